@@ -1,32 +1,98 @@
 # autocomplete.py
 
 import os
-import shlex
-import glob
+import bisect
 import readline
-from constants import command_options, aliases
+import cmdhash
+from constants import aliases
+from registry import command_options
+
+# Characters after which a new command starts
+COMMAND_SEPARATORS = '|;&('
+
+class PrefixIndex:
+    """A sorted array of names answering prefix queries with bisect."""
+
+    def __init__(self, names):
+        self.names = sorted(names)
+
+    def matches(self, prefix):
+        start = bisect.bisect_left(self.names, prefix)
+        end = bisect.bisect_left(self.names, prefix + '\U0010ffff', start)
+        return self.names[start:end]
+
+# Directory indexes keyed by path, each stored with the directory's mtime
+_dir_indexes = {}
+# PATH executables, keyed by the command hash's index they were built from
+_path_index = [None, None]
+# Candidates of the last (buffer, text) pair; readline asks for them one state at a time
+_last = [None, []]
+
+def directory_index(directory):
+    """Return the PrefixIndex of a directory, rebuilt only when its mtime changes."""
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return PrefixIndex([])
+    cached = _dir_indexes.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    try:
+        with os.scandir(directory) as entries:
+            index = PrefixIndex(entry.name for entry in entries)
+    except OSError:
+        index = PrefixIndex([])
+    _dir_indexes[directory] = (mtime, index)
+    return index
+
+def path_executables():
+    """Return a PrefixIndex of the executables found on PATH, shared with the command hash."""
+    commands = cmdhash.path_index()
+    if _path_index[0] is not commands:
+        _path_index[:] = [commands, PrefixIndex(commands)]
+    return _path_index[1]
+
+def complete_path(text):
+    """Complete a file name, listing the directory named in text from its cached index."""
+    directory, partial = os.path.split(text)
+    index = directory_index(os.path.expanduser(directory) or '.')
+    matches = index.matches(partial)
+    if not partial.startswith('.'):
+        matches = [name for name in matches if not name.startswith('.')]
+    if directory:
+        return [os.path.join(directory, name) for name in matches]
+    return matches
+
+def complete_command(text):
+    """Complete a command name: builtins, aliases, PATH executables and files."""
+    builtins = [name for name in command_options() if name.startswith(text)]
+    alias_names = [name for name in aliases if name.startswith(text)]
+    if '/' in text:
+        return complete_path(text)
+    seen = set(builtins) | set(alias_names)
+    externals = [name for name in path_executables().matches(text) if name not in seen]
+    return builtins + alias_names + externals + complete_path(text)
+
+def get_candidates(buffer, text, begidx):
+    """Return every completion of text at begidx within buffer, computed once per pair."""
+    if _last[0] == (buffer, text, begidx):
+        return _last[1]
+    before = buffer[:begidx].rstrip()
+    if not before or before[-1] in COMMAND_SEPARATORS:
+        candidates = complete_command(text)
+    else:
+        for separator in COMMAND_SEPARATORS:
+            before = before.rsplit(separator, 1)[-1]
+        words = before.split()
+        opts = command_options().get(words[0], []) if words else []
+        candidates = [opt for opt in opts if opt.startswith(text)] + complete_path(text)
+    _last[:] = [(buffer, text, begidx), candidates]
+    return candidates
 
 def autocomplete_commands(text, state):
     """Provide autocompletion for commands and files."""
-    buffer = readline.get_line_buffer()
-    tokens = shlex.split(buffer)
-    # Determine the context
-    if not tokens or buffer.endswith(' '):
-        # Suggest command names, aliases, or file names
-        options = list(command_options.keys()) + list(aliases.keys()) + os.listdir()
-    elif len(tokens) == 1:
-        options = [cmd for cmd in command_options if cmd.startswith(text)] + \
-                  [alias for alias in aliases if alias.startswith(text)] + \
-                  [f for f in os.listdir() if f.startswith(text)]
-    else:
-        # Suggest command options or file names
-        cmd = tokens[0]
-        if cmd in command_options:
-            opts = command_options[cmd]
-            options = [opt for opt in opts if opt.startswith(text)] + glob.glob(text + '*')
-        else:
-            options = glob.glob(text + '*')
+    candidates = get_candidates(readline.get_line_buffer(), text, readline.get_begidx())
     try:
-        return options[state]
+        return candidates[state]
     except IndexError:
         return None
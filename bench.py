@@ -0,0 +1,392 @@
+# bench.py
+
+import os
+import sys
+import json
+import time
+import select
+import argparse
+import platform
+import statistics
+import contextlib
+import tempfile
+import shutil
+import subprocess
+
+SHELL_DIR = os.path.dirname(os.path.abspath(__file__))
+# A run is a regression when a metric is worse than the baseline by more than this fraction
+DEFAULT_THRESHOLD = 0.15
+
+# Builtin-only lines, the kind found in rc files and sourced scripts
+DISPATCH_LINES = [
+    'cd .',
+    'export BENCH_VALUE=1',
+    'BENCH_OTHER="a b c"',
+    'echo "hello world" $HOME',
+    'pwd',
+]
+
+def bench_dispatch(iterations=20000):
+    """Measure parse+dispatch throughput of process_command, with and without the parse cache."""
+    import parser
+    from shell import process_command
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for label, clear_cache in (('uncached', True), ('cached', False)):
+            start = time.perf_counter()
+            for i in range(iterations):
+                if clear_cache:
+                    parser._compile.cache_clear()
+                process_command(DISPATCH_LINES[i % len(DISPATCH_LINES)])
+            elapsed = time.perf_counter() - start
+            results[f"{label}_lines_per_sec"] = round(iterations / elapsed)
+    return results
+
+def _isolated_env(home):
+    """Environment for child shells: no rc file, history or logs of the real user."""
+    env = dict(os.environ)
+    env.update(HOME=home, XDG_STATE_HOME=os.path.join(home, 'state'),
+               XDG_CACHE_HOME=os.path.join(home, 'cache'))
+    return env
+
+def bench_startup(runs=5):
+    """Measure the time from starting an interactive shell to its first prompt."""
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        env = _isolated_env(home)
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            process = subprocess.Popen([sys.executable, os.path.join(SHELL_DIR, 'main.py')],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL, cwd=home, env=env)
+            output = b''
+            while not output.endswith(b'$ '):
+                select.select([process.stdout], [], [], 10)
+                chunk = os.read(process.stdout.fileno(), 4096)
+                if not chunk:
+                    break
+                output += chunk
+            times.append(time.perf_counter() - start)
+            process.stdin.close()
+            process.stdout.read()
+            process.wait()
+        results['first_prompt_ms'] = round(statistics.median(times) * 1000, 1)
+    return results
+
+def bench_daemon(runs=20):
+    """Compare a command run through the daemon with starting 'main.py -c' for it."""
+    results = {}
+    with tempfile.TemporaryDirectory() as home:
+        env = _isolated_env(home)
+        path = os.path.join(home, 'shell.sock')
+        server = subprocess.Popen([sys.executable, os.path.join(SHELL_DIR, 'main.py'), '--serve', '--socket', path],
+                                  stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL, cwd=home, env=env)
+        try:
+            while not os.path.exists(path):
+                time.sleep(0.01)
+            cases = {
+                'client_ms': [sys.executable, '-S', os.path.join(SHELL_DIR, 'client.py'), '-s', path, 'true'],
+                'batch_ms': [sys.executable, os.path.join(SHELL_DIR, 'main.py'), '-c', 'true'],
+            }
+            for name, argv in cases.items():
+                times = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    subprocess.run(argv, cwd=home, env=env, stdout=subprocess.DEVNULL)
+                    times.append(time.perf_counter() - start)
+                results[name] = round(statistics.median(times) * 1000, 1)
+            sys.path.insert(0, SHELL_DIR)
+            import client
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                client.run('true', path=path)
+                times.append(time.perf_counter() - start)
+            results['round_trip_ms'] = round(statistics.median(times) * 1000, 2)
+        finally:
+            server.terminate()
+            server.wait()
+    return results
+
+@contextlib.contextmanager
+def _stdout_to_devnull():
+    """Point fd 1 and sys.stdout at /dev/null, for builtins and children alike."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        with open(os.devnull, 'w') as null, contextlib.redirect_stdout(null):
+            yield
+    finally:
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def bench_pipeline(megabytes=512, runs=200):
+    """Measure throughput of 'head | cat | wc' chains and the rate of short pipelines."""
+    from shell import process_command
+    results = {}
+    chains = {
+        'cat_wc': f"head -c {megabytes}M /dev/zero | cat | wc -c",
+        'cat3_wc': f"head -c {megabytes}M /dev/zero | cat | cat | cat | wc -c",
+    }
+    for name, line in chains.items():
+        with _stdout_to_devnull():
+            start = time.perf_counter()
+            process_command(line)
+            elapsed = time.perf_counter() - start
+        results[f"{name}_mb_per_sec"] = round(megabytes / elapsed)
+    # Short pipelines: builtins joined in-process, then the same through external tools
+    short = {
+        'builtin_echo_grep': 'echo hello | grep hello',
+        'external_echo_grep': f"{shutil.which('echo')} hello | {shutil.which('grep')} hello",
+    }
+    for name, line in short.items():
+        with _stdout_to_devnull():
+            start = time.perf_counter()
+            for _ in range(runs):
+                process_command(line)
+            elapsed = time.perf_counter() - start
+        results[f"{name}_per_sec"] = round(runs / elapsed)
+    return results
+
+def bench_completion(sizes=(1000, 10000, 100000)):
+    """Measure completion latency against directory size, cold and with a warm index."""
+    import autocomplete
+    results = {}
+    cwd = os.getcwd()
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            for i in range(size):
+                open(os.path.join(directory, f"file{i:06d}"), 'w').close()
+            os.chdir(directory)
+            try:
+                autocomplete._dir_indexes.clear()
+                for label in ('cold', 'warm'):
+                    autocomplete._last[0] = None
+                    start = time.perf_counter()
+                    state = 0
+                    while autocomplete.get_candidates('cat file00', 'file00', 4)[state:state + 1]:
+                        state += 1
+                    elapsed = time.perf_counter() - start
+                    results[f"{size}_files_{label}_ms"] = round(elapsed * 1000, 3)
+            finally:
+                os.chdir(cwd)
+    return results
+
+def _make_tree(root, directories=200, files=50, lines=200):
+    """Fill root with directories of small text files; every tenth file has a match."""
+    for d in range(directories):
+        directory = os.path.join(root, f"dir{d:03d}", "sub")
+        os.makedirs(directory)
+        for f in range(files):
+            with open(os.path.join(directory, f"file{f:03d}.txt"), 'w') as out:
+                out.write('lorem ipsum dolor sit amet\n' * lines)
+                if f % 10 == 0:
+                    out.write('needle in the haystack\n')
+
+def _time_builtin(function, args):
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        function(args)
+        return time.perf_counter() - start
+
+def _time_external(argv):
+    if shutil.which(argv[0]) is None:
+        return None
+    start = time.perf_counter()
+    subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def bench_search():
+    """Compare the find and grep builtins with the external tools on a generated tree."""
+    from search import builtin_find, builtin_grep
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        _make_tree(root)
+        cases = {
+            'find_name': (builtin_find, [root, '-name', '*5.txt'], ['find', root, '-name', '*5.txt']),
+            'grep_r': (builtin_grep, ['-r', 'needle', root], ['grep', '-r', 'needle', root]),
+            'grep_rc': (builtin_grep, ['-rc', 'ipsum', root], ['grep', '-rc', 'ipsum', root]),
+        }
+        for name, (function, args, argv) in cases.items():
+            results[f"{name}_builtin_ms"] = round(_time_builtin(function, args) * 1000, 1)
+            external = _time_external(argv)
+            if external is not None:
+                results[f"{name}_external_ms"] = round(external * 1000, 1)
+    return results
+
+def bench_expansion(size=100000, directories=100):
+    """Time brace ranges and a '**' glob of size words or files, against the glob module."""
+    import glob
+    from expansion import expand_words
+    results = {}
+    for name, word in (('brace_range', f"{{1..{size}}}"), ('brace_affixed', f"file{{1..{size}}}.txt")):
+        start = time.perf_counter()
+        expand_words([word])
+        results[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as root:
+        for d in range(directories):
+            directory = os.path.join(root, f"dir{d:03d}", "sub")
+            os.makedirs(directory)
+            for f in range(size // directories):
+                open(os.path.join(directory, f"file{f:04d}.txt"), 'w').close()
+        os.chdir(root)
+        try:
+            start = time.perf_counter()
+            expand_words(['**/*.txt'])
+            results['globstar_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            start = time.perf_counter()
+            sorted(glob.glob('**/*.txt', recursive=True))
+            results['globstar_glob_module_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        finally:
+            os.chdir(cwd)
+    return results
+
+# Builtin-only scripts for the interpreter benchmark, each running {n} iterations
+INTERPRETER_SCRIPTS = {
+    'while': 'i=0; while [ $i -lt {n} ]; do i=$((i+1)); done',
+    'for': 'for i in {{1..{n}}}; do x=$i; done',
+    'function': 'inc() {{ i=$((i+1)); }}\ni=0; for n in {{1..{n}}}; do inc; done',
+}
+
+def bench_interpreter(iterations=2000):
+    """Measure loop and function call throughput of the script interpreter."""
+    from interpreter import parse_script, run_body
+    results = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for name, script in INTERPRETER_SCRIPTS.items():
+            nodes = parse_script(script.format(n=iterations))
+            start = time.perf_counter()
+            run_body(nodes)
+            elapsed = time.perf_counter() - start
+            results[f"{name}_iterations_per_sec"] = round(iterations / elapsed)
+    return results
+
+def bench_watch(runs=10):
+    """Median delay from a file write to 'watch -e' noticing it, with inotify and with polling."""
+    import threading
+    from watch import PollingWatcher, InotifyWatcher, wait_for_changes
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        target = os.path.join(root, 'file.txt')
+        for name, make in (('inotify', InotifyWatcher), ('polling', PollingWatcher)):
+            watcher = make([root])
+            delays = []
+            try:
+                for i in range(runs):
+                    written = []
+
+                    def write():
+                        written.append(time.perf_counter())
+                        with open(target, 'w') as out:
+                            out.write(str(i))
+
+                    timer = threading.Timer(0.05 + 0.03 * i, write)
+                    timer.start()
+                    wait_for_changes(watcher, 0)
+                    delays.append(time.perf_counter() - written[0])
+                    timer.join()
+                    # The rest of the write's events must not end the next wait
+                    watcher.wait(0.2)
+            finally:
+                watcher.close()
+            results[f"{name}_latency_ms"] = round(statistics.median(delays) * 1000, 2)
+    return results
+
+def bench_files(directories=100, files=100, size=4096):
+    """Time ls -l, cp -r and rm -r on a generated tree of small files."""
+    from registry import lookup
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        tree = os.path.join(root, 'tree')
+        for d in range(directories):
+            directory = os.path.join(tree, f"dir{d:03d}")
+            os.makedirs(directory)
+            for f in range(files):
+                with open(os.path.join(directory, f"file{f:03d}"), 'wb') as out:
+                    out.write(b'x' * size)
+        flat = os.path.join(tree, 'dir000')
+        for f in range(files, 10000):
+            open(os.path.join(flat, f"file{f:05d}"), 'w').close()
+        steps = [
+            ('ls_l_10k', 'ls', ['-l', flat]),
+            ('ls_R', 'ls', ['-R', tree]),
+            ('cp_r', 'cp', ['-r', tree, os.path.join(root, 'copy')]),
+            ('rm_r', 'rm', ['-rf', os.path.join(root, 'copy')]),
+        ]
+        for name, command, args in steps:
+            with _stdout_to_devnull():
+                start = time.perf_counter()
+                lookup(command).run(args)
+                elapsed = time.perf_counter() - start
+            results[f"{name}_ms"] = round(elapsed * 1000, 1)
+    return results
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'daemon': bench_daemon,
+    'dispatch': bench_dispatch,
+    'pipeline': bench_pipeline,
+    'completion': bench_completion,
+    'expansion': bench_expansion,
+    'interpreter': bench_interpreter,
+    'watch': bench_watch,
+    'files': bench_files,
+    'search': bench_search,
+}
+
+def higher_is_better(metric):
+    return metric.endswith('_per_sec')
+
+def compare(results, baseline, threshold):
+    """Return (metric, baseline, current, change) for every metric worse than the threshold."""
+    regressions = []
+    for metric, value in results.items():
+        old = baseline.get(metric)
+        if not old or not isinstance(value, (int, float)):
+            continue
+        change = (value - old) / old
+        worse = -change if higher_is_better(metric) else change
+        if worse > threshold:
+            regressions.append((metric, old, value, change))
+    return regressions
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description='Benchmark the shell.')
+    arg_parser.add_argument('names', nargs='*', help=f"benchmarks to run: {', '.join(BENCHMARKS)}")
+    arg_parser.add_argument('--save', metavar='FILE', help='write the results as JSON')
+    arg_parser.add_argument('--compare', metavar='FILE', help='compare with the results saved in FILE')
+    arg_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                            help='fraction a metric may get worse before it is a regression')
+    options = arg_parser.parse_args(argv)
+    results = {}
+    for name in options.names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            print(f"Unknown benchmark: {name}")
+            return 2
+        for metric, value in BENCHMARKS[name]().items():
+            print(f"{name}.{metric}: {value}")
+            results[f"{name}.{metric}"] = value
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'cpus': os.cpu_count(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'results': results}, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, options.threshold)
+        for metric, old, value, change in regressions:
+            print(f"REGRESSION {metric}: {old} -> {value} ({change:+.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {options.threshold:.0%} against {options.compare}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# client.py
+
+import os
+import sys
+import struct
+import marshal
+# The C modules behind 'socket' and 'signal': the wrappers import enum, which
+# costs more than the whole request
+import _signal
+import _socket
+
+USAGE = """usage: python3 -S client.py [-s SOCKET] [-e NAME=VALUE]... [-E] command...
+
+Run a command in the shell daemon started with 'main.py --serve' and exit
+with its status. The arguments are joined into one command line, like ssh.
+The command runs in the current directory with this process's stdin,
+stdout and stderr. -e sets a variable for this command only; -E sends the
+whole environment.
+"""
+
+def socket_path():
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'custom_shell.sock')
+    return f"/tmp/custom_shell-{os.getuid()}.sock"
+
+def _recv_int(connection):
+    data = b''
+    while len(data) < 4:
+        chunk = connection.recv(4 - len(data))
+        if not chunk:
+            raise EOFError('daemon closed the connection')
+        data += chunk
+    return struct.unpack('!i', data)[0]
+
+def run(command, env=None, path=None):
+    """Send a command to the daemon and return its exit status."""
+    connection = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        connection.connect(path or socket_path())
+        # The environment and descriptors only go to a daemon run by this user
+        credentials = connection.getsockopt(_socket.SOL_SOCKET, _socket.SO_PEERCRED, struct.calcsize('3i'))
+        if struct.unpack('3i', credentials)[1] != os.getuid():
+            raise OSError('the daemon belongs to another user')
+        payload = marshal.dumps({'command': command, 'cwd': os.getcwd(), 'env': env or {}})
+        header = struct.pack('!I', len(payload))
+        fds = struct.pack('3i', 0, 1, 2)
+        connection.sendmsg([header], [(_socket.SOL_SOCKET, _socket.SCM_RIGHTS, fds)])
+        connection.sendall(payload)
+        pid = _recv_int(connection)
+
+        def forward(signum, frame):
+            # Ctrl-C and friends go to the command's whole process group in the daemon
+            os.killpg(pid, signum)
+
+        for signum in (_signal.SIGINT, _signal.SIGTERM, _signal.SIGHUP, _signal.SIGQUIT):
+            _signal.signal(signum, forward)
+        return _recv_int(connection)
+    finally:
+        connection.close()
+
+def main(argv):
+    env = {}
+    path = None
+    while argv and argv[0].startswith('-'):
+        arg = argv.pop(0)
+        if arg == '--':
+            break
+        if arg == '-E':
+            env.update(os.environ)
+        elif arg == '-e' and argv and '=' in argv[0]:
+            name, value = argv.pop(0).split('=', 1)
+            env[name] = value
+        elif arg == '-s' and argv:
+            path = argv.pop(0)
+        else:
+            sys.stderr.write(USAGE)
+            return 2
+    if not argv:
+        sys.stderr.write(USAGE)
+        return 2
+    try:
+        return run(' '.join(argv), env, path)
+    except (OSError, EOFError) as e:
+        sys.stderr.write(f"client: cannot reach the shell daemon: {e}\n")
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,84 @@
+# cmdhash.py
+
+import os
+
+# Resolved absolute paths by command name, like bash's command hash
+_table = {}
+# Number of times each hashed command was found in the table
+_hits = {}
+counters = {'hits': 0, 'misses': 0}
+# Every executable on PATH, built on demand for completion and reused by resolve()
+_index = {'key': None, 'path': None, 'commands': {}}
+
+def resolve(name, path=None):
+    """Return the absolute path of a command, or None if it is not on PATH.
+
+    Names containing a '/' are returned as they are. A custom ``path`` (from
+    a 'PATH=... cmd' assignment) bypasses the table.
+    """
+    if '/' in name:
+        return name
+    if path is not None:
+        import shutil
+        return shutil.which(name, path=path)
+    cached = _table.get(name)
+    if cached is not None:
+        counters['hits'] += 1
+        _hits[name] += 1
+        return cached
+    counters['misses'] += 1
+    resolved = None
+    if _index['path'] == os.environ.get('PATH', ''):
+        resolved = _index['commands'].get(name)
+    if resolved is None or not os.access(resolved, os.X_OK):
+        import shutil
+        resolved = shutil.which(name)
+    if resolved is not None:
+        _table[name] = resolved
+        _hits[name] = 0
+    return resolved
+
+def forget(name):
+    """Drop one command from the table, e.g. because its file disappeared."""
+    _table.pop(name, None)
+    _hits.pop(name, None)
+
+def clear():
+    """Forget every hashed command; called when PATH changes."""
+    _table.clear()
+    _hits.clear()
+    _index['key'] = None
+
+def entries():
+    """Return (hits, name, path) for every hashed command."""
+    return [(_hits[name], name, path) for name, path in _table.items()]
+
+def path_index():
+    """Return {name: path} for every executable on PATH, rebuilt when a PATH directory changes."""
+    path_value = os.environ.get('PATH', '')
+    directories = [d for d in path_value.split(os.pathsep) if d]
+    mtimes = []
+    for directory in directories:
+        try:
+            mtimes.append(os.stat(directory).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    key = (path_value, tuple(mtimes))
+    if _index['key'] == key:
+        return _index['commands']
+    commands = {}
+    for directory in directories:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name in commands:
+                        continue
+                    try:
+                        if entry.is_file() and os.access(entry.path, os.X_OK):
+                            commands[entry.name] = entry.path
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+    _index.update(key=key, path=path_value, commands=commands)
+    return commands
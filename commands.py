@@ -1,171 +1,59 @@
 # commands.py
 
 import os
-import stat
-import time
-import shutil
-import glob
-import subprocess
 import logging
-import shlex
-from constants import RED, GREEN, YELLOW, BLUE, CYAN, RESET, aliases
-from utils import confirm
-from jobs import jobs_list, Job
+import signal
+import sys
+from constants import RED, RESET, aliases, shell_state
+from substitution import expand_command, expand_word
+from expansion import ExpansionError
+from jobs import (
+    CHILD_DEFAULT_SIGNALS,
+    Job,
+    add_failed_stage,
+    add_job,
+    add_process,
+    give_terminal,
+    job_control_active,
+    wait_for,
+)
+import cmdhash
+from registry import resolve
 
 def change_directory(path):
     """Change the current working directory."""
-    path = os.path.expanduser(os.path.expandvars(path))
     try:
         os.chdir(path)
     except FileNotFoundError:
-        print(f"{RED}cd: No such directory: {path}{RESET}")
+        print(f"{RED}cd: No such directory: {path}{RESET}", file=sys.stderr)
+        return 1
     except NotADirectoryError:
-        print(f"{RED}cd: Not a directory: {path}{RESET}")
+        print(f"{RED}cd: Not a directory: {path}{RESET}", file=sys.stderr)
+        return 1
     except Exception as e:
         logging.error(f"cd: Error: {e}", exc_info=True)
-        print(f"{RED}cd: Error: {e}{RESET}")
-
-def list_files(detailed=False, all_files=False):
-    """List files in the current directory, with optional details and hidden files."""
-    try:
-        if all_files:
-            items = os.listdir('.')
-        else:
-            items = [item for item in os.listdir('.') if not item.startswith('.')]
-        for item in sorted(items):
-            if detailed:
-                stats = os.stat(item)
-                permissions = stat.filemode(stats.st_mode)
-                size = stats.st_size
-                mtime = time.strftime('%Y-%m-%d %H:%M', time.localtime(stats.st_mtime))
-                if os.path.isdir(item):
-                    item_type = BLUE + item + RESET
-                else:
-                    item_type = item
-                print(f"{permissions} {size:>8} {mtime} {item_type}")
-            else:
-                if os.path.isdir(item):
-                    print(f"{BLUE}{item}{RESET}")
-                else:
-                    print(item)
-    except Exception as e:
-        logging.error(f"ls: Error: {e}", exc_info=True)
-        print(f"{RED}ls: Error: {e}{RESET}")
+        print(f"{RED}cd: Error: {e}{RESET}", file=sys.stderr)
+        return 1
+    shell_state['cwd'] = None
+    return 0
 
 def make_directory(directory_name):
-    """Create a new directory."""
-    directory_name = os.path.expanduser(os.path.expandvars(directory_name))
+    """Create a new directory; return 0, or 1 if it could not be created."""
     try:
         os.makedirs(directory_name, exist_ok=False)
     except FileExistsError:
-        print(f"{RED}mkdir: Directory '{directory_name}' already exists.{RESET}")
+        print(f"{RED}mkdir: Directory '{directory_name}' already exists.{RESET}", file=sys.stderr)
+        return 1
     except Exception as e:
         logging.error(f"mkdir: Error: {e}", exc_info=True)
-        print(f"{RED}mkdir: Error: {e}{RESET}")
-
-def remove_item(patterns, recursive=False, force=False):
-    """Remove files or directories matching the given patterns."""
-    for pattern in patterns:
-        items = glob.glob(os.path.expanduser(os.path.expandvars(pattern)))
-        if not items and not force:
-            print(f"{RED}rm: No such file or directory: {pattern}{RESET}")
-            continue
-        for item_name in items:
-            try:
-                if os.path.isdir(item_name) and not os.path.islink(item_name):
-                    if recursive:
-                        if force or confirm(f"rm: remove directory '{item_name}' and its contents?"):
-                            shutil.rmtree(item_name)
-                    else:
-                        print(f"{RED}rm: cannot remove '{item_name}': Is a directory{RESET}")
-                else:
-                    if force or confirm(f"rm: remove file '{item_name}'?"):
-                        os.remove(item_name)
-            except Exception as e:
-                logging.error(f"rm: Error: {e}", exc_info=True)
-                print(f"{RED}rm: Error: {e}{RESET}")
-
-def copy_item(source, destination):
-    """Copy a file or directory."""
-    source = os.path.expanduser(os.path.expandvars(source))
-    destination = os.path.expanduser(os.path.expandvars(destination))
-    try:
-        if os.path.isdir(source):
-            shutil.copytree(source, destination)
-        else:
-            shutil.copy2(source, destination)
-    except Exception as e:
-        logging.error(f"cp: Error: {e}", exc_info=True)
-        print(f"{RED}cp: Error: {e}{RESET}")
-
-def move_item(source, destination):
-    """Move or rename a file or directory."""
-    source = os.path.expanduser(os.path.expandvars(source))
-    destination = os.path.expanduser(os.path.expandvars(destination))
-    try:
-        shutil.move(source, destination)
-    except Exception as e:
-        logging.error(f"mv: Error: {e}", exc_info=True)
-        print(f"{RED}mv: Error: {e}{RESET}")
+        print(f"{RED}mkdir: Error: {e}{RESET}", file=sys.stderr)
+        return 1
+    return 0
 
 def print_working_directory():
     """Print the current working directory."""
     print(os.getcwd())
 
-def display_help():
-    """Display help information."""
-    help_text = f"""
-{GREEN}Available commands:{RESET}
-  {CYAN}cd [path]{RESET}        Change the current directory to 'path'.
-  {CYAN}ls [-l] [-a]{RESET}     List files in the current directory. Use '-l' for detailed listing.
-  {CYAN}mkdir [name]{RESET}     Create a new directory named 'name'.
-  {CYAN}rm [options] [pattern]{RESET}
-                   Remove files or directories matching 'pattern'.
-                   Options:
-                     -r    Recursively remove directories and their contents.
-                     -f    Force removal without prompt.
-  {CYAN}cp [source] [dest]{RESET} Copy file or directory from 'source' to 'dest'.
-  {CYAN}mv [source] [dest]{RESET} Move or rename 'source' to 'dest'.
-  {CYAN}pwd{RESET}              Display the current working directory.
-  {CYAN}alias [name='command']{RESET}  Create an alias for a command.
-  {CYAN}unalias [name]{RESET}    Remove an alias.
-  {CYAN}export NAME=value{RESET} Set an environment variable.
-  {CYAN}echo [args]{RESET}       Display a line of text.
-  {CYAN}jobs{RESET}              List background jobs.
-  {CYAN}fg [job_id]{RESET}       Bring a background job to the foreground.
-  {CYAN}source [file]{RESET}     Execute commands from a file.
-  {CYAN}help [command]{RESET}    Display help information.
-  {CYAN}exit{RESET}              Exit the shell.
-
-You can also execute system commands and use pipelines and redirection.
-"""
-    print(help_text)
-
-# Help texts for individual commands
-command_help = {
-    'cd': 'Usage: cd [path]\nChange the current directory to [path].',
-    'ls': 'Usage: ls [-l] [-a]\nList directory contents.',
-    'mkdir': 'Usage: mkdir [directory]\nCreate a new directory.',
-    'rm': 'Usage: rm [options] [pattern]\nRemove files or directories.\nOptions:\n  -r  Recursively remove directories.\n  -f  Force removal without prompt.',
-    'cp': 'Usage: cp [source] [destination]\nCopy files or directories.',
-    'mv': 'Usage: mv [source] [destination]\nMove or rename files or directories.',
-    'pwd': 'Usage: pwd\nPrint the current working directory.',
-    'alias': 'Usage: alias [name=\'command\']\nCreate an alias for a command.',
-    'unalias': 'Usage: unalias [name]\nRemove an alias.',
-    'export': 'Usage: export NAME=value\nSet an environment variable.',
-    'echo': 'Usage: echo [arguments]\nDisplay a line of text.',
-    'jobs': 'Usage: jobs\nList background jobs.',
-    'fg': 'Usage: fg [job_id]\nBring a background job to the foreground.',
-    'source': 'Usage: source [file]\nExecute commands from a file.',
-    'help': 'Usage: help [command]\nDisplay help information.',
-    'exit': 'Usage: exit\nExit the shell.',
-}
-
-def display_command_help(command_name):
-    """Display help for a specific command."""
-    help_text = command_help.get(command_name, f"No help available for '{command_name}'.")
-    print(help_text)
-
 def set_alias(name, command):
     """Set an alias for a command."""
     aliases[name] = command
@@ -177,53 +65,310 @@ def remove_alias(name):
 def set_environment_variable(name, value):
     """Set an environment variable."""
     os.environ[name] = value
+    if name == 'PATH':
+        cmdhash.clear()
 
 def get_environment_variable(name):
     """Get an environment variable."""
     return os.environ.get(name, '')
 
-def execute_command(command_input):
-    """Execute a system command, supporting pipelines and redirection."""
+# Size of the chunks relayed when command output is captured
+CHUNK_SIZE = 64 * 1024
+
+def relay_output(fd, capture):
+    """Copy a pipe to ``capture`` in fixed-size chunks until EOF."""
+    while True:
+        chunk = os.read(fd, CHUNK_SIZE)
+        if not chunk:
+            break
+        capture.write(chunk)
+
+def open_redirects(redirects, fds, opened):
+    """Apply redirections to the fd map of a stage, in order.
+
+    Files are opened with os.open in the parent and handed to the child, which
+    dup2()s them into place, so no data ever flows through Python. Newly opened
+    descriptors are appended to ``opened`` so the caller can close them.
+    """
+    for redirect in redirects:
+        target = expand_word(redirect.target)
+        op = redirect.op
+        if redirect.fd not in fds:
+            raise OSError(f"unsupported file descriptor: {redirect.fd}")
+        if op in ('>&', '<&') and (target.isdigit() or target == '-'):
+            if target == '-':
+                fds[redirect.fd] = None
+            elif int(target) in fds:
+                fds[redirect.fd] = fds[int(target)]
+            else:
+                raise OSError(f"bad file descriptor: {target}")
+            continue
+        if op == '<':
+            fd = os.open(target, os.O_RDONLY)
+        elif op in ('>>', '&>>'):
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+        else:
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        opened.append(fd)
+        if op in ('&>', '&>>', '>&'):
+            fds[1] = fds[2] = fd
+        else:
+            fds[redirect.fd] = fd
+
+def close_descriptors(fds):
+    """Close every descriptor in the list, ignoring ones already closed."""
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+    fds.clear()
+
+class CommandNotFound(Exception):
+    """Raised when argv[0] is not a path and cannot be found on PATH."""
+
+def spawn_actions(fds):
+    """Turn a stage's fd map into posix_spawn file actions."""
+    actions = []
+    # Copies of the shell's own 0/1/2 go first, before anything is dup2()'d over them
+    for target in sorted(fds, key=lambda target: fds[target] not in (0, 1, 2)):
+        fd = fds[target]
+        if fd is None:
+            actions.append((os.POSIX_SPAWN_CLOSE, target))
+        elif fd != target:
+            actions.append((os.POSIX_SPAWN_DUP2, fd, target))
+    return actions
+
+def spawn(argv, fds, env=None, pgid=None):
+    """Start one pipeline stage and return its pid.
+
+    argv[0] is resolved through the command hash. ``pgid`` puts the child in a
+    process group (0 starts a new one) and job-control signals are reset to
+    their defaults, since the shell itself ignores some of them.
+    """
+    path = env.get('PATH') if env is not None and env.get('PATH') != os.environ.get('PATH') else None
+    executable = cmdhash.resolve(argv[0], path)
+    if executable is None:
+        raise CommandNotFound(argv[0])
+    options = {
+        'file_actions': spawn_actions(fds),
+        'setsigdef': CHILD_DEFAULT_SIGNALS,
+    }
+    if pgid is not None:
+        options['setpgroup'] = pgid
+    env = os.environ if env is None else env
     try:
-        # Parse the command for pipelines
-        commands = [shlex.split(cmd) for cmd in command_input.split('|')]
-        num_commands = len(commands)
-        processes = []
-        for i in range(num_commands):
-            stdin = processes[i - 1].stdout if i > 0 else None
-            stdout = subprocess.PIPE if i < num_commands - 1 else None
-            proc = subprocess.Popen(
-                commands[i],
-                stdin=stdin,
-                stdout=stdout or subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            processes.append(proc)
-        # Wait for the last process to complete
-        output, errors = processes[-1].communicate()
-        if output:
-            print(output.decode())
-        if errors:
-            print(errors.decode())
-        return processes[-1].returncode
-    except FileNotFoundError:
-        command_name = commands[0][0] if commands and commands[0] else command_input
-        logging.error(f"Command not found: {command_name}", exc_info=True)
-        print(f"{RED}Command not found: {command_name}{RESET}")
-        return 127
-    except Exception as e:
+        return os.posix_spawn(executable, argv, env, **options)
+    except FileNotFoundError as e:
+        if e.filename != executable or path is not None or '/' in argv[0]:
+            raise
+    # The hashed file went away since it was looked up; search PATH again
+    cmdhash.forget(argv[0])
+    executable = cmdhash.resolve(argv[0])
+    if executable is None:
+        raise CommandNotFound(argv[0])
+    return os.posix_spawn(executable, argv, env, **options)
+
+def fork_shell(run, fds, pgid=None, env=None, close=()):
+    """Call run() in a forked copy of the shell, a subshell, and return its pid.
+
+    The subshell exits with the status run() returns. Whatever it changes
+    (cwd, variables, aliases) stays in the copy. This is how command
+    substitutions run, and builtins that change the shell's state when they
+    are not the last stage of a pipeline or are started with '&': the copy
+    is a process like any other stage, so jobs, kill, fg and wait handle it.
+    ``close`` lists descriptors the copy must not keep, such as the ends of
+    other pipes it would otherwise hold open.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid:
+        if pgid is not None:
+            try:
+                os.setpgid(pid, pgid or pid)
+            except OSError:
+                # The child got there first, or has exited already
+                pass
+        return pid
+    status = 1
+    try:
+        if pgid is not None:
+            os.setpgid(0, pgid)
+        for signum in CHILD_DEFAULT_SIGNALS:
+            signal.signal(signum, signal.SIG_DFL)
+        for action in spawn_actions(fds):
+            if action[0] == os.POSIX_SPAWN_CLOSE:
+                os.close(action[1])
+            else:
+                os.dup2(action[1], action[2])
+        for fd in close:
+            os.close(fd)
+        # New streams on the new 0, 1 and 2: the shell's may be routed to
+        # stages or locked by threads that do not exist in the copy
+        sys.stdin = open(0, 'r', closefd=False, errors='surrogateescape')
+        sys.stdout = open(1, 'w', closefd=False, errors='surrogateescape')
+        sys.stderr = open(2, 'w', closefd=False, errors='backslashreplace')
+        shell_state['interactive'] = False
+        os.environ.update(env or {})
+        status = run()
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 0
+    except KeyboardInterrupt:
+        status = 128 + signal.SIGINT
+    except BaseException as e:
         logging.error(f"Error executing command: {e}", exc_info=True)
-        print(f"{RED}Error executing command: {e}{RESET}")
-        return 1
+        print(f"{RED}Error executing command: {e}{RESET}", file=sys.stderr)
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+        from logs import stop_logging
+        stop_logging()
+        os._exit(status & 0xff)
 
-def execute_script(file_path, process_command):
-    """Execute commands from a script file."""
+def describe_pipeline(pipeline):
+    """Return the command text of a pipeline, for the job table."""
+    return ' | '.join(' '.join(command.words) for command in pipeline.commands)
+
+def run_pipeline(pipeline, capture=None, command_text=None, first_argv=None, stdin=0):
+    """Run a parsed Pipeline and return the exit status of its last stage.
+
+    The external stages form one job. Background pipelines get their own
+    process group and return at once; foreground ones are waited for through
+    the job table, and get their own group and the terminal when job control
+    is on. In the foreground, stateless builtins and the last stage run in
+    threads of the shell: two adjacent ones are joined by an in-process
+    Pipe, anything else by an OS pipe, so a pipeline of such builtins starts
+    no process at all. Other builtin stages run in subshells, so that
+    'cd /tmp | cat' leaves the shell where it is. ``first_argv`` is the already expanded first stage;
+    ``stdin`` is the descriptor the first stage reads, left open. Pass a
+    binary file-like object as ``capture`` to receive the output of the last
+    stage instead of the terminal.
+    """
     try:
-        with open(file_path, 'r') as script_file:
-            for line in script_file:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    process_command(line)
+        argvs = [first_argv if i == 0 and first_argv is not None else expand_command(command)
+                 for i, command in enumerate(pipeline.commands)]
+    except ExpansionError as e:
+        print(f"{RED}{e}{RESET}", file=sys.stderr)
+        return 1
     except Exception as e:
-        logging.error(f"Error executing script: {e}", exc_info=True)
-        print(f"{RED}Error executing script: {e}{RESET}")
+        logging.error(f"Error executing command: {e}", exc_info=True)
+        print(f"{RED}Error executing command: {e}{RESET}", file=sys.stderr)
+        return 1
+    builtins = [None if not argv else resolve(argv) for argv in argvs]
+    if pipeline.background:
+        # Only builtins that can run in a forked shell; for the others the system tool runs
+        builtins = [builtin if getattr(builtin, 'background', False) else None for builtin in builtins]
+    num_commands = len(pipeline.commands)
+    threaded = [builtin is not None and not pipeline.background
+                and (i == num_commands - 1 or getattr(builtin, 'stateless', False))
+                for i, builtin in enumerate(builtins)]
+    if any(threaded):
+        from streams import BuiltinStage, Pipe, stage_streams
+    job = Job(command_text or describe_pipeline(pipeline))
+    new_group = pipeline.background or job_control_active()
+    stages = []
+    last_stage = None
+    capture_read = None
+    stdin_fd = stdin
+    # Anything printed by the shell must reach the terminal before the children write
+    sys.stdout.flush()
+    for i, command in enumerate(pipeline.commands):
+        opened = []
+        builtin = builtins[i]
+        if i < num_commands - 1 and threaded[i] and threaded[i + 1]:
+            pipe = Pipe()
+            next_stdin, stdout_fd = pipe.reader, pipe.writer
+        elif i < num_commands - 1:
+            next_stdin, stdout_fd = os.pipe()
+            opened.append(stdout_fd)
+        elif capture is not None:
+            capture_read, stdout_fd = os.pipe()
+            opened.append(stdout_fd)
+            next_stdin = None
+        else:
+            stdout_fd = 1
+            next_stdin = None
+        if isinstance(stdin_fd, int) and stdin_fd not in (0, stdin):
+            opened.append(stdin_fd)
+        fds = {0: stdin_fd, 1: stdout_fd, 2: 2}
+        argv = argvs[i]
+        spawning = False
+        stage = None
+        try:
+            open_redirects(command.redirects, fds, opened)
+            if threaded[i]:
+                stage = BuiltinStage(builtin, argv[1:], *stage_streams(fds))
+                stage.start()
+                stages.append(stage)
+                if i == num_commands - 1:
+                    last_stage = stage
+            elif argv:
+                env = None
+                if command.assignments:
+                    env = dict(os.environ)
+                    for name, value in command.assignments:
+                        env[name] = expand_word(value)
+                spawning = True
+                pgid = (job.pgid or 0) if new_group else None
+                if builtin:
+                    pid = fork_shell(lambda: builtin.run(argv[1:]), fds, pgid, env)
+                else:
+                    pid = spawn(argv, fds, env, pgid)
+                if new_group and job.pgid is None:
+                    job.pgid = pid
+                    # Hand over the terminal before the job can try to read from it
+                    if not pipeline.background:
+                        give_terminal(job)
+                add_process(job, pid)
+            else:
+                add_failed_stage(job, 0)
+        except CommandNotFound:
+            logging.error(f"Command not found: {argv[0]}")
+            print(f"{RED}Command not found: {argv[0]}{RESET}", file=sys.stderr)
+            add_failed_stage(job, 127)
+        except FileNotFoundError as e:
+            print(f"{RED}{e.filename}: No such file or directory{RESET}", file=sys.stderr)
+            add_failed_stage(job, 127 if spawning else 1)
+        except PermissionError as e:
+            print(f"{RED}{e.filename}: Permission denied{RESET}", file=sys.stderr)
+            add_failed_stage(job, 126 if spawning else 1)
+        except Exception as e:
+            logging.error(f"Error executing command: {e}", exc_info=True)
+            print(f"{RED}Error executing command: {e}{RESET}", file=sys.stderr)
+            add_failed_stage(job, 1)
+        finally:
+            # The children and builtin stages hold their own copies now
+            close_descriptors(opened)
+            for end in (stdin_fd, stdout_fd):
+                # In-process pipe ends this stage does not use (redirected, or it failed) end here
+                if not isinstance(end, int) and (stage is None or end not in stage.owned):
+                    end.close()
+        stdin_fd = next_stdin
+    if pipeline.background:
+        if job.pgid is None:
+            return job.exit_status
+        add_job(job)
+        print(f"[{job.job_id}] {job.pgid}")
+        return 0
+    if capture_read is not None:
+        try:
+            relay_output(capture_read, capture)
+        except BrokenPipeError:
+            # The reader is gone; closing our end stops the stages writing to it too
+            pass
+        finally:
+            os.close(capture_read)
+    try:
+        status = wait_for(job, foreground=True) if job.stages else 0
+        for stage in stages:
+            stage.wait()
+    except KeyboardInterrupt:
+        # Closing every in-process pipe makes the builtin stages run out of input or hit EPIPE
+        for stage in stages:
+            stage.close()
+        raise
+    return status if last_stage is None else last_stage.status
@@ -11,29 +11,46 @@ MAGENTA = '\033[95m'
 CYAN = '\033[96m'
 RESET = '\033[0m'
 
-# Command options for autocompletion
-command_options = {
-    'ls': ['-l', '-a'],
-    'rm': ['-r', '-f'],
-    'help': [],
-    'cd': [],
-    'mkdir': [],
-    'cp': [],
-    'mv': [],
-    'pwd': [],
-    'exit': [],
-    'alias': [],
-    'unalias': [],
-    'export': [],
-    'echo': [],
-    'jobs': [],
-    'fg': [],
-    'bg': [],
-    'source': [],
-}
+class AliasTable(dict):
+    """Alias dictionary that counts its modifications, so parsed lines can be cached per version."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+
+    def __setitem__(self, name, value):
+        super().__setitem__(name, value)
+        self.version += 1
+
+    def __delitem__(self, name):
+        super().__delitem__(name)
+        self.version += 1
+
+    def pop(self, name, *default):
+        self.version += 1
+        return super().pop(name, *default)
+
+    def clear(self):
+        super().clear()
+        self.version += 1
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self.version += 1
 
 # Aliases dictionary
-aliases = {}
+aliases = AliasTable()
+
+# Mutable state shared by the modules of a running shell
+shell_state = {
+    'interactive': False,
+    'last_status': 0,
+    # Working directory shown in the prompt; reset to None by 'cd'
+    'cwd': None,
+    # $0 and the positional parameters $1, $2...
+    'name': 'custom_shell',
+    'positional': [],
+}
 
 # Check OS type
 IS_WINDOWS = os.name == 'nt'
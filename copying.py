@@ -0,0 +1,407 @@
+# copying.py
+
+import os
+import sys
+import stat
+import time
+import errno
+import fcntl
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from constants import RED, RESET
+from progress import Progress, format_size
+from removal import Removal, remove_tree
+
+# Files copied at the same time
+MAX_WORKERS = 8
+# Bytes moved per copy_file_range/sendfile call, so progress keeps moving on big files
+COPY_CHUNK = 64 * 1024 * 1024
+# ioctl cloning a whole file on filesystems with shared extents (btrfs, XFS)
+FICLONE = 0x40049409
+# Errors meaning a zero-copy method does not work between these two files
+UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY,
+               errno.EBADF, errno.EPERM}
+
+class Transfer:
+    """Options, counters and worker pool of one 'cp' or 'mv' run."""
+
+    def __init__(self, name, no_clobber=False, update=False, resume=False, progress=False,
+                 workers=MAX_WORKERS):
+        self.name = name
+        self.no_clobber = no_clobber
+        self.update = update
+        self.resume = resume
+        self.progress = progress
+        self.files = 0
+        self.copied = 0
+        self.skipped = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        # (method, source device, destination device) pairs a method failed on
+        self.unsupported = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) if workers > 1 else None
+        # Bounds the queued files so a huge tree is not held in memory at once
+        self._slots = threading.Semaphore(workers * 4)
+        self._pending = set()
+        self._progress = Progress(self.status_line)
+
+    def count(self, files=0, copied=0, skipped=0):
+        with self._lock:
+            self.files += files
+            self.copied += copied
+            self.skipped += skipped
+
+    def fail(self, path, error):
+        with self._lock:
+            self.errors += 1
+        logging.error(f"{self.name}: cannot copy '{path}': {error}")
+        reason = error.strerror if isinstance(error, OSError) and error.strerror else error
+        print(f"{RED}{self.name}: cannot copy '{path}': {reason}{RESET}", file=sys.stderr)
+
+    def submit(self, function, source, *args):
+        """Run function(source, ...) on the pool, reporting errors against source."""
+        if self._executor is None:
+            self._run(function, source, *args)
+            return
+        self._slots.acquire()
+        future = self._executor.submit(self._run, function, source, *args)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _run(self, function, source, *args):
+        try:
+            function(source, *args)
+        except OSError as e:
+            self.fail(source, e)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
+
+    def wait(self):
+        """Block until every submitted file is copied."""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                return
+            for future in pending:
+                future.result()
+
+    def start_reporting(self):
+        if self.progress:
+            self._progress.start()
+
+    def status_line(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"copied {self.files} files, {format_size(self.copied)} "
+                f"({format_size(self.copied / elapsed)}/s), skipped {self.skipped}")
+
+    def finish(self):
+        self.wait()
+        self._progress.stop()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self.progress:
+            elapsed = time.monotonic() - self.started
+            print(f"{self.status_line()} in {elapsed:.2f}s")
+
+def _copy_data(source_fd, destination_fd, offset, size, devices, transfer):
+    """Copy bytes from offset to size, by reflink, copy_file_range, sendfile or read/write."""
+    if offset == 0 and size and ('reflink', devices) not in transfer.unsupported:
+        try:
+            fcntl.ioctl(destination_fd, FICLONE, source_fd)
+            transfer.count(copied=size)
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED:
+                raise
+            transfer.unsupported.add(('reflink', devices))
+    if ('copy_file_range', devices) not in transfer.unsupported:
+        try:
+            while offset < size:
+                copied = os.copy_file_range(source_fd, destination_fd, min(COPY_CHUNK, size - offset),
+                                            offset, offset)
+                if copied == 0:
+                    return
+                offset += copied
+                transfer.count(copied=copied)
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED:
+                raise
+            transfer.unsupported.add(('copy_file_range', devices))
+    os.lseek(destination_fd, offset, os.SEEK_SET)
+    if ('sendfile', devices) not in transfer.unsupported:
+        try:
+            while offset < size:
+                copied = os.sendfile(destination_fd, source_fd, offset, min(COPY_CHUNK, size - offset))
+                if copied == 0:
+                    return
+                offset += copied
+                transfer.count(copied=copied)
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED:
+                raise
+            transfer.unsupported.add(('sendfile', devices))
+    while offset < size:
+        data = os.pread(source_fd, min(1024 * 1024, size - offset), offset)
+        if not data:
+            return
+        view = memoryview(data)
+        while view:
+            written = os.write(destination_fd, view)
+            view = view[written:]
+        offset += len(data)
+        transfer.count(copied=len(data))
+
+def _skip(source_stats, destination, transfer, follow_symlinks=True):
+    """Return (skip, resume offset) for a destination that may already exist."""
+    try:
+        existing = os.stat(destination, follow_symlinks=follow_symlinks)
+    except FileNotFoundError:
+        return False, 0
+    if transfer.no_clobber:
+        return True, 0
+    if transfer.update and existing.st_mtime_ns >= source_stats.st_mtime_ns:
+        return True, 0
+    if transfer.resume and (stat.S_ISREG(existing.st_mode) or not follow_symlinks):
+        # The mtime is copied last, so a matching one marks a finished file
+        if (existing.st_size == source_stats.st_size
+                and existing.st_mtime_ns == source_stats.st_mtime_ns):
+            return True, 0
+        if existing.st_size < source_stats.st_size:
+            return False, existing.st_size
+    return False, 0
+
+def copy_file(source, destination, source_stats, transfer):
+    """Copy one regular file with its permissions and timestamps."""
+    skip, offset = _skip(source_stats, destination, transfer)
+    if skip:
+        transfer.count(skipped=1)
+        return
+    source_fd = os.open(source, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        flags = os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC | (0 if offset else os.O_TRUNC)
+        destination_fd = os.open(destination, flags, stat.S_IMODE(source_stats.st_mode) | stat.S_IWUSR)
+        try:
+            size = os.fstat(source_fd).st_size
+            devices = (source_stats.st_dev, os.fstat(destination_fd).st_dev)
+            _copy_data(source_fd, destination_fd, offset, size, devices, transfer)
+        finally:
+            os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+    shutil.copystat(source, destination)
+    transfer.count(files=1)
+
+def copy_special(source, destination, source_stats, transfer):
+    """Recreate a symlink or FIFO instead of copying what it points to."""
+    if os.path.lexists(destination):
+        skip, _ = _skip(source_stats, destination, transfer, follow_symlinks=False)
+        if skip:
+            transfer.count(skipped=1)
+            return
+        os.unlink(destination)
+    if stat.S_ISLNK(source_stats.st_mode):
+        os.symlink(os.readlink(source), destination)
+    elif stat.S_ISFIFO(source_stats.st_mode):
+        os.mkfifo(destination, stat.S_IMODE(source_stats.st_mode))
+    else:
+        raise OSError(errno.EINVAL, 'cannot copy special file')
+    shutil.copystat(source, destination, follow_symlinks=False)
+    transfer.count(files=1)
+
+def _copy_entry(source, destination, source_stats, transfer):
+    if stat.S_ISREG(source_stats.st_mode):
+        transfer.submit(copy_file, source, destination, source_stats, transfer)
+    else:
+        transfer.submit(copy_special, source, destination, source_stats, transfer)
+
+def copy_tree(source, destination, transfer):
+    """Copy a directory tree; files are copied on the pool while the walk goes on."""
+    directories = []
+    stack = [(source, destination)]
+    while stack:
+        source_dir, destination_dir = stack.pop()
+        try:
+            os.mkdir(destination_dir, 0o700)
+        except FileExistsError:
+            if not os.path.isdir(destination_dir):
+                transfer.fail(source_dir, OSError(errno.EEXIST, 'File exists', destination_dir))
+                continue
+        except OSError as e:
+            transfer.fail(source_dir, e)
+            continue
+        directories.append((source_dir, destination_dir))
+        try:
+            with os.scandir(source_dir) as entries:
+                for entry in entries:
+                    target = os.path.join(destination_dir, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, target))
+                    else:
+                        _copy_entry(entry.path, target, entry.stat(follow_symlinks=False), transfer)
+        except OSError as e:
+            transfer.fail(source_dir, e)
+    transfer.wait()
+    # Directory times change while files are added, so they are set once everything is in
+    for source_dir, destination_dir in reversed(directories):
+        try:
+            shutil.copystat(source_dir, destination_dir)
+        except OSError as e:
+            transfer.fail(source_dir, e)
+
+def copy_path(source, destination, recursive, transfer):
+    """Copy one source operand to its final destination path."""
+    source_stats = os.lstat(source)
+    if stat.S_ISDIR(source_stats.st_mode):
+        if not recursive:
+            print(f"{RED}{transfer.name}: -r not specified; omitting directory '{source}'{RESET}", file=sys.stderr)
+            return 1
+        real_source = os.path.realpath(source)
+        real_destination = os.path.realpath(destination)
+        if os.path.commonpath([real_source, real_destination]) == real_source:
+            print(f"{RED}{transfer.name}: cannot copy a directory, '{source}', into itself{RESET}", file=sys.stderr)
+            return 1
+        copy_tree(source, destination, transfer)
+    else:
+        if os.path.exists(destination) and os.path.samefile(source, destination):
+            print(f"{RED}{transfer.name}: '{source}' and '{destination}' are the same file{RESET}", file=sys.stderr)
+            return 1
+        _copy_entry(source, destination, source_stats, transfer)
+    return 0
+
+def _targets(operands, name):
+    """Pair each source with its destination, like cp and mv: 'src dest' or 'src... dir'."""
+    *sources, destination = operands
+    if os.path.isdir(destination):
+        # 'dir/.' names the contents of dir, so they land in destination itself
+        return [(source, os.path.join(destination, os.path.basename(source.rstrip('/'))))
+                for source in sources]
+    if len(sources) > 1:
+        print(f"{RED}{name}: target '{destination}' is not a directory{RESET}", file=sys.stderr)
+        return None
+    return [(sources[0], destination)]
+
+def copy_item(operands, recursive=False, **options):
+    """Copy files or directories; return the exit status."""
+    pairs = _targets(operands, 'cp')
+    if pairs is None:
+        return 1
+    transfer = Transfer('cp', **options)
+    transfer.start_reporting()
+    status = 0
+    try:
+        for source, destination in pairs:
+            try:
+                status = copy_path(source, destination, recursive, transfer) or status
+            except OSError as e:
+                transfer.fail(source, e)
+    finally:
+        transfer.finish()
+    return 1 if transfer.errors else status
+
+def move_item(operands, **options):
+    """Move or rename files; across filesystems copy with the engine, then delete the source."""
+    pairs = _targets(operands, 'mv')
+    if pairs is None:
+        return 1
+    transfer = Transfer('mv', **options)
+    transfer.start_reporting()
+    status = 0
+    try:
+        for source, destination in pairs:
+            if os.path.lexists(destination):
+                skip, _ = _skip(os.lstat(source), destination, transfer) if os.path.lexists(source) else (False, 0)
+                if skip:
+                    transfer.count(skipped=1)
+                    continue
+            try:
+                os.rename(source, destination)
+                transfer.count(files=1)
+                continue
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    logging.error(f"mv: Error: {e}", exc_info=True)
+                    print(f"{RED}mv: cannot move '{source}' to '{destination}': {e.strerror}{RESET}", file=sys.stderr)
+                    status = 1
+                    continue
+            errors = transfer.errors
+            try:
+                if copy_path(source, destination, True, transfer):
+                    status = 1
+                    continue
+                transfer.wait()
+            except OSError as e:
+                transfer.fail(source, e)
+            if transfer.errors != errors:
+                print(f"{RED}mv: keeping '{source}' because it was not copied completely{RESET}", file=sys.stderr)
+                continue
+            if os.path.isdir(source) and not os.path.islink(source):
+                removal = Removal()
+                remove_tree(source, removal)
+                removal.finish()
+                status = 1 if removal.errors else status
+            else:
+                os.unlink(source)
+    finally:
+        transfer.finish()
+    return 1 if transfer.errors else status
+
+def _parse_options(name, args, flags):
+    """Parse the options shared by cp and mv; return (options, operands) or None."""
+    options = {}
+    operands = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in ('-v', '--progress'):
+            options['progress'] = True
+        elif arg == '--resume' and 'r' in flags:
+            options['resume'] = True
+        elif arg == '-j':
+            try:
+                options['workers'] = max(1, int(args.pop(0)))
+            except (IndexError, ValueError):
+                print(f"{RED}{name}: -j needs a number of threads{RESET}", file=sys.stderr)
+                return None
+        elif arg.startswith('-') and len(arg) > 1:
+            for flag in arg[1:]:
+                if flag not in flags:
+                    print(f"{RED}{name}: invalid option -- '{flag}'{RESET}", file=sys.stderr)
+                    return None
+                if flag in 'rR':
+                    options['recursive'] = True
+                elif flag == 'n':
+                    options['no_clobber'] = True
+                elif flag == 'u':
+                    options['update'] = True
+                elif flag == 'v':
+                    options['progress'] = True
+        else:
+            operands.append(arg)
+    if len(operands) < 2:
+        print(f"{RED}{name}: missing file operand{RESET}", file=sys.stderr)
+        return None
+    return options, operands
+
+def builtin_cp(args):
+    parsed = _parse_options('cp', args, 'rRnuv')
+    if parsed is None:
+        return 1
+    options, operands = parsed
+    return copy_item(operands, **options)
+
+def builtin_mv(args):
+    parsed = _parse_options('mv', args, 'nuv')
+    if parsed is None:
+        return 1
+    options, operands = parsed
+    return move_item(operands, **options)
@@ -0,0 +1,848 @@
+# expansion.py
+
+import os
+import re
+from functools import lru_cache
+from constants import shell_state
+from parser import skip_backticks, skip_double_quotes, skip_parameter, skip_single_quotes, skip_substitution
+import cmdhash
+
+# Field separators when IFS is unset
+DEFAULT_IFS = ' \t\n'
+# Nesting limit for variables whose value is itself an arithmetic expression
+MAX_ARITHMETIC_DEPTH = 32
+# Results of arithmetic wrap around like the 64-bit integers of other shells
+INT_BITS = 64
+
+# Kinds of the pieces a word is scanned into
+LITERAL = 'literal'   # unquoted text of the word itself: globbed, never split
+QUOTED = 'quoted'     # quoted text and tilde results: neither globbed nor split
+SPLIT = 'split'       # unquoted expansion results: split into fields, then globbed
+BREAK = 'break'       # a field boundary inside a quoted "$@"
+
+_NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+# Anything that needs the full scanner; words without these are already final
+_SPECIAL = re.compile(r'[\\\'"$~*?\[]')
+_UNQUOTED_SPECIAL = re.compile(r'[\\\'"$]')
+_DOUBLE_SPECIAL = re.compile(r'[\\"$]')
+_GLOB_SPECIAL = re.compile(r'[\\*?\[\]]')
+_INT_SEQUENCE = re.compile(r'(-?\d+)\.\.(-?\d+)(?:\.\.(-?\d+))?')
+_CHAR_SEQUENCE = re.compile(r'([A-Za-z])\.\.([A-Za-z])(?:\.\.(-?\d+))?')
+
+class ExpansionError(Exception):
+    """Raised when a word cannot be expanded, e.g. '${x:?}' with x unset or bad arithmetic."""
+
+# Variables
+
+def get_variable(name):
+    """Return the value of a variable or special parameter, or None when it is unset."""
+    if name.isdigit():
+        if name == '0':
+            return shell_state['name']
+        index = int(name) - 1
+        positional = shell_state['positional']
+        return positional[index] if index < len(positional) else None
+    if name == '?':
+        return str(shell_state['last_status'])
+    if name == '$':
+        return str(os.getpid())
+    if name == '#':
+        return str(len(shell_state['positional']))
+    if name == '@' or name == '*':
+        return ' '.join(shell_state['positional'])
+    return os.environ.get(name)
+
+def set_variable(name, value):
+    os.environ[name] = value
+    if name == 'PATH':
+        cmdhash.clear()
+
+# Brace expansion
+
+def expand_braces(word):
+    """Yield the words a raw word brace-expands to, lazily and in order.
+
+    '{a,b}' yields one word per alternative and '{1..N}' or '{a..z}' one per
+    step of the sequence; braces may nest. A range is produced on demand, so
+    '{1..100000}' never exists as a list.
+    """
+    found = _find_brace(word)
+    if found is None:
+        yield word
+        return
+    start, end, alternatives = found
+    prefix = word[:start]
+    suffix = word[end:]
+    # The suffix is reused for every alternative, so its variants are kept
+    suffixes = list(expand_braces(suffix)) if '{' in suffix else [suffix]
+    if not isinstance(alternatives, list) and len(suffixes) == 1:
+        # A sequence: its words hold no braces, and '{1..N}' alone is the sequence itself
+        tail = suffixes[0]
+        if prefix or tail:
+            yield from (prefix + middle + tail for middle in alternatives)
+        else:
+            yield from alternatives
+        return
+    for alternative in alternatives:
+        middles = expand_braces(alternative) if '{' in alternative else (alternative,)
+        for middle in middles:
+            for tail in suffixes:
+                yield prefix + middle + tail
+
+def _find_brace(word):
+    """Return (start, end, alternatives) for the first expandable brace of a word, or None."""
+    n = len(word)
+    i = 0
+    while i < n:
+        c = word[i]
+        if c == '\\':
+            i += 2
+        elif c == "'":
+            i = skip_single_quotes(word, i)
+        elif c == '"':
+            i = skip_double_quotes(word, i)
+        elif c == '`':
+            i = skip_backticks(word, i)
+        elif c == '$' and word.startswith('${', i):
+            i = skip_parameter(word, i)
+        elif c == '$' and word.startswith('$(', i):
+            i = skip_substitution(word, i)
+        elif c == '{':
+            found = _brace_body(word, i)
+            if found is not None:
+                return (i,) + found
+            i += 1
+        else:
+            i += 1
+    return None
+
+def _brace_body(word, start):
+    """Return (end, alternatives) for the brace at start, or None if it does not expand."""
+    n = len(word)
+    depth = 0
+    commas = []
+    i = start + 1
+    while i < n:
+        c = word[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == "'":
+            i = skip_single_quotes(word, i)
+            continue
+        if c == '"':
+            i = skip_double_quotes(word, i)
+            continue
+        if c == '$' and word.startswith('${', i):
+            i = skip_parameter(word, i)
+            continue
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            if depth == 0:
+                if commas:
+                    bounds = [start] + commas + [i]
+                    return i + 1, [word[a + 1:b] for a, b in zip(bounds, bounds[1:])]
+                sequence = _sequence(word[start + 1:i])
+                return None if sequence is None else (i + 1, sequence)
+            depth -= 1
+        elif c == ',' and depth == 0:
+            commas.append(i)
+        i += 1
+    return None
+
+def _sequence(body):
+    """Return a generator of the words of a '{x..y[..step]}' body, or None if it is not one."""
+    match = _INT_SEQUENCE.fullmatch(body)
+    if match:
+        first, last = int(match.group(1)), int(match.group(2))
+        step = abs(int(match.group(3) or 1)) or 1
+        stop = last + 1 if first <= last else last - 1
+        numbers = range(first, stop, step if first <= last else -step)
+        # A leading zero on either end pads every number to the same width
+        if any(re.match(r'-?0\d', end) for end in match.group(1, 2)):
+            width = max(len(match.group(1)), len(match.group(2)))
+            return (f"{number:0{width}d}" for number in numbers)
+        return map(str, numbers)
+    match = _CHAR_SEQUENCE.fullmatch(body)
+    if match:
+        first, last = ord(match.group(1)), ord(match.group(2))
+        step = abs(int(match.group(3) or 1)) or 1
+        stop = last + 1 if first <= last else last - 1
+        return map(chr, range(first, stop, step if first <= last else -step))
+    return None
+
+# Scanning a word into pieces
+
+def _tilde(word):
+    """Return (home, end) for a leading '~', '~user', '~+' or '~-', or None."""
+    end = word.find('/')
+    if end == -1:
+        end = len(word)
+    user = word[1:end]
+    if not user:
+        home = os.environ.get('HOME') or os.path.expanduser('~')
+    elif user == '+':
+        home = os.environ.get('PWD') or os.getcwd()
+    elif user == '-':
+        home = os.environ.get('OLDPWD')
+    elif _NAME.fullmatch(user.replace('-', '_').replace('.', '_')):
+        import pwd
+        try:
+            home = pwd.getpwnam(user).pw_dir
+        except KeyError:
+            return None
+    else:
+        return None
+    return (home, end) if home is not None else None
+
+def _scan(word, pieces):
+    """Split a raw word into (text, kind) pieces, expanding tilde, parameters and arithmetic."""
+    n = len(word)
+    i = 0
+    if word.startswith('~'):
+        tilde = _tilde(word)
+        if tilde is not None:
+            pieces.append((tilde[0], QUOTED))
+            i = tilde[1]
+    while i < n:
+        match = _UNQUOTED_SPECIAL.search(word, i)
+        if match is None:
+            pieces.append((word[i:], LITERAL))
+            break
+        j = match.start()
+        if j > i:
+            pieces.append((word[i:j], LITERAL))
+        c = word[j]
+        if c == '\\':
+            pieces.append((word[j + 1:j + 2], QUOTED))
+            i = j + 2
+        elif c == "'":
+            end = skip_single_quotes(word, j)
+            pieces.append((word[j + 1:end - 1], QUOTED))
+            i = end
+        elif c == '"':
+            i = _scan_double(word, j + 1, pieces)
+        else:
+            text, i = _dollar(word, j)
+            pieces.append(('$', LITERAL) if text is None else (text, SPLIT))
+    return pieces
+
+def _scan_double(word, i, pieces):
+    """Scan the inside of a double-quoted string starting at i; return the index past it."""
+    if word.startswith('$@"', i):
+        # "$@" is one field per positional parameter, and no field at all without them
+        for index, argument in enumerate(shell_state['positional']):
+            if index:
+                pieces.append(('', BREAK))
+            pieces.append((argument, QUOTED))
+        return i + 3
+    chunks = []
+    n = len(word)
+    while i < n:
+        match = _DOUBLE_SPECIAL.search(word, i)
+        if match is None:
+            raise ExpansionError("unterminated double quote")
+        j = match.start()
+        if j > i:
+            chunks.append(word[i:j])
+        c = word[j]
+        if c == '"':
+            i = j + 1
+            break
+        if c == '\\':
+            following = word[j + 1:j + 2]
+            chunks.append(following if following in ('$', '`', '"', '\\', '\n') else '\\' + following)
+            i = j + 2
+        else:
+            text, i = _dollar(word, j)
+            chunks.append('$' if text is None else text)
+    pieces.append((''.join(chunks), QUOTED))
+    return i
+
+def _dollar(word, i):
+    """Expand the '$' at i; return (text, end), with text None when it starts no expansion."""
+    following = word[i + 1:i + 2]
+    if following == '(' and word.startswith('$((', i):
+        end = skip_substitution(word, i)
+        return str(arithmetic(expand_string(word[i + 3:end - 2]))), end
+    if following == '{':
+        end = skip_parameter(word, i)
+        return _parameter(word[i + 2:end - 1]), end
+    match = _NAME.match(word, i + 1)
+    if match:
+        return os.environ.get(match.group(), ''), match.end()
+    if following and (following.isdigit() or following in '?$#@*'):
+        value = get_variable(following)
+        return value or '', i + 2
+    return None, i + 1
+
+# Parameter expansion
+
+def _parameter(body):
+    """Evaluate the inside of '${...}'."""
+    if body.startswith('#') and len(body) > 1:
+        value = get_variable(_parameter_name(body[1:], whole=True))
+        return str(len(value or ''))
+    name = _parameter_name(body)
+    value = get_variable(name)
+    rest = body[len(name):]
+    if not rest:
+        return value or ''
+    operator = rest[:2] if rest[:2] in (':-', ':=', ':+', ':?', '##', '%%', '//', '/#', '/%', '^^', ',,') else rest[:1]
+    operand = rest[len(operator):]
+    if operator in (':-', '-'):
+        unset = value is None or (operator == ':-' and not value)
+        return expand_string(operand) if unset else value
+    if operator in (':=', '='):
+        if value is None or (operator == ':=' and not value):
+            if not _NAME.fullmatch(name):
+                raise ExpansionError(f"${name}: cannot assign in this way")
+            value = expand_string(operand)
+            set_variable(name, value)
+        return value
+    if operator in (':+', '+'):
+        unset = value is None or (operator == ':+' and not value)
+        return '' if unset else expand_string(operand)
+    if operator in (':?', '?'):
+        if value is None or (operator == ':?' and not value):
+            raise ExpansionError(f"{name}: {expand_string(operand) or 'parameter null or not set'}")
+        return value
+    value = value or ''
+    if operator == ':':
+        return _substring(value, operand)
+    if operator in ('#', '##', '%', '%%'):
+        return _remove_affix(value, operator, expand_pattern(operand))
+    if operator in ('/', '//', '/#', '/%'):
+        pattern, _, replacement = operand.partition('/')
+        return _replace(value, operator, expand_pattern(pattern), expand_string(replacement))
+    if operator == '^^':
+        return value.upper()
+    if operator == ',,':
+        return value.lower()
+    if operator == '^':
+        return value[:1].upper() + value[1:]
+    if operator == ',':
+        return value[:1].lower() + value[1:]
+    raise ExpansionError(f"${{{body}}}: bad substitution")
+
+def _parameter_name(body, whole=False):
+    match = re.match(r'\d+|[?$#@*]|[A-Za-z_][A-Za-z0-9_]*', body)
+    if match is None or (whole and match.end() != len(body)):
+        raise ExpansionError(f"${{{body}}}: bad substitution")
+    return match.group()
+
+def _substring(value, operand):
+    offset, colon, length = operand.partition(':')
+    start = arithmetic(expand_string(offset))
+    if start < 0:
+        start = max(len(value) + start, 0)
+    if not colon:
+        return value[start:]
+    count = arithmetic(expand_string(length))
+    if count < 0:
+        return value[start:max(len(value) + count, start)]
+    return value[start:start + count]
+
+def _remove_affix(value, operator, pattern):
+    regex = _pattern_regex(pattern)
+    n = len(value)
+    if operator == '#':
+        lengths = range(n + 1)
+    elif operator == '##':
+        lengths = range(n, -1, -1)
+    elif operator == '%':
+        lengths = range(n, -1, -1)
+    else:
+        lengths = range(n + 1)
+    for i in lengths:
+        if operator in ('#', '##'):
+            if regex.fullmatch(value, 0, i):
+                return value[i:]
+        elif regex.fullmatch(value, i):
+            return value[:i]
+    return value
+
+def _replace(value, operator, pattern, replacement):
+    if not pattern:
+        return value
+    regex = _pattern_regex(pattern)
+    if operator == '/#':
+        match = regex.match(value)
+        return replacement + value[match.end():] if match else value
+    if operator == '/%':
+        for i in range(len(value) + 1):
+            if regex.fullmatch(value, i):
+                return value[:i] + replacement
+        return value
+    # Empty matches replace nothing, like other shells
+    return regex.sub(lambda match: replacement if match.group() else '', value, count=0 if operator == '//' else 1)
+
+# Arithmetic
+
+_ARITHMETIC_TOKEN = re.compile(r'''\s*(?:
+    (?P<number>0[xX][0-9a-fA-F]+|\d+\#[0-9A-Za-z@_]+|\d+)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op>\*\*=|<<=|>>=|&&|\|\||\+\+|--|\*\*|<<|>>|<=|>=|==|!=|[-+*/%&|^]=|[-+*/%<>=!~&|^?:,()])
+)''', re.VERBOSE)
+_ASSIGNMENT_OPS = ('=', '*=', '/=', '%=', '+=', '-=', '<<=', '>>=', '&=', '^=', '|=', '**=')
+# Binding power of the binary operators; '**' is the only right-associative one
+_BINARY_OPS = {
+    ',': 1, '||': 4, '&&': 5, '|': 6, '^': 7, '&': 8, '==': 9, '!=': 9,
+    '<': 10, '>': 10, '<=': 10, '>=': 10, '<<': 11, '>>': 11,
+    '+': 12, '-': 12, '*': 13, '/': 13, '%': 13, '**': 14,
+}
+_ASSIGNMENT_POWER = 2
+_CONDITIONAL_POWER = 3
+
+def _parse_number(text):
+    try:
+        if '#' in text:
+            base, digits = text.split('#', 1)
+            return int(digits, int(base))
+        if text[:2] in ('0x', '0X'):
+            return int(text, 16)
+        if len(text) > 1 and text.startswith('0'):
+            return int(text, 8)
+        return int(text)
+    except ValueError:
+        raise ExpansionError(f"{text}: value too great for base") from None
+
+class _ArithmeticParser:
+    """Parse a shell arithmetic expression into nested tuples, by precedence climbing."""
+
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        i = 0
+        n = len(text)
+        while i < n:
+            match = _ARITHMETIC_TOKEN.match(text, i)
+            if match is None:
+                if text[i:].strip():
+                    raise ExpansionError(f"{text}: syntax error in expression (error token is \"{text[i:].strip()}\")")
+                break
+            i = match.end()
+            if match.group('number'):
+                self.tokens.append(('num', _parse_number(match.group('number'))))
+            elif match.group('name'):
+                self.tokens.append(('var', match.group('name')))
+            else:
+                self.tokens.append(('op', match.group('op')))
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            kind, value = self.tokens[self.position]
+            return value if kind == 'op' else kind
+        return None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, op):
+        if self.peek() != op:
+            raise ExpansionError(f"{self.text}: syntax error: '{op}' expected")
+        self.position += 1
+
+    def parse(self):
+        if not self.tokens:
+            return ('num', 0)
+        node = self.expression(0)
+        if self.position < len(self.tokens):
+            raise ExpansionError(f"{self.text}: syntax error in expression")
+        return node
+
+    def expression(self, min_power):
+        left = self.unary()
+        while True:
+            op = self.peek()
+            if op in _ASSIGNMENT_OPS:
+                if _ASSIGNMENT_POWER <= min_power:
+                    break
+                if left[0] != 'var':
+                    raise ExpansionError(f"{self.text}: attempted assignment to non-variable")
+                self.position += 1
+                left = ('assign', op, left[1], self.expression(_ASSIGNMENT_POWER - 1))
+            elif op == '?':
+                if _CONDITIONAL_POWER <= min_power:
+                    break
+                self.position += 1
+                then = self.expression(0)
+                self.expect(':')
+                left = ('cond', left, then, self.expression(_CONDITIONAL_POWER - 1))
+            elif op in _BINARY_OPS:
+                power = _BINARY_OPS[op]
+                if power <= min_power:
+                    break
+                self.position += 1
+                right = self.expression(power - 1 if op == '**' else power)
+                left = ('binary', op, left, right)
+            else:
+                break
+        return left
+
+    def unary(self):
+        if self.position >= len(self.tokens):
+            raise ExpansionError(f"{self.text}: syntax error: operand expected")
+        kind, value = self.take()
+        if kind == 'num':
+            return ('num', value)
+        if kind == 'var':
+            if self.peek() in ('++', '--'):
+                return ('post', self.take()[1], value)
+            return ('var', value)
+        if value == '(':
+            node = self.expression(0)
+            self.expect(')')
+            return node
+        if value in ('++', '--'):
+            if self.peek() != 'var':
+                raise ExpansionError(f"{self.text}: syntax error: variable expected after '{value}'")
+            return ('pre', value, self.take()[1])
+        if value in ('-', '+', '!', '~'):
+            return ('unary', value, self.unary())
+        raise ExpansionError(f"{self.text}: syntax error: operand expected (error token is \"{value}\")")
+
+@lru_cache(maxsize=256)
+def _compile_arithmetic(text):
+    return _ArithmeticParser(text).parse()
+
+def _wrap(number):
+    half = 1 << (INT_BITS - 1)
+    return ((number + half) & ((1 << INT_BITS) - 1)) - half
+
+def _binary(op, left, right):
+    if op == '+':
+        return _wrap(left + right)
+    if op == '-':
+        return _wrap(left - right)
+    if op == '*':
+        return _wrap(left * right)
+    if op in ('/', '%'):
+        if right == 0:
+            raise ExpansionError("division by 0")
+        # Truncated towards zero, like C
+        quotient = abs(left) // abs(right)
+        if (left < 0) != (right < 0):
+            quotient = -quotient
+        return _wrap(quotient) if op == '/' else left - right * quotient
+    if op == '**':
+        if right < 0:
+            raise ExpansionError("exponent less than 0")
+        return _wrap(pow(left, right, 1 << INT_BITS))
+    if op == '<<':
+        return _wrap(left << (right % INT_BITS))
+    if op == '>>':
+        return left >> (right % INT_BITS)
+    if op == '&':
+        return left & right
+    if op == '|':
+        return left | right
+    if op == '^':
+        return left ^ right
+    if op == '<':
+        return int(left < right)
+    if op == '>':
+        return int(left > right)
+    if op == '<=':
+        return int(left <= right)
+    if op == '>=':
+        return int(left >= right)
+    if op == '==':
+        return int(left == right)
+    if op == '!=':
+        return int(left != right)
+    if op == ',':
+        return right
+    raise ExpansionError(f"{op}: unknown operator")
+
+def _variable_value(name, depth):
+    value = get_variable(name)
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        # Like other shells, a variable holding an expression is evaluated
+        return arithmetic(value, depth + 1)
+
+def _evaluate(node, depth):
+    kind = node[0]
+    if kind == 'num':
+        return node[1]
+    if kind == 'var':
+        return _variable_value(node[1], depth)
+    if kind == 'binary':
+        op = node[1]
+        left = _evaluate(node[2], depth)
+        # '&&' and '||' short-circuit: the right side may divide by zero or assign
+        if op == '&&':
+            return int(bool(left) and bool(_evaluate(node[3], depth)))
+        if op == '||':
+            return int(bool(left) or bool(_evaluate(node[3], depth)))
+        return _binary(op, left, _evaluate(node[3], depth))
+    if kind == 'unary':
+        value = _evaluate(node[2], depth)
+        if node[1] == '-':
+            return _wrap(-value)
+        if node[1] == '!':
+            return int(not value)
+        if node[1] == '~':
+            return ~value
+        return value
+    if kind == 'cond':
+        return _evaluate(node[2] if _evaluate(node[1], depth) else node[3], depth)
+    if kind == 'assign':
+        op, name = node[1], node[2]
+        value = _evaluate(node[3], depth)
+        if op != '=':
+            value = _binary(op[:-1], _variable_value(name, depth), value)
+        set_variable(name, str(value))
+        return value
+    # '++' and '--', before or after the variable
+    name = node[2]
+    old = _variable_value(name, depth)
+    new = _wrap(old + 1 if node[1] == '++' else old - 1)
+    set_variable(name, str(new))
+    return new if kind == 'pre' else old
+
+def arithmetic(text, depth=0):
+    """Evaluate a shell arithmetic expression, such as the inside of '$((...))', to an int.
+
+    Integers are 64-bit; variables are read by name and may be assigned with
+    '=', '+=', '++' and the like. Parsed expressions are cached, so a loop
+    counter costs one evaluation per iteration.
+    """
+    if depth > MAX_ARITHMETIC_DEPTH:
+        raise ExpansionError(f"{text}: expression recursion level exceeded")
+    return _evaluate(_compile_arithmetic(text.strip()), depth)
+
+# Fields and pathname expansion
+
+@lru_cache(maxsize=16)
+def _separator_regex(ifs):
+    return re.compile(f"[{re.escape(ifs)}]+")
+
+def _escape_glob(text):
+    return _GLOB_SPECIAL.sub(lambda match: '\\' + match.group(), text) if _GLOB_SPECIAL.search(text) else text
+
+def _fields(pieces):
+    """Yield the fields of a scanned word as lists of (text, quoted) parts."""
+    ifs = os.environ.get('IFS', DEFAULT_IFS)
+    field = []
+    started = False
+    for text, kind in pieces:
+        if kind == QUOTED:
+            field.append((text, True))
+            started = True
+        elif kind == LITERAL:
+            field.append((text, False))
+            started = True
+        elif kind == BREAK:
+            if started:
+                yield field
+            field = []
+            started = False
+        elif not ifs:
+            if text:
+                field.append((text, False))
+                started = True
+        else:
+            for index, part in enumerate(_separator_regex(ifs).split(text)):
+                # Every separator ends the field in progress
+                if index and started:
+                    yield field
+                    field = []
+                    started = False
+                if part:
+                    field.append((part, False))
+                    started = True
+    if started:
+        yield field
+
+def _field_values(field):
+    """Return the final values of one field: its glob matches, or its text."""
+    text = ''.join(part for part, _ in field)
+    if not any(not quoted and ('*' in part or '?' in part or '[' in part) for part, quoted in field):
+        return (text,)
+    pattern = ''.join(_escape_glob(part) if quoted else part for part, quoted in field)
+    if not has_magic(pattern):
+        return (text,)
+    return glob_paths(pattern) or (text,)
+
+def expand(word):
+    """Yield the fields a raw word expands to.
+
+    Braces are expanded first, then tilde, parameters and arithmetic; the
+    unquoted results of expansions are split on IFS, and fields with
+    unquoted '*', '?' or '[...]' are replaced by the paths they match, when
+    there are any. Quotes are removed last.
+    """
+    if not _SPECIAL.search(word):
+        # Braces only rearrange the word's own text, so no variant needs more
+        yield from expand_braces(word)
+        return
+    for variant in expand_braces(word):
+        if not _SPECIAL.search(variant):
+            yield variant
+            continue
+        for field in _fields(_scan(variant, [])):
+            yield from _field_values(field)
+
+def expand_words(words):
+    """Expand raw words into the final argument list."""
+    fields = []
+    for word in words:
+        fields.extend(expand(word))
+    return fields
+
+def expand_string(word):
+    """Expand a raw word that stays one string: no braces, splitting or globbing."""
+    if not _SPECIAL.search(word):
+        return word
+    return ''.join(' ' if kind == BREAK else text for text, kind in _scan(word, []))
+
+def expand_pattern(word):
+    """Expand a raw word into a glob pattern in which quoted characters match literally."""
+    if not _SPECIAL.search(word):
+        return word
+    return ''.join(' ' if kind == BREAK else (_escape_glob(text) if kind == QUOTED else text)
+                   for text, kind in _scan(word, []))
+
+def match_pattern(pattern, text):
+    """Tell whether a glob pattern, as made by expand_pattern(), matches the whole of text."""
+    return _pattern_regex(pattern).fullmatch(text) is not None
+
+def has_magic(pattern):
+    """Tell whether a pattern has an unescaped '*', '?' or '[...]'."""
+    n = len(pattern)
+    i = 0
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c in '*?':
+            return True
+        if c == '[' and _bracket_end(pattern, i) is not None:
+            return True
+        i += 1
+    return False
+
+def _bracket_end(pattern, start):
+    """Return the index of the ']' closing the bracket expression at start, or None."""
+    i = start + 1
+    if i < len(pattern) and pattern[i] in '!^':
+        i += 1
+    if i < len(pattern) and pattern[i] == ']':
+        i += 1
+    end = pattern.find(']', i)
+    return None if end == -1 else end
+
+@lru_cache(maxsize=256)
+def _pattern_regex(pattern, hidden=True):
+    """Compile a glob pattern; without ``hidden`` a leading '.' must be matched literally."""
+    out = [] if hidden or pattern.startswith('.') else [r'(?!\.)']
+    n = len(pattern)
+    i = 0
+    while i < n:
+        c = pattern[i]
+        if c == '\\':
+            out.append(re.escape(pattern[i + 1:i + 2]))
+            i += 2
+            continue
+        if c == '*':
+            out.append('.*')
+        elif c == '?':
+            out.append('.')
+        elif c == '[' and _bracket_end(pattern, i) is not None:
+            end = _bracket_end(pattern, i)
+            body = pattern[i + 1:end]
+            negate = body[:1] in ('!', '^')
+            if negate:
+                body = body[1:]
+            body = body.replace('\\', '\\\\').replace('^', '\\^').replace('[', '\\[')
+            out.append(f"[{'^' if negate else ''}{body}]")
+            i = end
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return re.compile(''.join(out), re.DOTALL)
+
+def _entries(directory):
+    try:
+        with os.scandir(directory or '.') as it:
+            return list(it)
+    except OSError:
+        return []
+
+def _tree(prefix, entries=None):
+    """Yield (directory, entries) for a directory and every directory below it.
+
+    Each directory is read once; hidden directories and symlinks to
+    directories are not descended into, like '**' in other shells.
+    """
+    stack = [(prefix, entries)]
+    while stack:
+        directory, listing = stack.pop()
+        if listing is None:
+            listing = _entries(directory)
+        yield directory, listing
+        for entry in listing:
+            if not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False):
+                stack.append((directory + entry.name + '/', None))
+
+def _unescape(text):
+    return re.sub(r'\\(.)', r'\1', text) if '\\' in text else text
+
+def _match(prefix, parts, index, entries=None):
+    """Yield the paths below prefix matching parts[index:]."""
+    part = parts[index]
+    last = index == len(parts) - 1
+    if part == '**':
+        if last:
+            for directory, listing in _tree(prefix, entries):
+                for entry in listing:
+                    if not entry.name.startswith('.'):
+                        yield directory + entry.name
+            return
+        for directory, listing in _tree(prefix, entries):
+            yield from _match(directory, parts, index + 1, listing)
+        return
+    if not has_magic(part):
+        path = prefix + _unescape(part)
+        if last:
+            if os.path.lexists(path):
+                yield path
+        elif os.path.isdir(path):
+            yield from _match(path + '/', parts, index + 1)
+        return
+    regex = _pattern_regex(part, hidden=False)
+    for entry in entries if entries is not None else _entries(prefix):
+        if regex.fullmatch(entry.name):
+            if last:
+                yield prefix + entry.name
+            elif entry.is_dir():
+                yield from _match(prefix + entry.name + '/', parts, index + 1)
+
+def glob_paths(pattern):
+    """Return the sorted paths matching a glob pattern, in which '**' spans any number of directories.
+
+    The walk reads every directory with a single scandir() and never looks
+    inside directories the pattern cannot match, so '**/*.py' costs one pass
+    over the tree.
+    """
+    directories_only = pattern.endswith('/')
+    parts = [part for part in pattern.split('/') if part]
+    # '**/**' matches what '**' does
+    parts = [part for i, part in enumerate(parts) if not (part == '**' and i and parts[i - 1] == '**')]
+    if not parts:
+        return []
+    matches = list(_match('/' if pattern.startswith('/') else '', parts, 0))
+    if directories_only:
+        matches = [path + '/' for path in matches if os.path.isdir(path)]
+    matches.sort()
+    return matches
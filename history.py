@@ -0,0 +1,218 @@
+# history.py
+
+import os
+import sys
+import time
+import sqlite3
+import logging
+from constants import RED, CYAN, RESET, shell_state
+
+HISTORY_FILE = os.path.expanduser('~/.local/share/custom_shell/history.db')
+# Entries kept in the log; older ones are dropped by compaction
+MAX_ENTRIES = 1000000
+# Most recent distinct commands loaded into readline for the arrow keys and Ctrl-R
+READLINE_ENTRIES = 1000
+# Results shown by a history search
+SEARCH_LIMIT = 20
+# Most recent distinct commands a search scans before falling back to the indexes
+RECENT_WINDOW = 20000
+# Milliseconds a writer waits for another shell holding the write lock
+BUSY_TIMEOUT = 2000
+
+# The log is append-only; 'commands' holds each distinct command once with its
+# last use and is what searches run against, through a trigram FTS index.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    command TEXT NOT NULL,
+    time REAL NOT NULL,
+    cwd TEXT,
+    status INTEGER
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    command TEXT NOT NULL UNIQUE,
+    last_used INTEGER NOT NULL,
+    uses INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS commands_last_used ON commands(last_used);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS commands_fts USING fts5(
+    command, content='commands', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS commands_insert AFTER INSERT ON commands BEGIN
+    INSERT INTO commands_fts(rowid, command) VALUES (new.id, new.command);
+END;
+CREATE TRIGGER IF NOT EXISTS commands_delete AFTER DELETE ON commands BEGIN
+    INSERT INTO commands_fts(commands_fts, rowid, command) VALUES ('delete', old.id, old.command);
+END;
+"""
+
+class History:
+    """The on-disk history shared by every shell of the user.
+
+    SQLite in WAL mode lets several shells append at the same time, and each
+    entry is written in its own short transaction.
+    """
+
+    def __init__(self, path=HISTORY_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT / 1000, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 or the trigram tokenizer: substring search scans
+            self.fts = False
+        self.last = None
+
+    def add(self, command, status=None):
+        """Append a command to the log, skipping an immediate repeat in this shell."""
+        if command == self.last:
+            return
+        self.last = command
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            cursor = self.db.execute('INSERT INTO history(command, time, cwd, status) VALUES (?, ?, ?, ?)',
+                                     (command, time.time(), shell_state.get('cwd') or os.getcwd(), status))
+            self.db.execute('INSERT INTO commands(command, last_used) VALUES (?, ?) '
+                            'ON CONFLICT(command) DO UPDATE SET last_used = excluded.last_used, uses = uses + 1',
+                            (command, cursor.lastrowid))
+        if cursor.lastrowid % 10000 == 0:
+            self.compact(MAX_ENTRIES)
+
+    def recent(self, count):
+        """Return the last count (id, command) entries of the log, oldest first."""
+        rows = self.db.execute('SELECT id, command FROM history ORDER BY id DESC LIMIT ?', (count,)).fetchall()
+        return rows[::-1]
+
+    def recent_commands(self, count):
+        """Return the last count distinct commands, oldest first."""
+        rows = self.db.execute('SELECT command FROM commands ORDER BY last_used DESC LIMIT ?', (count,))
+        return [command for command, in rows][::-1]
+
+    def search(self, text, mode='substring', limit=SEARCH_LIMIT):
+        """Return distinct commands matching text, most recently used first.
+
+        The most recent commands are scanned first; if they hold enough matches,
+        those are the answer. Otherwise prefix search uses the unique index on
+        the command text and substring search the trigram index. Fuzzy search
+        (the characters of text in order) has no index and scans every command.
+        """
+        if mode == 'prefix':
+            where, params = 'command >= ? AND command < ?', (text, text + '\U0010ffff')
+        elif mode == 'fuzzy':
+            where, params = "command LIKE ? ESCAPE '\\'", ('%' + '%'.join(map(_escape_like, text)) + '%',)
+        else:
+            where, params = "command LIKE ? ESCAPE '\\'", ('%' + _escape_like(text) + '%',)
+        # Restrict the first pass to the newest commands through the last_used index
+        row = self.db.execute('SELECT last_used FROM commands ORDER BY last_used DESC LIMIT 1 OFFSET ?',
+                              (RECENT_WINDOW,)).fetchone()
+        rows = self.db.execute(
+            f'SELECT command FROM commands INDEXED BY commands_last_used WHERE last_used > ? AND {where} '
+            'ORDER BY last_used DESC LIMIT ?', (row[0] if row else 0, *params, limit)).fetchall()
+        if row is None:
+            return [command for command, in rows]
+        if len(rows) < limit:
+            if mode == 'substring' and self.fts and len(text) >= 3:
+                where = 'id IN (SELECT rowid FROM commands_fts WHERE commands_fts MATCH ?)'
+                params = ('"' + text.replace('"', '""') + '"',)
+            rows = self.db.execute(f'SELECT command FROM commands WHERE {where} ORDER BY last_used DESC LIMIT ?',
+                                   (*params, limit)).fetchall()
+        return [command for command, in rows]
+
+    def compact(self, max_entries=MAX_ENTRIES):
+        """Drop log entries beyond max_entries and commands not used since; return the rows removed."""
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            newest = self.db.execute('SELECT max(id) FROM history').fetchone()[0] or 0
+            cutoff = newest - max_entries
+            removed = self.db.execute('DELETE FROM history WHERE id <= ?', (cutoff,)).rowcount
+            removed += self.db.execute('DELETE FROM commands WHERE last_used <= ?', (cutoff,)).rowcount
+        if self.fts:
+            self.db.execute("INSERT INTO commands_fts(commands_fts) VALUES ('optimize')")
+        return removed
+
+    def close(self):
+        self.db.close()
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+_history = []
+
+def get_history():
+    """Return the shared History, opening it on first use, or None if it cannot be opened."""
+    if not _history:
+        try:
+            _history.append(History())
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"history: cannot open {HISTORY_FILE}: {e}", exc_info=True)
+            _history.append(None)
+    return _history[0]
+
+def record(command, status=None):
+    """Save an interactive command line; lines starting with a space are not saved."""
+    if not command.strip() or command.startswith(' '):
+        return
+    history = get_history()
+    if history is None:
+        return
+    try:
+        history.add(command.strip(), status)
+    except sqlite3.Error as e:
+        logging.error(f"history: cannot save command: {e}", exc_info=True)
+
+def load_readline():
+    """Fill readline's in-memory history with the most recent distinct commands."""
+    import readline
+    history = get_history()
+    if history is None:
+        return
+    try:
+        for command in history.recent_commands(READLINE_ENTRIES):
+            readline.add_history(command)
+    except sqlite3.Error as e:
+        logging.error(f"history: cannot load history: {e}", exc_info=True)
+
+def builtin_history(args):
+    history = get_history()
+    if history is None:
+        print(f"{RED}history: cannot open {HISTORY_FILE}{RESET}", file=sys.stderr)
+        return 1
+    modes = {'-p': 'prefix', '-s': 'substring', '-f': 'fuzzy'}
+    limit = SEARCH_LIMIT
+    args = list(args)
+    try:
+        if '-n' in args:
+            index = args.index('-n')
+            limit = int(args[index + 1])
+            del args[index:index + 2]
+        if args and args[0] in modes:
+            if len(args) < 2:
+                print(f"{RED}history: {args[0]} needs a search text{RESET}", file=sys.stderr)
+                return 1
+            for command in history.search(' '.join(args[1:]), modes[args[0]], limit):
+                print(command)
+            return 0
+        if args and args[0] == '--compact':
+            max_entries = int(args[1]) if len(args) > 1 else MAX_ENTRIES
+            removed = history.compact(max_entries)
+            print(f"{CYAN}history: removed {removed} old entries{RESET}")
+            return 0
+        count = int(args[0]) if args else limit
+        for entry_id, command in history.recent(count):
+            print(f"{entry_id:>7}  {command}")
+        return 0
+    except (IndexError, ValueError):
+        print(f"{RED}history: usage: history [N] | -p|-s|-f TEXT [-n N] | --compact [N]{RESET}", file=sys.stderr)
+        return 1
+    except sqlite3.Error as e:
+        logging.error(f"history: Error: {e}", exc_info=True)
+        print(f"{RED}history: Error: {e}{RESET}", file=sys.stderr)
+        return 1
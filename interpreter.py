@@ -0,0 +1,949 @@
+# interpreter.py
+
+import os
+import re
+import sys
+import stat
+import logging
+import contextlib
+from constants import RED, RESET, shell_state
+from parser import (
+    CommandList,
+    FUNCTION_RE,
+    ParseError,
+    Pipeline,
+    expand_aliases,
+    parse_list,
+    parse_pipeline,
+    skip_backticks,
+    skip_double_quotes,
+    skip_parameter,
+    skip_single_quotes,
+    skip_substitution,
+    tokenize,
+    WORD,
+)
+from registry import FUNCTIONS
+from shell import run_parsed
+from expansion import expand_pattern, match_pattern, set_variable
+from substitution import expand_word, expand_words
+
+# Reserved words that may be followed by a command on the same segment
+OPENING_WORDS = frozenset(('if', 'elif', 'then', 'else', 'while', 'until', 'do', '{'))
+# Reserved words starting and ending a compound command, which can be part of a pipeline or list
+COMPOUND_STARTS = ('if', 'while', 'until', 'for', 'case', '{')
+COMPOUND_ENDS = ('fi', 'done', 'esac', '}')
+# The 'in' of 'case WORD in', found by trying each candidate
+_IN_RE = re.compile(r'\sin(?:\s|$)')
+# Deepest chain of function calls before giving up, well within Python's recursion limit
+MAX_FUNCTION_DEPTH = 100
+# Status of a command killed by Ctrl-C; it also stops the loop running it
+INTERRUPTED_STATUS = 130
+
+class IncompleteInput(ParseError):
+    """Raised when the text ends inside a compound command, so more lines are needed."""
+
+class If:
+    """'if' and its 'elif' branches as (condition, body) pairs, then the 'else' body or None."""
+
+    def __init__(self, branches, otherwise, redirects):
+        self.branches = branches
+        self.otherwise = otherwise
+        self.redirects = redirects
+
+class While:
+    """A 'while' loop, or an 'until' loop when ``until`` is set."""
+
+    def __init__(self, condition, body, until, redirects):
+        self.condition = condition
+        self.body = body
+        self.until = until
+        self.redirects = redirects
+
+class For:
+    """A 'for NAME in WORDS' loop; ``words`` is None for 'for NAME', which loops over "$@"."""
+
+    def __init__(self, name, words, body, redirects):
+        self.name = name
+        self.words = words
+        self.body = body
+        self.redirects = redirects
+
+class Case:
+    """A 'case WORD in' with its arms as (patterns, body) pairs."""
+
+    def __init__(self, word, arms, redirects):
+        self.word = word
+        self.arms = arms
+        self.redirects = redirects
+
+class Group:
+    """A '{ ...; }' group, run in the shell itself."""
+
+    def __init__(self, body, redirects):
+        self.body = body
+        self.redirects = redirects
+
+class Piped:
+    """A pipeline with compound commands among its stages, as (line, node) pairs."""
+
+    def __init__(self, stages):
+        self.stages = stages
+
+class AndOr:
+    """An '&&' and '||' list with compound commands among its parts, as (connector, (line, node)) pairs."""
+
+    def __init__(self, items):
+        self.items = items
+
+class FunctionDefinition:
+    """'name() { ...; }': defines the function when run."""
+
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+
+class Function:
+    """A shell function, called like a builtin with its arguments as $1, $2...
+
+    In a pipeline or with redirections it runs as a builtin stage, so the
+    output of its builtins follows the stage while external commands it
+    starts keep the shell's own descriptors.
+    """
+
+    def __init__(self, name, body):
+        self.name = name
+        self.body = body
+
+    def run(self, args):
+        return call_function(self, args)
+
+class LoopControl(Exception):
+    """Raised by 'break' and 'continue' to leave ``levels`` enclosing loops."""
+
+    def __init__(self, kind, levels):
+        super().__init__(f"{kind} outside a loop")
+        self.kind = kind
+        self.levels = levels
+
+class FunctionReturn(Exception):
+    """Raised by 'return' to leave the running function with a status."""
+
+    def __init__(self, status):
+        super().__init__('return outside a function')
+        self.status = status
+
+# Loops running in the current function (or at top level) and the local-variable frames of the calls
+_state = {'loops': 0}
+_frames = []
+
+# Parsing
+
+def _segments(text):
+    """Yield (segment, line number) for the parts of script text between newlines and ';'.
+
+    A ';;' ending a case arm is a segment of its own. Quotes and
+    substitutions are skipped, and comments are dropped.
+    """
+    for number, line in enumerate(text.splitlines(), 1):
+        start = 0
+        i = 0
+        n = len(line)
+        try:
+            while i < n:
+                c = line[i]
+                if c == '\\':
+                    i += 2
+                elif c == "'":
+                    i = skip_single_quotes(line, i)
+                elif c == '"':
+                    i = skip_double_quotes(line, i)
+                elif c == '`':
+                    i = skip_backticks(line, i)
+                elif c == '$' and line.startswith('$(', i):
+                    i = skip_substitution(line, i)
+                elif c == '$' and line.startswith('${', i):
+                    i = skip_parameter(line, i)
+                elif c == '#' and (i == 0 or line[i - 1] in ' \t;&|()'):
+                    n = i
+                elif c == ';':
+                    segment = line[start:i].strip()
+                    if segment:
+                        yield segment, number
+                    if line.startswith(';;', i):
+                        yield ';;', number
+                        i += 1
+                    i += 1
+                    start = i
+                else:
+                    i += 1
+        except ParseError:
+            # Left whole, so the error is reported when the line is parsed as a command
+            i = n
+        segment = line[start:n].strip()
+        if segment:
+            yield segment, number
+
+def _segment_items(segment, number):
+    """Split a segment into items: reserved words ('kw'), function names ('func') and commands ('cmd')."""
+    items = []
+    while segment:
+        match = FUNCTION_RE.match(segment)
+        if match:
+            items.append(('func', match.group(1), number))
+            segment = segment[match.end():]
+            continue
+        parts = segment.split(None, 1)
+        word = parts[0]
+        rest = parts[1] if len(parts) > 1 else ''
+        if word == 'function' and rest:
+            parts = rest.split(None, 1)
+            name = parts[0]
+            rest = parts[1] if len(parts) > 1 else ''
+            if name.endswith('()'):
+                name = name[:-2]
+            elif rest.startswith('()'):
+                rest = rest[2:].lstrip()
+            items.append(('func', name, number))
+            segment = rest
+            continue
+        if word in OPENING_WORDS:
+            items.append(('kw', word, number))
+            segment = rest
+            continue
+        try:
+            operators = _compound_operators(segment)
+        except ParseError:
+            # Left whole, so the error is reported when the segment is parsed as a command
+            operators = []
+        if operators:
+            # 'a && if ...', '... done | sort': the operators become items between the commands
+            start = 0
+            for i, operator in operators:
+                items.extend(_segment_items(segment[start:i].strip(), number))
+                items.append(('op', operator, number))
+                start = i + len(operator)
+            segment = segment[start:].strip()
+            continue
+        items.append(('cmd', segment, number))
+        break
+    return items
+
+def _first_word(item):
+    kind, text, _ = item
+    if kind == 'cmd':
+        return text.split(None, 1)[0]
+    return text if kind == 'kw' else None
+
+class _Parser:
+    """Build the compiled nodes of a script from its items, by recursive descent."""
+
+    def __init__(self, items):
+        self.items = items
+        self.position = 0
+
+    def next(self):
+        if self.position >= len(self.items):
+            return None
+        item = self.items[self.position]
+        self.position += 1
+        return item
+
+    def push(self, items):
+        self.items[self.position:self.position] = items
+
+    def script(self, partial=True):
+        """Parse the whole text; a syntax error becomes the last node, reported when reached.
+
+        Without ``partial``, text ending inside a compound command raises
+        IncompleteInput instead.
+        """
+        nodes = []
+        while True:
+            start = self.position
+            item = self.next()
+            if item is None:
+                return nodes
+            try:
+                nodes.append(self.command(item))
+            except ParseError as e:
+                if isinstance(e, IncompleteInput) and not partial:
+                    raise
+                nodes.append((self.items[start][1], str(e)))
+                return nodes
+
+    def body(self, terminators):
+        """Parse commands up to one of the terminating reserved words; return them and the terminator."""
+        nodes = []
+        while True:
+            item = self.next()
+            if item is None:
+                raise IncompleteInput(f"syntax error: unexpected end of file, expecting '{terminators[-1]}'")
+            if _first_word(item) in terminators:
+                return nodes, item
+            nodes.append(self.command(item))
+
+    def peek(self, kinds):
+        """Return the next item without consuming it if it is an operator in kinds, else None."""
+        if self.position < len(self.items):
+            item = self.items[self.position]
+            if item[0] == 'op' and item[1] in kinds:
+                return item
+        return None
+
+    def command(self, item):
+        """Parse one command starting with item, with any '&&' and '||' list it heads, into a (line, node) pair."""
+        first = self.pipeline(item)
+        if self.peek(('&&', '||')) is None:
+            return first
+        items = [(None, first)]
+        while self.peek(('&&', '||')) is not None:
+            connector = self.next()[1]
+            item = self.next()
+            if item is None:
+                raise IncompleteInput(f"syntax error: unexpected end of file after '{connector}'")
+            items.append((connector, self.pipeline(item)))
+        line = ' '.join(f"{connector} {line}" if connector else line for connector, (line, _) in items)
+        return line, AndOr(items)
+
+    def pipeline(self, item):
+        """Parse one stage starting with item, with any stages piped after it."""
+        first = self.stage(item)
+        if self.peek(('|',)) is None:
+            return first
+        stages = [first]
+        while self.peek(('|',)) is not None:
+            self.next()
+            item = self.next()
+            if item is None:
+                raise IncompleteInput("syntax error: unexpected end of file after '|'")
+            stages.append(self.stage(item))
+        return ' | '.join(line for line, _ in stages), Piped(stages)
+
+    def stage(self, item):
+        """Parse one compound or simple command starting with item."""
+        kind, text, number = item
+        word = _first_word(item)
+        if kind == 'func':
+            return self.function(text, number)
+        if kind == 'op':
+            raise ParseError(f"syntax error near unexpected token '{text}'")
+        if kind == 'kw':
+            if word == 'if':
+                return self.if_command(number)
+            if word in ('while', 'until'):
+                return self.while_command(word, number)
+            if word == '{':
+                body, end = self.body(('}',))
+                return f"{{ ... }} (line {number})", Group(body, self.redirects(end))
+            raise ParseError(f"syntax error near unexpected token '{word}'")
+        if word == 'for':
+            return self.for_command(text, number)
+        if word == 'case':
+            return self.case_command(text, number)
+        if word in ('fi', 'done', 'esac', '}', ';;', 'then', 'do', 'else', 'elif', 'in'):
+            raise ParseError(f"syntax error near unexpected token '{word}'")
+        try:
+            return text, parse_list(text)
+        except ParseError as e:
+            # A bad simple command only fails when reached, like a bad line of a script
+            return text, str(e)
+
+    def redirects(self, end):
+        """Return the redirections after a closing word such as 'done > out'."""
+        _, text, _ = end
+        keyword = _first_word(end)
+        if text == keyword:
+            return []
+        pipeline = parse_pipeline(text)
+        command = pipeline.commands[0]
+        if (len(pipeline.commands) > 1 or command.words != [keyword] or command.assignments
+                or pipeline.background or pipeline.negated):
+            raise ParseError(f"syntax error near '{text}': only redirections may follow '{keyword}'")
+        return command.redirects
+
+    def if_command(self, number):
+        branches = []
+        otherwise = None
+        while True:
+            condition, _ = self.body(('then',))
+            body, end = self.body(('elif', 'else', 'fi'))
+            if not condition or not body:
+                raise ParseError(f"syntax error: empty 'if' condition or branch (line {number})")
+            branches.append((condition, body))
+            word = _first_word(end)
+            if word == 'else':
+                otherwise, end = self.body(('fi',))
+                break
+            if word == 'fi':
+                break
+        return f"if ... fi (line {number})", If(branches, otherwise, self.redirects(end))
+
+    def while_command(self, word, number):
+        condition, _ = self.body(('do',))
+        body, end = self.body(('done',))
+        if not condition:
+            raise ParseError(f"syntax error: empty '{word}' condition (line {number})")
+        return f"{word} ... done (line {number})", While(condition, body, word == 'until', self.redirects(end))
+
+    def for_command(self, text, number):
+        words = [value for kind, value in tokenize(text) if kind == WORD]
+        if len(words) < 2 or len(words) != len(tokenize(text)) or not words[1].isidentifier():
+            raise ParseError(f"syntax error in '{text}'")
+        if len(words) > 2 and words[2] != 'in':
+            raise ParseError(f"syntax error in '{text}': expected 'in'")
+        item = self.next()
+        if item is None:
+            raise IncompleteInput("syntax error: unexpected end of file, expecting 'do'")
+        if _first_word(item) != 'do':
+            raise ParseError(f"syntax error near unexpected token '{_first_word(item)}', expecting 'do'")
+        body, end = self.body(('done',))
+        return f"{text}; do ... done", For(words[1], words[3:] if len(words) > 2 else None, body, self.redirects(end))
+
+    def case_command(self, text, number):
+        # 'in' ends the head: the first arm, or 'esac', may follow on the same line
+        for match in _IN_RE.finditer(text):
+            try:
+                tokens = tokenize(text[:match.end()])
+            except ParseError:
+                continue
+            if len(tokens) == 3 and all(kind == WORD for kind, _ in tokens) and tokens[2][1] == 'in':
+                break
+        else:
+            raise ParseError(f"syntax error in '{text}': expected 'case WORD in'")
+        words = [value for _, value in tokens]
+        self.push(_segment_items(text[match.end():].strip(), number))
+        text = text[:match.end()].strip()
+        arms = []
+        while True:
+            item = self.next()
+            if item is None:
+                raise IncompleteInput("syntax error: unexpected end of file, expecting 'esac'")
+            if _first_word(item) == 'esac':
+                return f"{text} ... esac", Case(words[1], arms, self.redirects(item))
+            if item[0] != 'cmd':
+                raise ParseError(f"syntax error near unexpected token '{_first_word(item)}' in case")
+            patterns, rest = _arm_patterns(item[1])
+            self.push(_segment_items(rest, item[2]))
+            body, end = self.body((';;', 'esac'))
+            arms.append((patterns, body))
+            if _first_word(end) == 'esac':
+                return f"{text} ... esac", Case(words[1], arms, self.redirects(end))
+
+    def function(self, name, number):
+        item = self.next()
+        if item is None:
+            raise IncompleteInput("syntax error: unexpected end of file, expecting '{'")
+        if _first_word(item) != '{':
+            raise ParseError(f"syntax error: the body of function '{name}' must be a '{{ ... }}' group")
+        body, end = self.body(('}',))
+        if end[1] != '}':
+            raise ParseError(f"syntax error near '{end[1]}': redirections on function definitions are not supported")
+        return f"{name}() {{ ... }}", FunctionDefinition(name, body)
+
+def _compound_operators(text):
+    """Return the (index, operator) pairs at which a command must be split around compound commands.
+
+    A '|' is split at when a compound command ends before it or starts after
+    it; once one operator is, so is every '&&' and '||', which bind more
+    loosely. The list is empty for a command with no compound in it.
+    """
+    operators = []
+    n = len(text)
+    i = 0
+    while i < n:
+        c = text[i]
+        if c == '\\':
+            i += 2
+        elif c == "'":
+            i = skip_single_quotes(text, i)
+        elif c == '"':
+            i = skip_double_quotes(text, i)
+        elif c == '`':
+            i = skip_backticks(text, i)
+        elif c == '$' and text.startswith('$(', i):
+            i = skip_substitution(text, i)
+        elif c == '$' and text.startswith('${', i):
+            i = skip_parameter(text, i)
+        elif text.startswith(('&&', '||'), i):
+            operators.append((i, text[i:i + 2]))
+            i += 2
+        elif c == '|':
+            operators.append((i, '|'))
+            i += 1
+        else:
+            i += 1
+    if not operators:
+        return []
+    starts = [0] + [i + len(operator) for i, operator in operators]
+    ends = [i for i, _ in operators] + [n]
+    firsts = [(text[start:end].split(None, 1) or [''])[0] for start, end in zip(starts, ends)]
+    split = [firsts[k] in COMPOUND_ENDS or firsts[k + 1] in COMPOUND_STARTS for k in range(len(operators))]
+    if not any(split):
+        return []
+    return [(i, operator) for (i, operator), needed in zip(operators, split) if needed or operator != '|']
+
+def _arm_patterns(text):
+    """Split 'a|b) command' into the raw patterns and the command after the ')'."""
+    i = 1 if text.startswith('(') else 0
+    start = i
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == '\\':
+            i += 2
+        elif c == "'":
+            i = skip_single_quotes(text, i)
+        elif c == '"':
+            i = skip_double_quotes(text, i)
+        elif c == '$' and text.startswith('${', i):
+            i = skip_parameter(text, i)
+        elif c == ')':
+            break
+        else:
+            i += 1
+    if i >= n:
+        raise ParseError(f"syntax error in case arm '{text}': expected ')'")
+    tokens = tokenize(text[start:i])
+    patterns = [value for kind, value in tokens if kind == WORD]
+    if not patterns or len(tokens) != 2 * len(patterns) - 1 or any(value != '|' for kind, value in tokens[1::2]):
+        raise ParseError(f"syntax error in case pattern '{text[start:i]}'")
+    return patterns, text[i + 1:].strip()
+
+def _items(text):
+    items = []
+    for segment, number in _segments(text):
+        items.extend(_segment_items(segment, number))
+    return items
+
+def parse_script(text):
+    """Parse script text into a list of (line, node) pairs.
+
+    A node is a Pipeline or CommandList, a compound command (If, While,
+    For, Case or Group), a Piped pipeline or AndOr list with compound
+    commands among its parts, a FunctionDefinition, or the ParseError
+    message of a command that does not parse, which is reported when
+    execution reaches it. A syntax error in the structure of compound commands, such
+    as a missing 'fi', ends the script there.
+    """
+    return _Parser(_items(text)).script()
+
+def incomplete(text):
+    """Tell whether text ends inside a compound command, so the prompt should ask for more."""
+    try:
+        _Parser(_items(text)).script(partial=False)
+    except IncompleteInput:
+        return True
+    return False
+
+# Execution
+
+@contextlib.contextmanager
+def redirected(redirects):
+    """Apply redirections to the shell's own descriptors 0, 1 and 2 for the duration of the block."""
+    if not redirects:
+        yield
+        return
+    from commands import open_redirects
+    fds = {0: 0, 1: 1, 2: 2}
+    opened = []
+    saved = {}
+    try:
+        open_redirects(redirects, fds, opened)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, target in fds.items():
+            if target == fd:
+                continue
+            saved[fd] = os.dup(fd)
+            if target is None:
+                target = os.open(os.devnull, os.O_RDWR)
+                opened.append(target)
+            os.dup2(target, fd)
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for fd, copy in saved.items():
+            os.dup2(copy, fd)
+            os.close(copy)
+        for fd in opened:
+            os.close(fd)
+
+def run_node(line, node):
+    """Run one compiled node and return its exit status."""
+    if isinstance(node, (Pipeline, CommandList)):
+        return run_parsed(expand_aliases(node), line)
+    if isinstance(node, str):
+        print(f"{RED}{line}: {node}{RESET}", file=sys.stderr)
+        return 2
+    if isinstance(node, FunctionDefinition):
+        FUNCTIONS[node.name] = Function(node.name, node.body)
+        return 0
+    if isinstance(node, AndOr):
+        from shell import run_list
+        status = run_list(node, lambda item: run_node(*item))
+    elif isinstance(node, Piped):
+        status = _run_piped(node)
+    else:
+        try:
+            with redirected(node.redirects):
+                status = _RUNNERS[type(node)](node)
+        except OSError as e:
+            logging.error(f"{line}: {e}")
+            print(f"{RED}{line}: {e.strerror or e}{RESET}", file=sys.stderr)
+            status = 1
+    shell_state['last_status'] = status
+    return status
+
+def run_body(nodes):
+    """Run a list of (line, node) pairs and return the status of the last one, 0 if there is none."""
+    status = 0
+    for line, node in nodes:
+        status = run_node(line, node)
+    return status
+
+def _run_if(node):
+    for condition, body in node.branches:
+        if run_body(condition) == 0:
+            return run_body(body)
+    return run_body(node.otherwise) if node.otherwise is not None else 0
+
+def _loop_body(body):
+    """Run a loop body once; return its status and whether the loop must stop."""
+    try:
+        status = run_body(body)
+    except LoopControl as control:
+        if control.levels > 1:
+            control.levels -= 1
+            raise
+        return 0, control.kind == 'break'
+    if status == INTERRUPTED_STATUS:
+        raise KeyboardInterrupt
+    return status, False
+
+def _run_while(node):
+    status = 0
+    _state['loops'] += 1
+    try:
+        while (run_body(node.condition) == 0) != node.until:
+            status, stop = _loop_body(node.body)
+            if stop:
+                break
+    finally:
+        _state['loops'] -= 1
+    return status
+
+def _run_for(node):
+    values = expand_words(node.words) if node.words is not None else list(shell_state['positional'])
+    status = 0
+    _state['loops'] += 1
+    try:
+        for value in values:
+            set_variable(node.name, value)
+            status, stop = _loop_body(node.body)
+            if stop:
+                break
+    finally:
+        _state['loops'] -= 1
+    return status
+
+def _run_case(node):
+    value = expand_word(node.word)
+    for patterns, body in node.arms:
+        if any(match_pattern(expand_pattern(pattern), value) for pattern in patterns):
+            return run_body(body)
+    return 0
+
+def _run_group(node):
+    return run_body(node.body)
+
+def _run_piped(node):
+    """Run a pipeline with compound commands among its stages and return the status of the last stage.
+
+    Compound commands before the last stage run in subshells and simple
+    stages from threads of the shell, each writing into a pipe read by the
+    next. The last stage runs in the shell itself with that pipe as fd 0, so
+    a 'while read' loop at the end of a pipeline keeps its variables.
+    """
+    import threading
+    from commands import fork_shell, run_pipeline
+    from jobs import Job, add_process, wait_for
+    stages = node.stages
+    # The first stage keeps the shell's stdin, even once fd 0 is the last pipe
+    saved = os.dup(0)
+    inputs = [saved]
+    outputs = []
+    for _ in stages[1:]:
+        read_fd, write_fd = os.pipe()
+        inputs.append(read_fd)
+        outputs.append(write_fd)
+    # Pipe ends the shell holds; each is closed as soon as the stage using it has started
+    held = set(inputs[1:] + outputs)
+    job = Job(' | '.join(line for line, _ in stages))
+    producers = []
+    try:
+        # Subshells are forked before any thread opens pipes of its own that they could inherit
+        for i, (line, stage) in enumerate(stages[:-1]):
+            if not isinstance(stage, Pipeline):
+                fds = {0: inputs[i], 1: outputs[i], 2: 2}
+                add_process(job, fork_shell(lambda line=line, stage=stage: run_node(line, stage), fds, close=held))
+                for fd in (inputs[i], outputs[i]):
+                    if fd in held:
+                        held.discard(fd)
+                        os.close(fd)
+        for i, (line, stage) in enumerate(stages[:-1]):
+            if isinstance(stage, Pipeline):
+                held.difference_update((inputs[i], outputs[i]))
+                stdin = inputs[i] if i else os.dup(saved)
+                producer = threading.Thread(target=_produce, args=(stage, stdin, open(outputs[i], 'wb')),
+                                            name='pipe-stage', daemon=True)
+                producer.start()
+                producers.append(producer)
+        line, last = stages[-1]
+        if isinstance(last, Pipeline):
+            return run_pipeline(expand_aliases(last), stdin=inputs[-1])
+        os.dup2(inputs[-1], 0)
+        try:
+            return run_node(line, last)
+        finally:
+            os.dup2(saved, 0)
+    finally:
+        # Without readers left the other stages get EPIPE and stop
+        for fd in held:
+            os.close(fd)
+        for producer in producers:
+            producer.join()
+        if job.stages:
+            wait_for(job)
+        os.close(saved)
+
+def _produce(pipeline, stdin, output):
+    """Run a simple stage of a pipeline with compound commands; stdin and output belong to it."""
+    from commands import run_pipeline
+    try:
+        run_pipeline(expand_aliases(pipeline), capture=output, stdin=stdin)
+    except BrokenPipeError:
+        pass
+    finally:
+        os.close(stdin)
+        try:
+            output.close()
+        except BrokenPipeError:
+            pass
+
+_RUNNERS = {If: _run_if, While: _run_while, For: _run_for, Case: _run_case, Group: _run_group}
+
+def call_function(function, args):
+    """Run a function with args as its positional parameters and return its status."""
+    if len(_frames) >= MAX_FUNCTION_DEPTH:
+        print(f"{RED}{function.name}: maximum function nesting level exceeded ({MAX_FUNCTION_DEPTH}){RESET}", file=sys.stderr)
+        return 1
+    saved = (shell_state['positional'], _state['loops'])
+    shell_state['positional'] = list(args)
+    # 'break' and 'continue' do not reach the loops of the caller
+    _state['loops'] = 0
+    _frames.append({})
+    try:
+        return run_body(function.body)
+    except FunctionReturn as returned:
+        return returned.status
+    finally:
+        _restore_locals(_frames.pop())
+        shell_state['positional'], _state['loops'] = saved
+
+def _restore_locals(frame):
+    for name, value in frame.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            set_variable(name, value)
+
+def run_source(text):
+    """Parse and run script text typed at the prompt; return the last status."""
+    return run_body(parse_script(text))
+
+# Builtins
+
+def _count(name, args):
+    """The loop count or status argument of break, continue and return, or None if it is invalid."""
+    if not args:
+        return 1 if name != 'return' else shell_state['last_status']
+    try:
+        return int(args[0])
+    except ValueError:
+        print(f"{RED}{name}: {args[0]}: numeric argument required{RESET}", file=sys.stderr)
+        return None
+
+def _loop_control(kind, args):
+    levels = _count(kind, args)
+    if levels is None:
+        return 2
+    if levels < 1:
+        print(f"{RED}{kind}: {levels}: loop count out of range{RESET}", file=sys.stderr)
+        return 1
+    if _state['loops'] == 0:
+        print(f"{RED}{kind}: only meaningful in a 'for', 'while', or 'until' loop{RESET}", file=sys.stderr)
+        return 0
+    raise LoopControl(kind, min(levels, _state['loops']))
+
+def builtin_break(args):
+    return _loop_control('break', args)
+
+def builtin_continue(args):
+    return _loop_control('continue', args)
+
+def builtin_return(args):
+    status = _count('return', args)
+    if status is None:
+        status = 2
+    if not _frames:
+        print(f"{RED}return: can only 'return' from a function{RESET}", file=sys.stderr)
+        return 1
+    raise FunctionReturn(status & 0xff)
+
+def builtin_local(args):
+    if not _frames:
+        print(f"{RED}local: can only be used in a function{RESET}", file=sys.stderr)
+        return 1
+    frame = _frames[-1]
+    status = 0
+    for arg in args:
+        name, assigned, value = arg.partition('=')
+        if not name.isidentifier():
+            print(f"{RED}local: '{arg}': not a valid identifier{RESET}", file=sys.stderr)
+            status = 1
+            continue
+        if name not in frame:
+            frame[name] = os.environ.get(name)
+        if assigned:
+            set_variable(name, value)
+        else:
+            os.environ.pop(name, None)
+    return status
+
+def builtin_true(args):
+    return 0
+
+def builtin_false(args):
+    return 1
+
+# Tests of 'test' and '[' on one file, by flag
+_FILE_TESTS = {
+    '-e': lambda path: os.path.exists(path),
+    '-f': lambda path: os.path.isfile(path),
+    '-d': lambda path: os.path.isdir(path),
+    '-L': lambda path: os.path.islink(path),
+    '-h': lambda path: os.path.islink(path),
+    '-r': lambda path: os.access(path, os.R_OK),
+    '-w': lambda path: os.access(path, os.W_OK),
+    '-x': lambda path: os.access(path, os.X_OK),
+    '-s': lambda path: os.path.isfile(path) and os.path.getsize(path) > 0,
+    '-p': lambda path: os.path.exists(path) and stat.S_ISFIFO(os.stat(path).st_mode),
+}
+_INTEGER_TESTS = {
+    '-eq': lambda a, b: a == b, '-ne': lambda a, b: a != b,
+    '-lt': lambda a, b: a < b, '-le': lambda a, b: a <= b,
+    '-gt': lambda a, b: a > b, '-ge': lambda a, b: a >= b,
+}
+_STRING_TESTS = {
+    '=': lambda a, b: a == b, '==': lambda a, b: a == b, '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '>': lambda a, b: a > b,
+    '-nt': lambda a, b: _newer(a, b), '-ot': lambda a, b: _newer(b, a),
+}
+
+class _TestError(Exception):
+    pass
+
+def _integer(text):
+    try:
+        return int(text.strip())
+    except ValueError:
+        raise _TestError(f"{text}: integer expression expected") from None
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _newer(path, other):
+    """'-nt': path exists and is newer than other, or other does not exist."""
+    mtime, other_mtime = _mtime(path), _mtime(other)
+    return mtime is not None and (other_mtime is None or mtime > other_mtime)
+
+def _evaluate_test(args):
+    """Evaluate the arguments of 'test' with the usual precedence: '!', then '-a', then '-o'."""
+    position = [0]
+
+    def peek(offset=0):
+        index = position[0] + offset
+        return args[index] if index < len(args) else None
+
+    def take():
+        position[0] += 1
+        return args[position[0] - 1]
+
+    def primary():
+        word = peek()
+        if word is None:
+            raise _TestError('argument expected')
+        operator = peek(1)
+        if peek(2) is not None and (operator in _STRING_TESTS or operator in _INTEGER_TESTS):
+            left, operator, right = take(), take(), take()
+            if operator in _STRING_TESTS:
+                return _STRING_TESTS[operator](left, right)
+            return _INTEGER_TESTS[operator](_integer(left), _integer(right))
+        if word == '!':
+            take()
+            return not primary()
+        if word == '(' and operator is not None:
+            take()
+            result = disjunction()
+            if peek() != ')':
+                raise _TestError("')' expected")
+            take()
+            return result
+        if operator is not None and (word in ('-z', '-n') or word in _FILE_TESTS):
+            flag, operand = take(), take()
+            if flag == '-z':
+                return operand == ''
+            if flag == '-n':
+                return operand != ''
+            return _FILE_TESTS[flag](operand)
+        # A lone word, even '-n' or '-f', is true when it is not empty
+        return take() != ''
+
+    def conjunction():
+        result = primary()
+        while peek() == '-a':
+            take()
+            result = primary() and result
+        return result
+
+    def disjunction():
+        result = conjunction()
+        while peek() == '-o':
+            take()
+            result = conjunction() or result
+        return result
+
+    if not args:
+        return False
+    result = disjunction()
+    if position[0] != len(args):
+        raise _TestError(f"{args[position[0]]}: unexpected argument")
+    return result
+
+def builtin_test(args):
+    try:
+        return 0 if _evaluate_test(list(args)) else 1
+    except _TestError as e:
+        print(f"{RED}test: {e}{RESET}", file=sys.stderr)
+        return 2
+
+def builtin_bracket(args):
+    if not args or args[-1] != ']':
+        print(f"{RED}[: missing ']'{RESET}", file=sys.stderr)
+        return 2
+    return builtin_test(args[:-1])
@@ -1,35 +1,309 @@
 # jobs.py
 
+import os
+import sys
+import signal
 import threading
+import time
 from constants import RED, RESET
 
 jobs_list = []
-job_counter = 1
+
+# Guards the job table; notified by the reaper whenever a child changes state
+_cond = threading.Condition()
+# Live child pids, mapped to the Job they belong to
+_pid_jobs = {}
+# Children reaped before add_process() registered them, by pid: (status, rusage, when reaped)
+_unclaimed = {}
+# Seconds an unclaimed status is kept; a child is registered right after it starts
+UNCLAIMED_SECONDS = 5.0
+_reaper = []
+# Terminal ownership, filled in by enable_job_control()
+_control = {'enabled': False, 'shell_pgid': None}
+
+def _after_fork():
+    """Start a forked child (a daemon request, a background builtin) with an empty job table and no reaper.
+
+    The reaper thread does not exist in the child, and the lock may have been
+    held by it at the moment of the fork. The child does not own the
+    terminal either, so it runs its jobs without job control.
+    """
+    global _cond
+    _cond = threading.Condition()
+    _control['enabled'] = False
+    jobs_list.clear()
+    _pid_jobs.clear()
+    _unclaimed.clear()
+    _reaper.clear()
+
+os.register_at_fork(after_in_child=_after_fork)
+
+# Signals a child must get back at their default disposition
+CHILD_DEFAULT_SIGNALS = (signal.SIGINT, signal.SIGQUIT, signal.SIGPIPE, signal.SIGXFSZ,
+                         signal.SIGTSTP, signal.SIGTTIN, signal.SIGTTOU)
 
 class Job:
-    def __init__(self, job_id, thread, command):
-        self.job_id = job_id
-        self.thread = thread
+    """A pipeline running as a process group, with its per-process results.
+
+    ``stages`` holds the pid of every process that was started, or None for
+    a stage that could not be started; its status is kept in ``failed``.
+    """
+
+    def __init__(self, command):
+        self.job_id = None
         self.command = command
+        self.pgid = None
+        self.stages = []
+        self.failed = {}
+        self.statuses = {}
+        self.state = 'Running'
+        self.started = time.monotonic()
+        self.finished = None
+        self.cpu_time = 0.0
+        self.max_rss = 0
+
+    @property
+    def exit_status(self):
+        if not self.stages:
+            return 0
+        last = self.stages[-1]
+        if last is None:
+            return self.failed[len(self.stages) - 1]
+        return self.statuses.get(last, 0)
+
+    def all_reaped(self):
+        return all(pid in self.statuses for pid in self.stages if pid is not None)
+
+    @property
+    def wall_time(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def status_text(self):
+        if self.state == 'Done' and self.exit_status:
+            return f"Exit {self.exit_status}"
+        return self.state
+
+def _exit_status(status):
+    code = os.waitstatus_to_exitcode(status)
+    return 128 - code if code < 0 else code
+
+def _reap_loop():
+    """Reap every child of the shell's jobs, in a single thread for all jobs."""
+    while True:
+        with _cond:
+            while not _pid_jobs:
+                _cond.wait()
+        try:
+            # Block until some child changes state, without reaping it yet
+            info = os.waitid(os.P_ALL, 0, os.WEXITED | os.WSTOPPED | os.WCONTINUED | os.WNOWAIT)
+        except ChildProcessError:
+            # No children at all: whoever reaped the registered ones, they are gone
+            with _cond:
+                for pid, job in list(_pid_jobs.items()):
+                    _update(job, pid, 0, None)
+                _cond.notify_all()
+            continue
+        if info is None:
+            continue
+        try:
+            pid, status, rusage = os.wait4(info.si_pid, os.WUNTRACED | os.WCONTINUED | os.WNOHANG)
+        except ChildProcessError:
+            pid, status, rusage = info.si_pid, 0, None
+        if pid == 0:
+            continue
+        with _cond:
+            job = _pid_jobs.get(pid)
+            if job is None:
+                # Started but not registered yet: add_process() picks the status up
+                # from here, so the reaper never has to poll for it
+                now = time.monotonic()
+                for old in [old for old, (_, _, when) in _unclaimed.items() if now - when > UNCLAIMED_SECONDS]:
+                    del _unclaimed[old]
+                if not os.WIFSTOPPED(status) and not os.WIFCONTINUED(status):
+                    _unclaimed[pid] = (status, rusage, now)
+                continue
+            _update(job, pid, status, rusage)
+            _cond.notify_all()
+
+def _update(job, pid, status, rusage):
+    if os.WIFSTOPPED(status):
+        job.state = 'Stopped'
+        return
+    if os.WIFCONTINUED(status):
+        job.state = 'Running'
+        return
+    job.statuses[pid] = _exit_status(status)
+    if rusage is not None:
+        job.cpu_time += rusage.ru_utime + rusage.ru_stime
+        job.max_rss = max(job.max_rss, rusage.ru_maxrss)
+    del _pid_jobs[pid]
+    if job.all_reaped():
+        job.state = 'Done'
+        job.finished = time.monotonic()
+
+def add_process(job, pid):
+    """Register a started process with its job and make sure the reaper runs."""
+    with _cond:
+        job.stages.append(pid)
+        _pid_jobs[pid] = job
+        if pid in _unclaimed:
+            # The reaper got to it first
+            status, rusage, _ = _unclaimed.pop(pid)
+            _update(job, pid, status, rusage)
+        if not _reaper:
+            thread = threading.Thread(target=_reap_loop, name='reaper', daemon=True)
+            thread.start()
+            _reaper.append(thread)
+        _cond.notify_all()
 
-def add_job(thread, command):
-    global job_counter
-    job = Job(job_counter, thread, command)
+def add_failed_stage(job, status):
+    """Record a stage that could not be started, with its exit status."""
+    job.failed[len(job.stages)] = status
+    job.stages.append(None)
+
+def enable_job_control():
+    """Take control of the terminal, if there is one, so jobs can be stopped and resumed."""
+    if not os.isatty(0):
+        return
+    for sig in (signal.SIGTTOU, signal.SIGTTIN, signal.SIGTSTP):
+        signal.signal(sig, signal.SIG_IGN)
+    _control['shell_pgid'] = os.getpgrp()
+    _control['enabled'] = True
+
+def job_control_active():
+    """Tell whether new foreground jobs get their own process group and the terminal."""
+    return _control['enabled'] and threading.current_thread() is threading.main_thread()
+
+def give_terminal(job):
+    if job_control_active() and job.pgid is not None:
+        try:
+            os.tcsetpgrp(0, job.pgid)
+        except OSError:
+            pass
+
+def take_terminal():
+    if job_control_active():
+        try:
+            os.tcsetpgrp(0, _control['shell_pgid'])
+        except OSError:
+            pass
+
+def add_job(job):
+    """Put a job in the job table, giving it the next free job number."""
+    job.job_id = max((j.job_id for j in jobs_list), default=0) + 1
     jobs_list.append(job)
-    job_counter += 1
-    print(f"[{job.job_id}] {thread.ident} Started '{command}'")
     return job.job_id
 
-def list_jobs():
-    for job in jobs_list:
-        status = 'Running' if job.thread.is_alive() else 'Done'
-        print(f"[{job.job_id}] {status} {job.command}")
+def wait_for(job, foreground=False):
+    """Block until a job finishes or stops and return its exit status.
 
-def bring_job_to_foreground(job_id):
+    A foreground job gets the terminal while it runs. If it is stopped (Ctrl-Z)
+    it is moved to the job table.
+    """
+    if foreground:
+        give_terminal(job)
+    try:
+        with _cond:
+            while job.state == 'Running' and not job.all_reaped():
+                _cond.wait()
+            if job.state == 'Running':
+                job.state = 'Done'
+                job.finished = time.monotonic()
+    finally:
+        if foreground:
+            take_terminal()
+    if job.state == 'Stopped':
+        if job.job_id is None:
+            add_job(job)
+        print(f"\n[{job.job_id}]+  Stopped                 {job.command}")
+        return 128 + signal.SIGTSTP
+    if job in jobs_list:
+        jobs_list.remove(job)
+    if foreground and job_control_active() and job.exit_status == 128 + signal.SIGINT:
+        # Ctrl-C went to the job, not the shell; end the ^C line
+        print()
+    return job.exit_status
+
+def find_job(spec):
+    """Return the job named by '%n', 'n', or the most recent job for None."""
+    if spec is None:
+        return jobs_list[-1] if jobs_list else None
+    spec = spec.lstrip('%')
+    if spec in ('', '+', '%'):
+        return jobs_list[-1] if jobs_list else None
     for job in jobs_list:
-        if job.job_id == job_id:
-            job.thread.join()
+        if str(job.job_id) == spec:
+            return job
+    return None
+
+def list_jobs(detailed=False):
+    for job in list(jobs_list):
+        if detailed:
+            pid = job.pgid if job.pgid is not None else '-'
+            print(f"[{job.job_id}] {pid:>7} {job.status_text():<10} "
+                  f"wall {job.wall_time:8.2f}s  cpu {job.cpu_time:7.2f}s  "
+                  f"rss {job.max_rss:>8} KB  {job.command}")
+        else:
+            print(f"[{job.job_id}] {job.status_text()} {job.command}")
+        if job.state == 'Done':
+            jobs_list.remove(job)
+
+def notify_finished():
+    """Report background jobs that finished since the last prompt and drop them."""
+    for job in list(jobs_list):
+        if job.state == 'Done':
+            print(f"[{job.job_id}]  {job.status_text():<22}{job.command}")
+            jobs_list.remove(job)
+
+def continue_job(job):
+    """Send SIGCONT to a stopped job and mark it running."""
+    with _cond:
+        job.state = 'Running' if job.state == 'Stopped' else job.state
+    try:
+        os.killpg(job.pgid, signal.SIGCONT)
+    except ProcessLookupError:
+        pass
+
+def bring_job_to_foreground(spec):
+    job = find_job(spec)
+    if job is None:
+        print(f"{RED}fg: No such job: {spec or 'current'}{RESET}", file=sys.stderr)
+        return 1
+    print(job.command)
+    if job.state == 'Stopped':
+        continue_job(job)
+    return wait_for(job, foreground=True)
+
+def resume_job_in_background(spec):
+    job = find_job(spec)
+    if job is None:
+        print(f"{RED}bg: No such job: {spec or 'current'}{RESET}", file=sys.stderr)
+        return 1
+    if job.state == 'Stopped':
+        continue_job(job)
+    print(f"[{job.job_id}]+ {job.command} &")
+    return 0
+
+def wait_for_jobs(specs):
+    """Wait for the given jobs (all background jobs when empty); return the last status."""
+    targets = []
+    for spec in specs:
+        job = find_job(spec)
+        if job is None:
+            print(f"{RED}wait: No such job: {spec}{RESET}", file=sys.stderr)
+            return 127
+        targets.append(job)
+    status = 0
+    for job in targets or list(jobs_list):
+        with _cond:
+            while job.state == 'Running' and not job.all_reaped():
+                _cond.wait()
+            stopped = job.state == 'Stopped' and not job.all_reaped()
+        if stopped:
+            # Like POSIX wait, a stopped job ends the wait for it; it stays in the table
+            status = 128 + signal.SIGTSTP
+            continue
+        status = job.exit_status
+        if job in jobs_list:
             jobs_list.remove(job)
-            print(f"Brought job [{job_id}] to foreground")
-            return
-    print(f"{RED}fg: No such job: {job_id}{RESET}")
+    return status
@@ -0,0 +1,222 @@
+# listing.py
+
+import os
+import sys
+import stat
+import time
+import shutil
+import signal
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from constants import RED, BLUE, RESET
+
+# Entries formatted before they are written out in one go
+BATCH_SIZE = 1024
+
+# Formatted modification times by minute; most entries share a handful of minutes
+_mtime_text = {}
+
+class Listing:
+    """Options of one 'ls' run."""
+
+    def __init__(self, detailed=False, all_files=False, recursive=False, sort='name',
+                 reverse=False, columns=None, streaming=False, workers=0, color=False):
+        self.detailed = detailed
+        self.all_files = all_files
+        self.recursive = recursive
+        self.sort = sort
+        self.reverse = reverse
+        self.columns = columns
+        self.streaming = streaming
+        self.workers = workers
+        # Directories are coloured only on a terminal, never in pipes or files
+        self.color = color
+        self._executor = None
+
+    def stat_entries(self, entries):
+        """Return (entry, stat_result) pairs, statting in parallel when workers were requested."""
+        if not self.workers:
+            return [(entry, _stat(entry)) for entry in entries]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return list(zip(entries, self._executor.map(_stat, entries)))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+def _stat(entry):
+    try:
+        return entry.stat()
+    except OSError:
+        try:
+            return entry.stat(follow_symlinks=False)
+        except OSError:
+            return None
+
+def _is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+def format_entry(name, is_dir, stats, detailed, color):
+    """Format one entry; with color, directories are coloured from the type cached in their DirEntry."""
+    if is_dir and color:
+        name = f"{BLUE}{name}{RESET}"
+    if not detailed:
+        return name
+    if stats is None:
+        return f"?????????? {'?':>8} {'?':>16} {name}"
+    permissions = stat.filemode(stats.st_mode)
+    minute = int(stats.st_mtime) // 60
+    mtime = _mtime_text.get(minute)
+    if mtime is None:
+        mtime = _mtime_text[minute] = time.strftime('%Y-%m-%d %H:%M', time.localtime(minute * 60))
+    return f"{permissions} {stats.st_size:>8} {mtime} {name}"
+
+def print_columns(entries, write, color):
+    """Print names in columns, filled top to bottom like ls -C."""
+    if not entries:
+        return
+    names = [entry.name for entry in entries]
+    width = shutil.get_terminal_size().columns
+    column_width = max(len(name) for name in names) + 2
+    num_columns = max(1, width // column_width)
+    num_rows = (len(names) + num_columns - 1) // num_columns
+    lines = []
+    for row in range(num_rows):
+        cells = []
+        for index in range(row, len(names), num_rows):
+            padding = ' ' * (column_width - len(names[index]))
+            cells.append(format_entry(names[index], _is_dir(entries[index]), None, False, color) + padding)
+        lines.append(''.join(cells).rstrip())
+    write('\n'.join(lines) + '\n')
+
+def _sort_key(listing):
+    if listing.sort == 'size':
+        return lambda pair: (-pair[1].st_size if pair[1] else 0, pair[0].name)
+    if listing.sort == 'time':
+        return lambda pair: (-pair[1].st_mtime_ns if pair[1] else 0, pair[0].name)
+    return lambda pair: pair[0].name
+
+def list_directory(path, listing, write):
+    """List one directory and return the subdirectories to visit for -R."""
+    subdirs = []
+    with os.scandir(path) as scanner:
+        if listing.streaming:
+            # -U: print entries in directory order as they are read
+            batch = []
+            for entry in scanner:
+                if not listing.all_files and entry.name.startswith('.'):
+                    continue
+                stats = _stat(entry) if listing.detailed else None
+                batch.append(format_entry(entry.name, _is_dir(entry), stats, listing.detailed, listing.color))
+                if listing.recursive and entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                if len(batch) >= BATCH_SIZE:
+                    write('\n'.join(batch) + '\n')
+                    batch.clear()
+            if batch:
+                write('\n'.join(batch) + '\n')
+            return subdirs
+        entries = [entry for entry in scanner if listing.all_files or not entry.name.startswith('.')]
+    # Only -l, -S and -t need a stat per entry; the file type comes from the DirEntry
+    if listing.detailed or listing.sort != 'name':
+        pairs = listing.stat_entries(entries)
+    else:
+        pairs = [(entry, None) for entry in entries]
+    pairs.sort(key=_sort_key(listing), reverse=listing.reverse)
+    if listing.columns and not listing.detailed:
+        print_columns([entry for entry, _ in pairs], write, listing.color)
+    else:
+        for start in range(0, len(pairs), BATCH_SIZE):
+            chunk = pairs[start:start + BATCH_SIZE]
+            write('\n'.join(format_entry(entry.name, _is_dir(entry), stats, listing.detailed, listing.color)
+                             for entry, stats in chunk) + '\n')
+    if listing.recursive:
+        subdirs = [entry.path for entry, _ in pairs if entry.is_dir(follow_symlinks=False)]
+    return subdirs
+
+def list_files(paths, listing):
+    """List files and directories; return the exit status like ls does."""
+    write = sys.stdout.write
+    status = 0
+    directories = []
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                directories.append(path)
+            else:
+                stats = os.stat(path) if listing.detailed else os.lstat(path)
+                write(format_entry(path, False, stats, listing.detailed, False) + '\n')
+        except OSError as e:
+            print(f"{RED}ls: cannot access '{path}': {e.strerror}{RESET}", file=sys.stderr)
+            status = 2
+    show_headers = listing.recursive or len(paths) > 1
+    # Depth-first, like ls -R, without recursion limits
+    stack = list(reversed(directories))
+    first = True
+    try:
+        while stack:
+            path = stack.pop()
+            if show_headers:
+                write(('' if first else '\n') + f"{path}:\n")
+            first = False
+            try:
+                subdirs = list_directory(path, listing, write)
+            except BrokenPipeError:
+                # The reader went away, e.g. 'ls -R / | head'
+                return 128 + signal.SIGPIPE
+            except OSError as e:
+                logging.error(f"ls: Error: {e}", exc_info=True)
+                print(f"{RED}ls: cannot open directory '{path}': {e.strerror}{RESET}", file=sys.stderr)
+                status = 2
+                continue
+            stack.extend(reversed(subdirs))
+    finally:
+        listing.close()
+    return status
+
+def builtin_ls(args):
+    terminal = sys.stdout.isatty()
+    listing = Listing(columns=terminal, color=terminal)
+    paths = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '--':
+            paths.extend(args)
+            break
+        if not arg.startswith('-') or arg == '-':
+            paths.append(arg)
+            continue
+        for flag in arg[1:]:
+            if flag == 'l':
+                listing.detailed = True
+            elif flag == 'a':
+                listing.all_files = True
+            elif flag == 'R':
+                listing.recursive = True
+            elif flag == 'S':
+                listing.sort = 'size'
+            elif flag == 't':
+                listing.sort = 'time'
+            elif flag == 'r':
+                listing.reverse = True
+            elif flag == '1':
+                listing.columns = False
+            elif flag == 'C':
+                listing.columns = True
+            elif flag == 'U':
+                listing.streaming = True
+            elif flag == 'j':
+                try:
+                    listing.workers = int(args.pop(0))
+                except (IndexError, ValueError):
+                    print(f"{RED}ls: -j needs a number of stat threads{RESET}", file=sys.stderr)
+                    return 2
+            else:
+                print(f"{RED}ls: invalid option -- '{flag}'{RESET}", file=sys.stderr)
+                return 2
+    return list_files([os.path.expanduser(path) for path in paths] or ['.'], listing)
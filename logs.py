@@ -0,0 +1,108 @@
+# logs.py
+
+import os
+import logging
+
+LOG_DIR = os.path.join(os.path.expanduser(os.environ.get('XDG_STATE_HOME', '~/.local/state')), 'custom_shell')
+LOG_FILE = os.path.join(LOG_DIR, 'shell.log')
+# Rotation: at most LOG_BACKUPS old files of LOG_MAX_BYTES each are kept
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUPS = 3
+
+# Per-command records go to this logger at INFO; everything else logs errors only
+command_log = logging.getLogger('shell.commands')
+
+_listener = []
+# The handler this module put on the root logger: the stand-in, then the queue handler
+_installed = []
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object per line, with its 'fields' merged in."""
+
+    def format(self, record):
+        import json
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        for key, value in (getattr(record, 'fields', None) or {}).items():
+            # Timings are kept as raw floats by the REPL and only rounded here
+            entry[key] = round(value, 6) if isinstance(value, float) else value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _DeferredHandler(logging.Handler):
+    """Stands in on the root logger until the first record, so startup never pays for the writer."""
+
+    def __init__(self):
+        super().__init__()
+        self.handler = None
+
+    def emit(self, record):
+        # Emits are serialised by the handler lock, so only the first one starts the writer
+        if self.handler is None:
+            self.handler = _start_writer()
+            _install(self.handler)
+        self.handler.handle(record)
+
+def _start_writer():
+    """Start the thread writing the rotated JSON log and return the handler feeding it."""
+    import queue
+    import atexit
+    import logging.handlers
+
+    class QueueHandler(logging.handlers.QueueHandler):
+        """Hand records to the writer thread untouched; formatting happens there, not in the REPL."""
+
+        def prepare(self, record):
+            return record
+
+    try:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8', delay=True)
+    except OSError:
+        # No writable state directory: keep errors out of the terminal rather than fail
+        return logging.NullHandler()
+    file_handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, file_handler)
+    listener.start()
+    _listener.append(listener)
+    atexit.register(stop_logging)
+    return QueueHandler(records)
+
+def stop_logging():
+    """Write out the queued records and stop the writer thread."""
+    while _listener:
+        _listener.pop().stop()
+
+def _install(handler):
+    root = logging.getLogger()
+    while _installed:
+        root.removeHandler(_installed.pop())
+    root.addHandler(handler)
+    _installed.append(handler)
+
+def _after_fork():
+    # The writer thread stays in the parent: a forked child starts its own on its first record
+    _listener.clear()
+    if _installed:
+        _install(_DeferredHandler())
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def setup_logging():
+    """Send all logging through a queue to a background thread writing a rotated JSON log.
+
+    The thread and the log file are only set up when the first record arrives.
+    """
+    root = logging.getLogger()
+    if not _installed:
+        _install(_DeferredHandler())
+    root.setLevel(logging.ERROR)
+    command_log.setLevel(logging.INFO)
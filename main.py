@@ -1,221 +1,114 @@
 # main.py
 
-import shlex
-import threading
-import re
-import os
+import time
+
+# Phase timings for --startup-profile, measured from the first line of this file
+_started = time.perf_counter()
+
+import sys
 import logging
-import subprocess
-
-# Try importing readline for history navigation; use pyreadline on Windows
-try:
-    import readline
-except ImportError:
-    import pyreadline as readline
-
-from constants import RED, GREEN, YELLOW, RESET, aliases
-from utils import get_prompt, setup_autocomplete, load_configuration
-from commands import (
-    change_directory,
-    list_files,
-    make_directory,
-    remove_item,
-    copy_item,
-    move_item,
-    print_working_directory,
-    display_help,
-    display_command_help,
-    set_alias,
-    remove_alias,
-    set_environment_variable,
-    execute_command,
-    execute_script,
-)
-from autocomplete import autocomplete_commands
-from jobs import add_job, list_jobs, bring_job_to_foreground
-
-# Configure logging
-logging.basicConfig(filename='shell.log', level=logging.ERROR,
-                    format='%(asctime)s %(levelname)s: %(message)s')
-
-def substitute_commands(command_input):
-    """Substitute commands enclosed in backticks or $()."""
-    pattern = r'`([^`]+)`|\$\(([^)]+)\)'
-    while True:
-        match = re.search(pattern, command_input)
-        if not match:
-            break
-        cmd = match.group(1) or match.group(2)
-        try:
-            # Use shell=True to allow shell features in command substitution
-            output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT).decode().strip()
-            command_input = command_input[:match.start()] + output + command_input[match.end():]
-        except subprocess.CalledProcessError as e:
-            error_output = e.output.decode().strip() if e.output else str(e)
-            logging.error(f"Error in command substitution: {error_output}", exc_info=True)
-            print(f"{RED}Error in command substitution: {error_output}{RESET}")
-            # Remove the failed substitution
-            command_input = command_input[:match.start()] + command_input[match.end():]
-        except Exception as e:
-            logging.error(f"Error in command substitution: {e}", exc_info=True)
-            print(f"{RED}Error in command substitution: {e}{RESET}")
-            # Remove the failed substitution
-            command_input = command_input[:match.start()] + command_input[match.end():]
-    return command_input
-
-def process_command(command_input):
-    """Process a single command input."""
-    # Handle command substitution
-    command_input = substitute_commands(command_input)
-
-    if not command_input:
-        return
-
-    # Command History
-    readline.add_history(command_input)
-
-    # Handle background execution
-    background = False
-    if command_input.endswith('&'):
-        background = True
-        command_input = command_input[:-1].strip()
-
-    tokens = shlex.split(command_input)
-    if not tokens:
-        return
-    command = tokens[0]
-    args = tokens[1:]
-
-    # Handle variable assignment
-    if '=' in command and command[0] != '=':
-        name, value = command_input.split('=', 1)
-        set_environment_variable(name.strip(), value.strip())
-        return
-
-    # Check for aliases
-    if command in aliases:
-        aliased_command = aliases[command]
-        command_input = aliased_command + ' ' + ' '.join(args)
-        tokens = shlex.split(command_input)
-        command = tokens[0]
-        args = tokens[1:]
-
-    # Handle built-in commands
-    if command == 'exit':
-        print(f"{GREEN}Exiting Custom Shell. Goodbye!{RESET}")
-        exit(0)
-    elif command == 'cd':
-        path = args[0] if args else '~'
-        change_directory(path)
-    elif command == 'ls':
-        detailed = False
-        all_files = False
-        for arg in args:
-            if arg == '-l':
-                detailed = True
-            elif arg == '-a':
-                all_files = True
-        list_files(detailed, all_files)
-    elif command == 'mkdir':
-        if args:
-            make_directory(args[0])
-        else:
-            print(f"{RED}mkdir: missing operand{RESET}")
-    elif command == 'rm':
-        recursive = False
-        force = False
-        patterns = []
-        for arg in args:
-            if arg == '-r':
-                recursive = True
-            elif arg == '-f':
-                force = True
-            else:
-                patterns.append(arg)
-        if patterns:
-            remove_item(patterns, recursive=recursive, force=force)
-        else:
-            print(f"{RED}rm: missing operand{RESET}")
-    elif command == 'cp':
-        if len(args) >= 2:
-            copy_item(args[0], args[1])
-        else:
-            print(f"{RED}cp: missing file operand{RESET}")
-    elif command == 'mv':
-        if len(args) >= 2:
-            move_item(args[0], args[1])
-        else:
-            print(f"{RED}mv: missing file operand{RESET}")
-    elif command == 'pwd':
-        print_working_directory()
-    elif command == 'alias':
-        if args:
-            for arg in args:
-                if '=' in arg:
-                    name, cmd = arg.split('=', 1)
-                    set_alias(name, cmd)
-                else:
-                    print(f"{YELLOW}{arg}='{aliases.get(arg, '')}'{RESET}")
-        else:
-            for name, cmd in aliases.items():
-                print(f"{YELLOW}{name}='{cmd}'{RESET}")
-    elif command == 'unalias':
-        if args:
-            remove_alias(args[0])
-        else:
-            print(f"{RED}unalias: missing operand{RESET}")
-    elif command == 'export':
-        if args and '=' in args[0]:
-            name, value = args[0].split('=', 1)
-            set_environment_variable(name, value)
-        else:
-            print(f"{RED}export: invalid format. Use 'export NAME=value'{RESET}")
-    elif command == 'echo':
-        output = ' '.join(args)
-        # Expand environment variables
-        output = os.path.expandvars(output)
-        print(output)
-    elif command == 'jobs':
-        list_jobs()
-    elif command == 'fg':
-        if args:
-            try:
-                job_id = int(args[0])
-                bring_job_to_foreground(job_id)
-            except ValueError:
-                print(f"{RED}fg: argument must be a job ID{RESET}")
-        else:
-            print(f"{RED}fg: job ID missing{RESET}")
-    elif command == 'help':
-        if args:
-            display_command_help(args[0])
-        else:
-            display_help()
-    elif command == 'source':
-        if args:
-            execute_script(args[0], process_command)
-        else:
-            print(f"{RED}source: filename argument required{RESET}")
-    else:
-        # Execute external command
-        if background:
-            thread = threading.Thread(target=execute_command, args=(command_input,))
-            thread.start()
-            add_job(thread, command_input)
-        else:
-            execute_command(command_input)
+
+from logs import setup_logging
+
+from constants import RED, GREEN, YELLOW, RESET, shell_state
+from utils import setup_autocomplete, load_configuration
+from prompt import get_prompt
+from shell import process_command
+from parser import is_compound
+
+# Log to a rotated JSON file in the user's state directory, written by a background thread
+setup_logging()
+
+def run_batch(options):
+    """Run a -c command string or a script file without readline, prompt or history."""
+    from scripts import compile_source, execute_script, run_nodes
+    if options.command is not None:
+        return run_nodes(compile_source(options.command))
+    shell_state['name'] = options.script
+    shell_state['positional'] = options.arguments
+    return execute_script(options.script)
+
+class StartupProfile:
+    """Time each startup phase and report them on stderr before the first prompt."""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.phases = [('imports', time.perf_counter() - _started)]
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        for phase, seconds in self.phases:
+            sys.stderr.write(f"{phase:<24}{seconds * 1000:8.2f} ms\n")
+        sys.stderr.write(f"{'total':<24}{(self.last - _started) * 1000:8.2f} ms\n")
+        self.enabled = False
+
+def parse_arguments(argv):
+    """Return the parsed command line, or None when there are no arguments."""
+    if not argv:
+        # The common interactive start skips importing argparse altogether
+        return None
+    import argparse
+    arg_parser = argparse.ArgumentParser(description='Enhanced Custom Shell')
+    arg_parser.add_argument('-c', dest='command', help='run COMMAND and exit')
+    arg_parser.add_argument('--startup-profile', action='store_true',
+                            help='print the time spent in each startup phase')
+    arg_parser.add_argument('--serve', action='store_true',
+                            help='run as a daemon serving commands from client.py over a Unix socket')
+    arg_parser.add_argument('--socket', help='socket path for --serve (default: in $XDG_RUNTIME_DIR or /tmp)')
+    arg_parser.add_argument('script', nargs='?', help='run the commands in SCRIPT and exit')
+    arg_parser.add_argument('arguments', nargs=argparse.REMAINDER, help='arguments of SCRIPT, as $1, $2...')
+    return arg_parser.parse_args(argv)
 
 def main():
+    options = parse_arguments(sys.argv[1:])
+    if options is not None and (options.command is not None or options.script is not None):
+        sys.exit(run_batch(options))
+    if options is not None and options.serve:
+        from server import serve
+        load_configuration()
+        sys.exit(serve(options.socket))
+
+    profile = StartupProfile(options is not None and options.startup_profile)
+    profile.mark('arguments')
+    from jobs import enable_job_control, notify_finished
+    shell_state['interactive'] = True
+    enable_job_control()
+    profile.mark('job control')
     print(f"{GREEN}Welcome to Enhanced Custom Shell! Type 'help' to see available commands. Type 'exit' to quit.{RESET}")
+    from autocomplete import autocomplete_commands
     setup_autocomplete(autocomplete_commands)
-    load_configuration(process_command)
+    profile.mark('readline')
+    rc = load_configuration()
+    profile.mark(f"rc ({rc or 'none'})")
+    from history import load_readline, record
+    load_readline()
+    profile.mark('history')
 
     while True:
         try:
+            notify_finished()
             prompt = get_prompt()
-            command_input = input(prompt).strip()
+            if profile.enabled:
+                profile.mark('first prompt')
+                profile.report()
+            line = input(prompt)
+            if is_compound(line):
+                from interpreter import incomplete
+                # Keep reading until the if, loop, case or function is closed
+                while incomplete(line):
+                    line += '\n' + input('> ')
+            command_input = line.strip()
             if command_input:
-                process_command(command_input)
+                status = process_command(command_input)
+                # Only lines typed at the prompt are saved, never rc or sourced lines
+                record(line, status)
         except KeyboardInterrupt:
             print(f"\n{YELLOW}Interrupted. Type 'exit' to quit.{RESET}")
         except EOFError:
@@ -223,7 +116,7 @@ def main():
             break
         except Exception as e:
             logging.error(f"An error occurred: {e}", exc_info=True)
-            print(f"{RED}An error occurred: {e}{RESET}")
+            print(f"{RED}An error occurred: {e}{RESET}", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
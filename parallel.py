@@ -0,0 +1,244 @@
+# parallel.py
+
+import os
+import sys
+import time
+import signal
+import logging
+import selectors
+from constants import RED, RESET
+from commands import CommandNotFound, spawn
+from jobs import Job, add_process, wait_for
+from progress import Progress
+
+# Size of the reads from a job's stdout and stderr pipes
+CHUNK_SIZE = 64 * 1024
+# Highest exit status, like GNU parallel: the number of failed jobs, capped
+MAX_FAILED_STATUS = 101
+
+class Task:
+    """One job of a 'parallel' run: its process, its pipes and the output not yet written."""
+
+    def __init__(self, index, argv):
+        self.index = index
+        self.argv = argv
+        self.job = Job(' '.join(argv))
+        self.open = 0
+        # Per stream: complete output (grouped) or the last unfinished line (line-buffered)
+        self.pending = {1: [], 2: []}
+        self.status = None
+
+class Parallel:
+    """Run commands on a bounded pool of processes and write their output without mixing it.
+
+    By default each job's output is written in one piece when it finishes.
+    With ``line_buffer`` whole lines are written as soon as they are complete.
+    With ``keep_order`` output follows the order of the arguments: only the
+    oldest running job may write while it runs, the others wait their turn.
+    """
+
+    def __init__(self, workers, keep_order=False, line_buffer=False, progress=False):
+        self.workers = workers
+        self.keep_order = keep_order
+        self.line_buffer = line_buffer
+        self.progress = progress
+        self.started = time.monotonic()
+        self.done = 0
+        self.failed = 0
+        self.running = {}
+        self.finished = {}
+        self.next_output = 0
+        self.selector = selectors.DefaultSelector()
+        self._progress = Progress(self.status_line)
+
+    def status_line(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"{self.done} jobs done, {self.failed} failed, {len(self.running)} running "
+                f"({self.done / elapsed:.1f} jobs/s)")
+
+    def start(self, task):
+        """Spawn a task with its output going to two pipes watched by the selector."""
+        opened = []
+        reads = []
+        try:
+            opened.append(os.open(os.devnull, os.O_RDONLY))
+            for _ in range(2):
+                read_fd, write_fd = os.pipe()
+                reads.append(read_fd)
+                opened.append(write_fd)
+            pid = spawn(task.argv, dict(enumerate(opened)))
+        except (CommandNotFound, OSError) as e:
+            for fd in reads:
+                os.close(fd)
+            if isinstance(e, CommandNotFound):
+                self._failed_start(task, 127, f"parallel: command not found: {task.argv[0]}")
+            else:
+                self._failed_start(task, 126, f"parallel: {task.argv[0]}: {e.strerror or e}")
+            return
+        finally:
+            # The child holds its own copies now
+            for fd in opened:
+                os.close(fd)
+        add_process(task.job, pid)
+        self.running[task.index] = task
+        for stream, fd in enumerate(reads, 1):
+            self.selector.register(fd, selectors.EVENT_READ, (task, stream))
+        task.open = 2
+
+    def _failed_start(self, task, status, message):
+        logging.error(message)
+        task.pending[2].append(f"{RED}{message}{RESET}\n".encode())
+        self.running[task.index] = task
+        self._finish(task, status)
+
+    def poll(self):
+        """Wait for output of the running tasks and handle it."""
+        for key, _ in self.selector.select():
+            task, stream = key.data
+            chunk = os.read(key.fd, CHUNK_SIZE)
+            if chunk:
+                self._collect(task, stream, chunk)
+                continue
+            self.selector.unregister(key.fd)
+            os.close(key.fd)
+            task.open -= 1
+            if task.open == 0:
+                self._finish(task, wait_for(task.job))
+
+    def _may_write(self, task):
+        return not self.keep_order or task.index == self.next_output
+
+    def _collect(self, task, stream, chunk):
+        pending = task.pending[stream]
+        pending.append(chunk)
+        if not self.line_buffer or not self._may_write(task):
+            return
+        data = b''.join(pending)
+        end = data.rfind(b'\n') + 1
+        pending[:] = [data[end:]] if end < len(data) else []
+        if end:
+            self._write(stream, data[:end])
+
+    def _finish(self, task, status):
+        task.status = status
+        del self.running[task.index]
+        self.done += 1
+        if status:
+            self.failed += 1
+        self.finished[task.index] = task
+        if not self.keep_order:
+            self._flush(self.finished.pop(task.index))
+            return
+        # Write every finished task whose turn has come, then let the next one stream
+        while self.next_output in self.finished:
+            self._flush(self.finished.pop(self.next_output))
+            self.next_output += 1
+        head = self.running.get(self.next_output)
+        if head is not None and self.line_buffer:
+            for stream in (1, 2):
+                self._collect(head, stream, b'')
+
+    def _flush(self, task):
+        for stream in (1, 2):
+            data = b''.join(task.pending[stream])
+            task.pending[stream] = []
+            if data:
+                self._write(stream, data)
+
+    def _write(self, stream, data):
+        target = sys.stdout if stream == 1 else sys.stderr
+        buffer = getattr(target, 'buffer', None)
+        if buffer is None:
+            # An in-process pipe to another builtin takes text; surrogateescape keeps every byte
+            target.write(data.decode(errors='surrogateescape'))
+        else:
+            # Job output is passed on as it is, binary or not
+            target.flush()
+            buffer.write(data)
+        target.flush()
+
+    def run(self, commands):
+        """Run every argv of the iterable commands; return the exit status of the run."""
+        if self.progress:
+            self._progress.start()
+        try:
+            index = 0
+            for argv in commands:
+                while len(self.running) >= self.workers:
+                    self.poll()
+                self.start(Task(index, argv))
+                index += 1
+            while self.running:
+                self.poll()
+        except KeyboardInterrupt:
+            for task in list(self.running.values()):
+                for pid in task.job.stages:
+                    try:
+                        os.kill(pid, signal.SIGTERM)
+                    except (OSError, TypeError):
+                        pass
+            raise
+        finally:
+            self._progress.stop()
+            self.selector.close()
+        if self.progress:
+            elapsed = time.monotonic() - self.started
+            sys.stderr.write(f"{self.status_line()} in {elapsed:.2f}s\n")
+        return min(self.failed, MAX_FAILED_STATUS)
+
+def build_command(template, arguments):
+    """Return the argv of one job: '{}' in the template is replaced by the arguments, else they are appended."""
+    if not any('{}' in word for word in template):
+        return template + arguments
+    joined = ' '.join(arguments)
+    return [word.replace('{}', joined) for word in template]
+
+def _stdin_arguments():
+    for line in sys.stdin:
+        line = line.rstrip('\n')
+        if line:
+            yield [line]
+
+def builtin_parallel(args):
+    workers = os.cpu_count() or 1
+    options = {'keep_order': False, 'line_buffer': False, 'progress': False}
+    args = list(args)
+    while args and args[0].startswith('-'):
+        arg = args.pop(0)
+        if arg == '--':
+            break
+        if arg in ('-j', '--jobs') or arg.startswith(('-j', '--jobs=')):
+            # The number may also be attached: -j2, --jobs=2
+            if arg in ('-j', '--jobs'):
+                value = args.pop(0) if args else ''
+            else:
+                value = arg.partition('=')[2] if arg.startswith('--') else arg[2:]
+            try:
+                workers = max(1, int(value))
+            except ValueError:
+                print(f"{RED}parallel: -j needs a number of jobs{RESET}", file=sys.stderr)
+                return 1
+        elif arg in ('-k', '--keep-order'):
+            options['keep_order'] = True
+        elif arg == '--line-buffer':
+            options['line_buffer'] = True
+        elif arg in ('-v', '--progress'):
+            options['progress'] = True
+        else:
+            print(f"{RED}parallel: unknown option '{arg}'{RESET}", file=sys.stderr)
+            return 1
+    if ':::' in args:
+        separator = args.index(':::')
+        template, values = args[:separator], args[separator + 1:]
+        arguments = ([value] for value in values)
+    else:
+        template = args
+        if sys.stdin.isatty():
+            print(f"{RED}parallel: no arguments: use 'parallel COMMAND ::: ARG...' or pipe them in{RESET}", file=sys.stderr)
+            return 1
+        arguments = _stdin_arguments()
+    if not template:
+        print(f"{RED}parallel: missing command{RESET}", file=sys.stderr)
+        return 1
+    commands = (build_command(template, values) for values in arguments)
+    return Parallel(workers, **options).run(commands)
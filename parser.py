@@ -0,0 +1,415 @@
+# parser.py
+
+import re
+from functools import lru_cache
+from constants import aliases
+
+WORD = 'word'
+OP = 'op'
+IO_NUMBER = 'io'
+
+# Characters that end a word and start an operator
+OPERATOR_CHARS = '|&;<>()'
+# Operators, longest first so that '>>' wins over '>'
+OPERATORS = ('&>>', '&&', '||', '>>', '>&', '<&', '&>', '|', '&', ';', '<', '>', '(', ')')
+REDIRECT_OPS = ('<', '>', '>>', '>&', '<&', '&>', '&>>')
+# Operators separating the pipelines of a command list
+LIST_OPS = (';', '&&', '||', '&')
+# Leading NAME=value words of a command
+ASSIGNMENT_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*=')
+# 'name()' starting a function definition
+FUNCTION_RE = re.compile(r'([A-Za-z_][A-Za-z0-9_.-]*)\s*\(\s*\)\s*')
+# A reserved word starting a compound command, run by the interpreter, at the start of a command
+_COMPOUND_RE = re.compile(r'(?:^|[;|&])\s*(?:if|for|while|until|case|function|\{)(?:\s|$)')
+# Characters that may start an expansion somewhere in a word
+_DYNAMIC = re.compile(r'[$`{*?\[]')
+# Number of compiled lines kept by compile_command()
+PARSE_CACHE_SIZE = 1024
+
+class ParseError(Exception):
+    """Raised when a command line cannot be parsed."""
+
+class Redirect:
+    """A single redirection such as '< input', '2>> log' or '2>&1'."""
+
+    def __init__(self, fd, op, target):
+        self.fd = fd
+        self.op = op
+        self.target = target
+
+    def __repr__(self):
+        return f"Redirect({self.fd!r}, {self.op!r}, {self.target!r})"
+
+class Command:
+    """A simple command: assignments, raw words and redirections.
+
+    ``argv`` holds the final arguments when no word needs expansion at run
+    time, so cached commands skip quote removal entirely; otherwise it is None.
+    """
+
+    def __init__(self, words, redirects, assignments=None):
+        self.words = words
+        self.redirects = redirects
+        self.assignments = assignments or []
+        if any(is_dynamic(word) for word in words):
+            self.argv = None
+        else:
+            self.argv = [unquote(word) for word in words]
+
+    def __repr__(self):
+        return f"Command({self.words!r}, {self.redirects!r}, {self.assignments!r})"
+
+class Pipeline:
+    """Commands connected with '|', optionally run in the background.
+
+    ``negated`` is set by a leading '!', which inverts the exit status.
+    """
+
+    def __init__(self, commands, background=False, negated=False):
+        self.commands = commands
+        self.background = background
+        self.negated = negated
+
+    def __repr__(self):
+        return f"Pipeline({self.commands!r}, background={self.background!r}, negated={self.negated!r})"
+
+class CommandList:
+    """Pipelines separated by ';', '&&', '||' or '&', run left to right.
+
+    ``items`` holds (connector, pipeline) pairs, where connector is the
+    operator before the pipeline: None for the first, ';' after ';' and '&',
+    '&&' or '||'. A pipeline followed by '&' is a background one.
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+    def __repr__(self):
+        return f"CommandList({self.items!r})"
+
+def is_dynamic(word):
+    """Tell whether a raw word needs expansion when the command runs.
+
+    That is any word with a substitution, parameter, brace, glob or leading
+    tilde; the others are final once their quotes are removed.
+    """
+    return _DYNAMIC.search(word) is not None or word.startswith('~')
+
+def is_compound(line):
+    """Tell whether a line has a compound command or starts a function definition."""
+    return _COMPOUND_RE.search(line) is not None or FUNCTION_RE.match(line) is not None
+
+def skip_single_quotes(line, i):
+    """Return the index just past the single-quoted string starting at i."""
+    end = line.find("'", i + 1)
+    if end == -1:
+        raise ParseError("unterminated single quote")
+    return end + 1
+
+def skip_double_quotes(line, i):
+    """Return the index just past the double-quoted string starting at i."""
+    i += 1
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c == '\\':
+            i += 2
+        elif c == '"':
+            return i + 1
+        elif c == '$' and line.startswith('$(', i):
+            i = skip_substitution(line, i)
+        elif c == '$' and line.startswith('${', i):
+            i = skip_parameter(line, i)
+        elif c == '`':
+            i = skip_backticks(line, i)
+        else:
+            i += 1
+    raise ParseError("unterminated double quote")
+
+def skip_backticks(line, i):
+    """Return the index just past the backtick substitution starting at i."""
+    i += 1
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c == '\\':
+            i += 2
+        elif c == '`':
+            return i + 1
+        else:
+            i += 1
+    raise ParseError("unterminated backtick substitution")
+
+def skip_substitution(line, i):
+    """Return the index just past the '$(...)' starting at i, honouring nesting and quotes."""
+    i += 2
+    depth = 1
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == "'":
+            i = skip_single_quotes(line, i)
+            continue
+        if c == '"':
+            i = skip_double_quotes(line, i)
+            continue
+        if c == '`':
+            i = skip_backticks(line, i)
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise ParseError("unterminated command substitution")
+
+def skip_parameter(line, i):
+    """Return the index just past the '${...}' starting at i, honouring nesting and quotes."""
+    i += 2
+    depth = 1
+    n = len(line)
+    while i < n:
+        c = line[i]
+        if c == '\\':
+            i += 2
+            continue
+        if c == "'":
+            i = skip_single_quotes(line, i)
+            continue
+        if c == '"':
+            i = skip_double_quotes(line, i)
+            continue
+        if c == '`':
+            i = skip_backticks(line, i)
+            continue
+        if c == '$' and line.startswith('$(', i):
+            i = skip_substitution(line, i)
+            continue
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    raise ParseError("unterminated parameter expansion")
+
+def tokenize(line):
+    """Split a command line into (kind, value) tokens.
+
+    Words keep their quotes so that later stages can tell quoted text apart;
+    use unquote() to get the final argument.
+    """
+    tokens = []
+    n = len(line)
+    i = 0
+    start = None
+    while i < n:
+        c = line[i]
+        if c in ' \t\n':
+            if start is not None:
+                tokens.append((WORD, line[start:i]))
+                start = None
+            i += 1
+            continue
+        if c in OPERATOR_CHARS:
+            if start is not None:
+                word = line[start:i]
+                if c in '<>' and word.isdigit():
+                    tokens.append((IO_NUMBER, int(word)))
+                else:
+                    tokens.append((WORD, word))
+                start = None
+            for op in OPERATORS:
+                if line.startswith(op, i):
+                    tokens.append((OP, op))
+                    i += len(op)
+                    break
+            continue
+        if start is None:
+            if c == '#':
+                # Comment until the end of the line
+                break
+            start = i
+        if c == '\\':
+            i += 2
+        elif c == "'":
+            i = skip_single_quotes(line, i)
+        elif c == '"':
+            i = skip_double_quotes(line, i)
+        elif c == '`':
+            i = skip_backticks(line, i)
+        elif c == '$' and line.startswith('$(', i):
+            i = skip_substitution(line, i)
+        elif c == '$' and line.startswith('${', i):
+            i = skip_parameter(line, i)
+        else:
+            i += 1
+    if start is not None:
+        tokens.append((WORD, line[start:min(i, n)]))
+    return tokens
+
+def unquote(word):
+    """Remove quotes and backslash escapes from a raw word."""
+    if '\\' not in word and "'" not in word and '"' not in word:
+        return word
+    out = []
+    n = len(word)
+    i = 0
+    while i < n:
+        c = word[i]
+        if c == "'":
+            end = word.index("'", i + 1)
+            out.append(word[i + 1:end])
+            i = end + 1
+        elif c == '"':
+            i += 1
+            while i < n and word[i] != '"':
+                if word[i] == '\\' and i + 1 < n and word[i + 1] in '$`"\\\n':
+                    out.append(word[i + 1])
+                    i += 2
+                else:
+                    out.append(word[i])
+                    i += 1
+            i += 1
+        elif c == '\\':
+            out.append(word[i + 1:i + 2])
+            i += 2
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+def parse_pipeline(line):
+    """Parse a command line into a Pipeline of Commands."""
+    return _parse_tokens(tokenize(line))
+
+def parse_list(line):
+    """Parse a command line into a CommandList, or a Pipeline when it is a single one."""
+    tokens = tokenize(line)
+    items = []
+    connector = None
+    start = 0
+    n = len(tokens)
+    for i, (kind, value) in enumerate(tokens):
+        if kind != OP or value not in LIST_OPS or (value == '&' and i == n - 1):
+            continue
+        # A trailing '&' stays with its pipeline, which then runs in the background
+        end = i + 1 if value == '&' else i
+        pipeline = _parse_tokens(tokens[start:end])
+        if not pipeline.commands:
+            raise ParseError(f"syntax error near unexpected token '{value}'")
+        items.append((connector, pipeline))
+        connector = ';' if value == '&' else value
+        start = i + 1
+    if not items:
+        return _parse_tokens(tokens)
+    pipeline = _parse_tokens(tokens[start:])
+    if pipeline.commands:
+        items.append((connector, pipeline))
+    elif connector in ('&&', '||'):
+        raise ParseError("syntax error: missing command")
+    return CommandList(items)
+
+def _parse_tokens(tokens):
+    commands = []
+    words = []
+    redirects = []
+    assignments = []
+    background = False
+    negated = bool(tokens) and tokens[0] == (WORD, '!')
+    i = 1 if negated else 0
+    n = len(tokens)
+    while i < n:
+        kind, value = tokens[i]
+        if kind == WORD:
+            match = ASSIGNMENT_RE.match(value) if not words else None
+            if match:
+                assignments.append((value[:match.end() - 1], value[match.end():]))
+            else:
+                words.append(value)
+            i += 1
+            continue
+        fd = None
+        if kind == IO_NUMBER:
+            fd = value
+            i += 1
+            if i >= n:
+                raise ParseError("syntax error near unexpected token 'newline'")
+            kind, value = tokens[i]
+        if value in REDIRECT_OPS:
+            if i + 1 >= n or tokens[i + 1][0] != WORD:
+                raise ParseError(f"syntax error near unexpected token '{value}'")
+            if fd is None:
+                fd = 0 if value in ('<', '<&') else 1
+            redirects.append(Redirect(fd, value, tokens[i + 1][1]))
+            i += 2
+        elif value == '|':
+            if not words:
+                raise ParseError("syntax error near unexpected token '|'")
+            commands.append(Command(words, redirects, assignments))
+            words = []
+            redirects = []
+            assignments = []
+            i += 1
+        elif value == '&' and i == n - 1:
+            background = True
+            i += 1
+        else:
+            raise ParseError(f"syntax error near unexpected token '{value}'")
+    if not words and not assignments:
+        if commands or redirects or negated:
+            raise ParseError("syntax error: missing command")
+        return Pipeline([], background)
+    if not words and commands:
+        raise ParseError("syntax error: missing command")
+    commands.append(Command(words, redirects, assignments))
+    return Pipeline(commands, background, negated)
+
+def expand_aliases(pipeline):
+    """Return a Pipeline, or CommandList, with aliases substituted for the first word of each command."""
+    if isinstance(pipeline, CommandList):
+        return CommandList([(connector, expand_aliases(item)) for connector, item in pipeline.items])
+    if not any(command.words and command.words[0] in aliases for command in pipeline.commands):
+        return pipeline
+    commands = []
+    for command in pipeline.commands:
+        commands.extend(_expand_alias(command, set()))
+    return Pipeline(commands, pipeline.background, pipeline.negated)
+
+def _expand_alias(command, seen):
+    """Expand the alias naming a command, recursively but at most once per alias."""
+    if not command.words:
+        return [command]
+    name = command.words[0]
+    if name not in aliases or name in seen:
+        return [command]
+    seen.add(name)
+    expansion = parse_pipeline(aliases[name]).commands
+    if not expansion:
+        rest = Command(command.words[1:], command.redirects, command.assignments)
+        return _expand_alias(rest, seen) if rest.words else [rest]
+    last = expansion[-1]
+    merged = Command(last.words + command.words[1:], last.redirects + command.redirects, last.assignments)
+    commands = expansion[:-1] + [merged]
+    first = commands[0]
+    commands[0] = Command(first.words, first.redirects, command.assignments + first.assignments)
+    return _expand_alias(commands[0], seen) + commands[1:]
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _compile(line, alias_version):
+    return expand_aliases(parse_list(line))
+
+def compile_command(line):
+    """Parse a line into an alias-expanded Pipeline, or CommandList for a command list.
+
+    Results are cached on the raw line and the alias-table version, so a line
+    that runs again (rc files, sourced scripts, loops) skips tokenization.
+    Callers must treat the returned AST as read-only.
+    """
+    return _compile(line, aliases.version)
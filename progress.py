@@ -0,0 +1,45 @@
+# progress.py
+
+import sys
+import threading
+
+# Seconds between two progress lines
+PROGRESS_INTERVAL = 0.5
+
+class Progress:
+    """A status line redrawn on stderr while a long-running builtin works.
+
+    ``status_line`` is called from a background thread; nothing is drawn
+    unless stderr is a terminal.
+    """
+
+    def __init__(self, status_line, interval=PROGRESS_INTERVAL):
+        self.status_line = status_line
+        self.interval = interval
+        self._thread = None
+        self._done = threading.Event()
+
+    def start(self):
+        if sys.stderr.isatty():
+            self._thread = threading.Thread(target=self._loop, name='progress', daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        while not self._done.wait(self.interval):
+            sys.stderr.write(f"\r{self.status_line()}\033[K")
+            sys.stderr.flush()
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+            sys.stderr.write('\r\033[K')
+            sys.stderr.flush()
+
+def format_size(size):
+    """Format a byte count with a binary unit, like '1.5 MiB'."""
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
@@ -0,0 +1,115 @@
+# prompt.py
+
+import os
+import getpass
+import logging
+from constants import GREEN, BLUE, YELLOW, MAGENTA, RED, RESET, shell_state
+
+# Longest time a prompt render waits for expensive segments, in seconds
+DEFAULT_TIMEOUT = 0.05
+
+# user@host never changes while the shell runs, so it is looked up once
+_static = {}
+_executor = None
+
+class Segment:
+    """A prompt segment computed in the background.
+
+    Each render starts a new computation if the previous one has finished and
+    waits at most ``timeout`` for it; a slow segment shows its last value.
+    """
+
+    def __init__(self, name, compute, timeout=DEFAULT_TIMEOUT, color=MAGENTA):
+        self.name = name
+        self.compute = compute
+        self.timeout = timeout
+        self.color = color
+        self.value = ''
+        self.future = None
+
+    def refresh(self):
+        """Start a computation unless one is already in flight; return it."""
+        if self.future is None or self.future.done():
+            self.collect()
+            self.future = _get_executor().submit(self.compute)
+        return self.future
+
+    def collect(self):
+        """Take the result of a finished computation, keeping the old value otherwise."""
+        if self.future is not None and self.future.done():
+            try:
+                self.value = self.future.result() or ''
+            except Exception as e:
+                logging.error(f"Prompt segment {self.name} failed: {e}", exc_info=True)
+                self.value = ''
+        return self.value
+
+# Expensive segments shown before the '$', in the order they were added
+segments = {}
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        from concurrent.futures import ThreadPoolExecutor
+        _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prompt')
+    return _executor
+
+def git_branch():
+    """Return the current git branch by reading .git/HEAD, without running git."""
+    directory = shell_state.get('cwd') or os.getcwd()
+    while True:
+        head = os.path.join(directory, '.git', 'HEAD')
+        if os.path.isfile(head):
+            with open(head) as f:
+                ref = f.read().strip()
+            if ref.startswith('ref: refs/heads/'):
+                return ref[len('ref: refs/heads/'):]
+            return ref[:7]
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return ''
+        directory = parent
+
+def exit_status():
+    status = shell_state['last_status']
+    return str(status) if status else ''
+
+def job_count():
+    from jobs import jobs_list
+    return f"{len(jobs_list)} jobs" if jobs_list else ''
+
+def command_output(command):
+    """Return a segment function showing the output of a shell command."""
+    def compute():
+        from substitution import run_substitution
+        return run_substitution(command).split('\n', 1)[0]
+    return compute
+
+# Segments that can be enabled by name with 'prompt add NAME'
+BUILTIN_SEGMENTS = {
+    'git': (git_branch, YELLOW),
+    'status': (exit_status, RED),
+    'jobs': (job_count, MAGENTA),
+}
+
+def add_segment(name, compute, timeout=DEFAULT_TIMEOUT, color=MAGENTA):
+    segments[name] = Segment(name, compute, timeout, color)
+
+def remove_segment(name):
+    return segments.pop(name, None) is not None
+
+def get_prompt():
+    """Generate the command prompt."""
+    if not _static:
+        _static['user_host'] = f"{GREEN}{getpass.getuser()}@{os.uname().nodename}{RESET}"
+    current_dir = shell_state.get('cwd')
+    if current_dir is None:
+        current_dir = shell_state['cwd'] = os.getcwd()
+    extra = ''
+    if segments:
+        from concurrent.futures import wait
+        futures = [segment.refresh() for segment in segments.values()]
+        wait(futures, timeout=max(segment.timeout for segment in segments.values()))
+        values = [(segment.color, segment.collect()) for segment in segments.values()]
+        extra = ''.join(f" {color}({value}){RESET}" for color, value in values if value)
+    return f"{_static['user_host']}:{BLUE}{current_dir}{RESET}{extra}$ "
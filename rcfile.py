@@ -0,0 +1,134 @@
+# rcfile.py
+
+import os
+import re
+import logging
+import marshal
+from constants import aliases, shell_state
+from parser import Pipeline, unquote
+from utils import write_atomically
+
+RC_FILE = os.path.expanduser('~/.custom_shellrc')
+# Bump whenever the snapshot layout changes so stale files are ignored
+SNAPSHOT_FORMAT = 3
+SNAPSHOT_FILE = os.path.join(os.path.expanduser(os.environ.get('XDG_CACHE_HOME', '~/.cache')),
+                             'custom_shell', 'rc.snapshot')
+# Builtins whose whole effect is the alias table, the environment or the cwd
+SNAPSHOT_BUILTINS = {'alias', 'unalias', 'export', 'cd'}
+
+_VARIABLE = re.compile(r'\$\{?([A-Za-z_][A-Za-z0-9_]*)')
+# Expansions reading more than the variables named above: command substitutions
+# and arithmetic, backticks, the pid, lengths
+_UNTRACKED = re.compile(r'\$\(|`|\$\$|\$\{#')
+_QUOTED = re.compile(r"'[^']*'|\"(?:\\.|[^\"\\])*\"|\\.")
+
+def _globs(word):
+    """Tell whether a raw word has an unquoted glob, whose result depends on the file system."""
+    unquoted = _QUOTED.sub('', word)
+    return '*' in unquoted or '?' in unquoted or '[' in unquoted
+
+def _key(path):
+    stats = os.stat(path)
+    return (SNAPSHOT_FORMAT, path, stats.st_mtime_ns, stats.st_size)
+
+def _inputs(names, cwd):
+    """The outside state an rc run depends on: the variables it reads, HOME and the cwd."""
+    values = {name: os.environ.get(name) for name in names}
+    values['HOME'] = os.environ.get('HOME')
+    return {'variables': values, 'cwd': cwd}
+
+def restore_snapshot(path=RC_FILE):
+    """Apply the saved state of an unchanged rc file; return True if it was used."""
+    try:
+        with open(SNAPSHOT_FILE, 'rb') as f:
+            snapshot = marshal.load(f)
+        if snapshot['key'] != _key(path):
+            return False
+        inputs = snapshot['inputs']
+        if inputs['cwd'] != os.getcwd() or any(
+                os.environ.get(name) != value for name, value in inputs['variables'].items()):
+            return False
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        return False
+    for name, value in snapshot['set'].items():
+        os.environ[name] = value
+    for name in snapshot['unset']:
+        os.environ.pop(name, None)
+    if 'PATH' in snapshot['set'] or 'PATH' in snapshot['unset']:
+        import cmdhash
+        cmdhash.clear()
+    aliases.update(snapshot['aliases'])
+    if snapshot['cwd'] != inputs['cwd']:
+        os.chdir(snapshot['cwd'])
+        shell_state['cwd'] = None
+    return True
+
+def _snapshot_safe(nodes, records):
+    """Tell whether an rc run only touched aliases, variables and the cwd, silently and without errors."""
+    if len(records) != len(nodes):
+        return False
+    for (line, node), record in zip(nodes, records):
+        if not isinstance(node, Pipeline) or record['command'] != line or len(node.commands) != 1:
+            return False
+        command = node.commands[0]
+        if node.background or command.redirects or _UNTRACKED.search(line):
+            return False
+        if any(_globs(word) for word in command.words):
+            return False
+        if command.words:
+            name = unquote(command.words[0])
+            if name not in SNAPSHOT_BUILTINS or name in aliases:
+                return False
+        if record['path'] not in ('assignment', 'builtin') or record['status'] or record['output_bytes']:
+            return False
+    return True
+
+def save_snapshot(path, inputs, environment, nodes, records):
+    """Store the state left by an rc run, if nothing else happened during it."""
+    if not _snapshot_safe(nodes, records):
+        return False
+    snapshot = {
+        'key': _key(path),
+        'inputs': inputs,
+        'set': {name: value for name, value in os.environ.items() if environment.get(name) != value},
+        'unset': [name for name in environment if name not in os.environ],
+        'aliases': dict(aliases),
+        'cwd': os.getcwd(),
+    }
+    try:
+        write_atomically(SNAPSHOT_FILE, lambda f: marshal.dump(snapshot, f))
+    except OSError as e:
+        logging.error(f"Could not write rc snapshot {SNAPSHOT_FILE}: {e}")
+        return False
+    return True
+
+def load_rc(path=RC_FILE):
+    """Load the rc file and return how: 'snapshot', 'executed' or None when there is none.
+
+    An rc file made only of alias, unalias, export, cd and assignments is run
+    once and its resulting state saved; later shells restore that state while
+    the file, the variables it reads, HOME and the starting directory are all
+    unchanged. A file using command substitutions is run on every start,
+    since their output cannot be known without running them.
+    """
+    if not os.path.isfile(path):
+        return None
+    if restore_snapshot(path):
+        return 'snapshot'
+    from scripts import compile_script, run_nodes
+    from shell import session_records
+    try:
+        nodes = compile_script(path)
+        with open(path) as f:
+            names = set(_VARIABLE.findall(f.read()))
+    except OSError as e:
+        logging.error(f"Error executing script: {e}", exc_info=True)
+        return None
+    inputs = _inputs(names, os.getcwd())
+    environment = dict(os.environ)
+    start = len(session_records)
+    run_nodes(nodes)
+    # A full deque no longer tells which records are the rc's; that file is just not snapshotted
+    if start + len(nodes) <= session_records.maxlen:
+        save_snapshot(path, inputs, environment, nodes, list(session_records)[start:])
+    return 'executed'
@@ -0,0 +1,228 @@
+# registry.py
+
+import sys
+import importlib
+from constants import RED, RESET
+
+class Builtin:
+    """A builtin command, declared once with its handler, argument spec, help and options.
+
+    The handler is named by module and function and only imported the first
+    time the builtin runs, so heavy builtins cost nothing until used.
+    ``external`` marks builtins standing in for a system tool of the same
+    name. It names a function of the module that tells whether the builtin
+    supports the given arguments. When it does not, the tool runs instead.
+    ``background`` marks builtins that run in a forked copy of the shell when
+    started with '&', so they show up in the job table like other jobs.
+    ``stateless`` marks builtins that leave the shell's state (cwd,
+    variables, aliases, jobs) alone: they may run in a thread of the shell
+    anywhere in a pipeline. Other builtins run in a subshell there, unless
+    they are the last stage.
+    """
+
+    def __init__(self, name, module, function, usage, summary, options=None, min_args=0, missing=None,
+                 external=False, background=False, stateless=False):
+        self.name = name
+        self.module = module
+        self.function = function
+        self.usage = usage
+        self.summary = summary
+        self.options = options or []
+        self.min_args = min_args
+        self.missing = missing or 'missing operand'
+        self.external = external
+        self.background = background
+        self.stateless = stateless
+        self._handler = None
+
+    @property
+    def handler(self):
+        if self._handler is None:
+            self._handler = getattr(importlib.import_module(self.module), self.function)
+        return self._handler
+
+    def handles(self, args):
+        """Tell whether the builtin supports args, rather than the system tool it stands in for."""
+        if not self.external:
+            return True
+        return getattr(importlib.import_module(self.module), self.external)(args)
+
+    def run(self, args):
+        """Check the argument spec, then run the handler and return its exit status."""
+        if len(args) < self.min_args:
+            print(f"{RED}{self.name}: {self.missing}{RESET}", file=sys.stderr)
+            return 1
+        status = self.handler(args)
+        return 0 if status is None else status
+
+# Builtins by name, in the order they are listed by 'help'
+BUILTINS = {}
+# Shell functions by name; they take precedence over builtins
+FUNCTIONS = {}
+
+def register(name, module, function, usage, summary, **spec):
+    """Declare a builtin command."""
+    BUILTINS[name] = Builtin(name, module, function, usage, summary, **spec)
+
+def lookup(name):
+    """Return the function or Builtin called name, or None for external commands."""
+    return FUNCTIONS.get(name) or BUILTINS.get(name)
+
+def resolve(argv):
+    """Return the function or Builtin that runs argv, or None when it is the external command.
+
+    A builtin standing in for a system tool gives way to that tool, if there
+    is one on PATH, for the arguments it does not support.
+    """
+    command = lookup(argv[0])
+    if command is None or not getattr(command, 'external', False) or command.handles(argv[1:]):
+        return command
+    import cmdhash
+    return command if cmdhash.resolve(argv[0]) is None else None
+
+def command_options():
+    """Return the completion options of every builtin, keyed by name."""
+    return {name: [flag for flag, _ in builtin.options] for name, builtin in BUILTINS.items()}
+
+register('cd', 'shell_builtins', 'builtin_cd', 'cd [path]',
+         "Change the current directory to 'path'.")
+register('ls', 'listing', 'builtin_ls', 'ls [options] [path ...]',
+         'List directory contents, in columns on a terminal.',
+         options=[('-l', 'Use a detailed listing.'), ('-a', 'Include hidden files.'),
+                  ('-R', 'List subdirectories recursively.'), ('-S', 'Sort by size, largest first.'),
+                  ('-t', 'Sort by modification time, newest first.'), ('-r', 'Reverse the sort order.'),
+                  ('-1', 'One entry per line.'), ('-C', 'List entries in columns.'),
+                  ('-U', 'Do not sort; print entries as they are read.'),
+                  ('-j', 'Stat entries with N threads, for network filesystems.')], stateless=True)
+register('mkdir', 'shell_builtins', 'builtin_mkdir', 'mkdir [name]',
+         "Create a new directory named 'name'.", min_args=1, stateless=True)
+register('rm', 'removal', 'builtin_rm', 'rm [-rfv] [--progress] [-j N] [file ...]',
+         "Remove files or directories.",
+         options=[('-r', 'Recursively remove directories and their contents.'),
+                  ('-f', 'Force removal without prompt.'),
+                  ('-v', 'Report progress (files/s, space freed) and a summary.'),
+                  ('--progress', 'Same as -v.'),
+                  ('-j', 'Remove subtrees with N threads.')], stateless=True)
+register('cp', 'copying', 'builtin_cp', 'cp [-rnuv] [--resume] [-j N] source... dest',
+         "Copy files or directories to 'dest', keeping permissions and timestamps.",
+         options=[('-r', 'Copy directories recursively.'),
+                  ('-n', 'Do not overwrite existing files.'),
+                  ('-u', 'Only copy files newer than the destination.'),
+                  ('--resume', 'Skip finished files and continue partial ones.'),
+                  ('-v', 'Report progress and throughput.'),
+                  ('--progress', 'Same as -v.'),
+                  ('-j', 'Copy N files at a time.')], stateless=True)
+register('mv', 'copying', 'builtin_mv', 'mv [-nuv] [-j N] source... dest',
+         "Move or rename files; across filesystems they are copied, then removed.",
+         options=[('-n', 'Do not overwrite existing files.'),
+                  ('-u', 'Only move files newer than the destination.'),
+                  ('-v', 'Report progress and throughput.'),
+                  ('--progress', 'Same as -v.'),
+                  ('-j', 'Copy N files at a time.')], stateless=True)
+register('find', 'search', 'builtin_find', 'find [path ...] [predicates]',
+         'Find files by name, type, size or age, walking subtrees in parallel.',
+         options=[('-name', 'Match the file name against a glob.'),
+                  ('-iname', 'Like -name, ignoring case.'),
+                  ('-path', 'Match the whole path against a glob.'),
+                  ('-type', "Match files 'f', directories 'd' or symlinks 'l'."),
+                  ('-size', 'Match the size: [+-]N[ckMG], in 512-byte blocks by default.'),
+                  ('-mtime', 'Match the age in days: [+-]N.'),
+                  ('-mmin', 'Match the age in minutes: [+-]N.'),
+                  ('-maxdepth', 'Descend at most N levels.'),
+                  ('-mindepth', 'Ignore entries above level N.'),
+                  ('--ordered', 'Print in sorted depth-first order.'),
+                  ('-j', 'Use N worker processes.')],
+         external='find_handles', stateless=True)
+register('grep', 'search', 'builtin_grep', 'grep [-rilcn] [--ordered] [-j N] pattern [path ...]',
+         'Print lines matching a regular expression, searching files in parallel.',
+         options=[('-r', 'Search directories recursively.'),
+                  ('-i', 'Ignore case.'),
+                  ('-l', 'Print only the names of matching files.'),
+                  ('-c', 'Print the number of matching lines per file.'),
+                  ('-n', 'Prefix lines with their line number.'),
+                  ('--ordered', 'Print files in sorted order.'),
+                  ('-j', 'Use N worker processes.')],
+         external='grep_handles', stateless=True)
+register('pwd', 'shell_builtins', 'builtin_pwd', 'pwd',
+         'Display the current working directory.', stateless=True)
+register('alias', 'shell_builtins', 'builtin_alias', "alias [name='command']",
+         'Create an alias for a command, or list aliases.')
+register('unalias', 'shell_builtins', 'builtin_unalias', 'unalias [name]',
+         'Remove an alias.', min_args=1)
+register('export', 'shell_builtins', 'builtin_export', 'export NAME=value',
+         'Set an environment variable.')
+register('echo', 'shell_builtins', 'builtin_echo', 'echo [args]',
+         'Display a line of text.', stateless=True)
+register('jobs', 'shell_builtins', 'builtin_jobs', 'jobs [-l]',
+         'List background jobs.',
+         options=[('-l', 'Show pid, exit status, wall and CPU time and max RSS.')], stateless=True)
+register('fg', 'shell_builtins', 'builtin_fg', 'fg [%job]',
+         'Bring a background or stopped job to the foreground.')
+register('bg', 'shell_builtins', 'builtin_bg', 'bg [%job]',
+         'Resume a stopped job in the background.')
+register('wait', 'shell_builtins', 'builtin_wait', 'wait [%job ...]',
+         'Wait for background jobs to finish.')
+register('kill', 'shell_builtins', 'builtin_kill', 'kill [-SIGNAL] %job|pid ...',
+         'Send a signal (TERM by default) to jobs or processes.',
+         options=[('-l', 'List signal names.'), ('-s', 'Name the signal to send.')], stateless=True)
+register('hash', 'shell_builtins', 'builtin_hash', 'hash [-r] [-s] [name ...]',
+         'List remembered command locations, or look up and remember the named commands.',
+         options=[('-r', 'Forget all remembered locations.'), ('-s', 'Show hit and miss counters.')])
+register('history', 'history', 'builtin_history', 'history [N] | -p|-s|-f TEXT [-n N] | --compact [N]',
+         'Show saved commands, or search them by prefix, substring or fuzzy match.',
+         options=[('-p', 'Search by prefix.'), ('-s', 'Search by substring.'),
+                  ('-f', 'Fuzzy search: the characters in order.'), ('-n', 'Show N results.'),
+                  ('--compact', 'Keep only the last N entries (default 1000000).')], stateless=True)
+register('source', 'shell_builtins', 'builtin_source', 'source [file]',
+         'Execute commands from a file.', min_args=1, missing='filename argument required')
+register('prompt', 'shell_builtins', 'builtin_prompt', 'prompt [add|remove NAME]',
+         "Show the prompt segments, or add/remove one: 'git', 'status', 'jobs' or NAME [-t SECONDS] COMMAND.",
+         options=[('add', 'Add a segment, computed in the background.'), ('remove', 'Remove a segment.')])
+register('parallel', 'parallel', 'builtin_parallel', 'parallel [-j N] [-k] [--line-buffer] [-v] command [{}] ::: arg ...',
+         "Run 'command' once per argument (or input line) on N processes, without mixing their output.",
+         options=[('-j', 'Run N jobs at a time (default: one per CPU).'),
+                  ('-k', 'Write output in the order of the arguments.'),
+                  ('--line-buffer', 'Write whole lines as they come instead of whole jobs.'),
+                  ('-v', 'Report progress, failures and jobs/s.'),
+                  ('--progress', 'Same as -v.')], stateless=True)
+register('test', 'interpreter', 'builtin_test', 'test EXPRESSION',
+         "Evaluate a condition: files (-e -f -d ...), strings (= != -z -n), integers (-eq -lt ...), ! -a -o.",
+         stateless=True)
+register('[', 'interpreter', 'builtin_bracket', '[ EXPRESSION ]',
+         "Same as 'test', with a closing ']'.", stateless=True)
+register('true', 'interpreter', 'builtin_true', 'true',
+         'Do nothing, successfully.', stateless=True)
+register(':', 'interpreter', 'builtin_true', ':',
+         'Do nothing, successfully.', stateless=True)
+register('false', 'interpreter', 'builtin_false', 'false',
+         'Do nothing, unsuccessfully.', stateless=True)
+register('break', 'interpreter', 'builtin_break', 'break [N]',
+         'Leave the innermost loop, or N loops.')
+register('continue', 'interpreter', 'builtin_continue', 'continue [N]',
+         'Go on with the next iteration of the innermost loop, or of the Nth.')
+register('return', 'interpreter', 'builtin_return', 'return [status]',
+         'Leave the running function with a status (default: that of the last command).')
+register('local', 'interpreter', 'builtin_local', 'local NAME[=value] ...',
+         'Give a variable a value that lasts until the running function returns.')
+register('read', 'shell_builtins', 'builtin_read', 'read [-r] [-p prompt] [NAME ...]',
+         'Read a line of input and split it into the variables NAME (default REPLY).',
+         options=[('-r', 'Keep backslashes as they are.'), ('-p', 'Print a prompt first.')])
+register('watch', 'watch', 'builtin_watch',
+         'watch [-n SECONDS] [-c N] command | watch [-x GLOB] [--debounce SECONDS] [--poll] -e PATH... -- command',
+         'Rerun a command every N seconds showing what changed, or whenever files under PATH change.',
+         options=[('-n', 'Seconds between runs (default 2).'),
+                  ('-c', 'Stop after N runs.'),
+                  ('-e', 'Run when files under the paths up to -- change.'),
+                  ('-x', 'Ignore files and directories matching a glob.'),
+                  ('--debounce', 'Quiet time that ends a burst of changes (default 0.1).'),
+                  ('--poll', 'Scan for changes instead of using inotify.')],
+         background=True)
+register('time', 'shell_builtins', 'builtin_time', 'time command',
+         'Run a command or pipeline and report its real, user and system time.')
+register('stats', 'shell_builtins', 'builtin_stats', 'stats [-n N]',
+         'Summarize the commands of this session and list the N slowest.',
+         options=[('-n', 'Number of slow commands to list (default 10).')], stateless=True)
+register('help', 'shell_builtins', 'builtin_help', 'help [command]',
+         'Display help information.', stateless=True)
+register('exit', 'shell_builtins', 'builtin_exit', 'exit [status]',
+         'Exit the shell.')
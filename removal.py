@@ -0,0 +1,202 @@
+# removal.py
+
+import os
+import sys
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from constants import RED, RESET
+from progress import Progress, format_size
+from utils import confirm
+
+# Threads removing independent subtrees at the same time
+MAX_WORKERS = 8
+
+DIRECTORY_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | getattr(os, 'O_CLOEXEC', 0)
+
+class Removal:
+    """Counters and worker pool of one 'rm' run, shared by every thread."""
+
+    def __init__(self, workers=MAX_WORKERS, progress=False):
+        self.workers = workers
+        self.progress = progress
+        self.files = 0
+        self.directories = 0
+        self.freed = 0
+        self.errors = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        # One slot per worker: a subtree only goes to the pool when a worker is free,
+        # so a thread waiting for its subtrees never waits for a queued task
+        self._slots = threading.Semaphore(workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='rm') if workers > 1 else None
+        self._progress = Progress(self.status_line)
+
+    def count(self, files=0, directories=0, freed=0):
+        with self._lock:
+            self.files += files
+            self.directories += directories
+            self.freed += freed
+
+    def fail(self, path, error):
+        with self._lock:
+            self.errors += 1
+        logging.error(f"rm: cannot remove '{path}': {error}")
+        print(f"{RED}rm: cannot remove '{path}': {error.strerror or error}{RESET}", file=sys.stderr)
+
+    def submit(self, function, *args):
+        """Run function on a free worker and return its future, or None if all are busy."""
+        if self._executor is None or not self._slots.acquire(blocking=False):
+            return None
+        future = self._executor.submit(function, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def start_reporting(self):
+        if self.progress:
+            self._progress.start()
+
+    def status_line(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"removed {self.files} files, {self.directories} directories, "
+                f"{format_size(self.freed)} freed ({self.files / elapsed:,.0f} files/s)")
+
+    def finish(self):
+        self._progress.stop()
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self.progress:
+            elapsed = time.monotonic() - self.started
+            print(f"{self.status_line()} in {elapsed:.2f}s")
+
+def _clear_directory(fd, path, removal):
+    """Remove everything inside the directory open as fd, never following symlinks."""
+    with os.scandir(fd) as scanner:
+        entries = list(scanner)
+    subdirs = []
+    files = freed = 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.name)
+                continue
+            if removal.progress:
+                stats = entry.stat(follow_symlinks=False)
+                if stats.st_nlink <= 1:
+                    freed += stats.st_blocks * 512
+            os.unlink(entry.name, dir_fd=fd)
+            files += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            removal.fail(os.path.join(path, entry.name), e)
+    removal.count(files=files, freed=freed)
+    # Subtrees are independent: hand them to idle workers and do the rest here
+    pending = []
+    for name in subdirs:
+        future = removal.submit(_remove_subdirectory, fd, name, os.path.join(path, name), removal)
+        if future is None:
+            _remove_subdirectory(fd, name, os.path.join(path, name), removal)
+        else:
+            pending.append(future)
+    for future in pending:
+        future.result()
+
+def _remove_subdirectory(parent_fd, name, path, removal):
+    try:
+        fd = os.open(name, DIRECTORY_FLAGS, dir_fd=parent_fd)
+    except FileNotFoundError:
+        return
+    except OSError as e:
+        removal.fail(path, e)
+        return
+    try:
+        _clear_directory(fd, path, removal)
+    except OSError as e:
+        removal.fail(path, e)
+    finally:
+        os.close(fd)
+    try:
+        os.rmdir(name, dir_fd=parent_fd)
+        removal.count(directories=1)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        removal.fail(path, e)
+
+def remove_tree(path, removal):
+    """Remove a directory and its contents, walking with dir_fd-relative calls."""
+    parent, name = os.path.split(os.path.normpath(path))
+    try:
+        parent_fd = os.open(parent or '.', os.O_RDONLY | os.O_DIRECTORY | getattr(os, 'O_CLOEXEC', 0))
+    except OSError as e:
+        removal.fail(path, e)
+        return
+    try:
+        _remove_subdirectory(parent_fd, name, path, removal)
+    finally:
+        os.close(parent_fd)
+
+def remove_item(paths, recursive=False, force=False, progress=False, workers=MAX_WORKERS):
+    """Remove the given files or directories; return the exit status.
+
+    Globs in the operands were already expanded by the shell.
+    """
+    removal = Removal(workers=workers, progress=progress)
+    removal.start_reporting()
+    status = 0
+    try:
+        for item_name in paths:
+            if not os.path.lexists(item_name):
+                if not force:
+                    print(f"{RED}rm: No such file or directory: {item_name}{RESET}", file=sys.stderr)
+                    status = 1
+                continue
+            try:
+                if os.path.isdir(item_name) and not os.path.islink(item_name):
+                    if not recursive:
+                        print(f"{RED}rm: cannot remove '{item_name}': Is a directory{RESET}", file=sys.stderr)
+                        status = 1
+                    elif force or confirm(f"rm: remove directory '{item_name}' and its contents?"):
+                        remove_tree(item_name, removal)
+                elif force or confirm(f"rm: remove file '{item_name}'?"):
+                    freed = 0
+                    if progress:
+                        stats = os.lstat(item_name)
+                        freed = stats.st_blocks * 512 if stats.st_nlink <= 1 else 0
+                    os.remove(item_name)
+                    removal.count(files=1, freed=freed)
+            except OSError as e:
+                removal.fail(item_name, e)
+    finally:
+        removal.finish()
+    return 1 if removal.errors else status
+
+def builtin_rm(args):
+    recursive = False
+    force = False
+    progress = False
+    workers = MAX_WORKERS
+    paths = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in ('-v', '--progress'):
+            progress = True
+        elif arg == '-j':
+            try:
+                workers = max(1, int(args.pop(0)))
+            except (IndexError, ValueError):
+                print(f"{RED}rm: -j needs a number of threads{RESET}", file=sys.stderr)
+                return 1
+        elif arg.startswith('-') and len(arg) > 1 and set(arg[1:]) <= set('rRfv'):
+            recursive = recursive or 'r' in arg or 'R' in arg
+            force = force or 'f' in arg
+            progress = progress or 'v' in arg
+        else:
+            paths.append(arg)
+    if not paths:
+        print(f"{RED}rm: missing operand{RESET}", file=sys.stderr)
+        return 1
+    return remove_item(paths, recursive=recursive, force=force, progress=progress, workers=workers)
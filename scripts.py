@@ -0,0 +1,78 @@
+# scripts.py
+
+import os
+import sys
+import logging
+from constants import RED, RESET
+from interpreter import parse_script, run_body
+from utils import write_atomically
+
+# Bump whenever the AST classes change so stale cache files are ignored
+CACHE_FORMAT = 4
+CACHE_DIR = os.path.join(os.path.expanduser(os.environ.get('XDG_CACHE_HOME', '~/.cache')),
+                         'custom_shell', 'scripts')
+
+# Compiled scripts already loaded by this process, keyed by path
+_compiled = {}
+
+def compile_source(text):
+    """Parse script text into a list of (line, node) pairs; see interpreter.parse_script()."""
+    return parse_script(text)
+
+def _cache_path(path):
+    import hashlib
+    return os.path.join(CACHE_DIR, hashlib.sha1(path.encode()).hexdigest() + '.pickle')
+
+def _load_cached(path, key):
+    import pickle
+    try:
+        with open(_cache_path(path), 'rb') as f:
+            cached = pickle.load(f)
+    except (OSError, pickle.PickleError, EOFError, AttributeError, ImportError):
+        return None
+    if cached.get('key') != key:
+        return None
+    return cached['nodes']
+
+def _store_cached(path, key, nodes):
+    import pickle
+    cache_path = _cache_path(path)
+    try:
+        write_atomically(cache_path, lambda f: pickle.dump({'key': key, 'nodes': nodes}, f,
+                                                           protocol=pickle.HIGHEST_PROTOCOL))
+    except OSError as e:
+        logging.error(f"Could not write script cache {cache_path}: {e}")
+
+def compile_script(path):
+    """Return the compiled form of a script file.
+
+    Compiled scripts are kept in memory and on disk, keyed by path, mtime and
+    size, so re-running an unchanged file skips parsing altogether.
+    """
+    path = os.path.abspath(path)
+    stats = os.stat(path)
+    key = (CACHE_FORMAT, path, stats.st_mtime_ns, stats.st_size)
+    cached = _compiled.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    nodes = _load_cached(path, key)
+    if nodes is None:
+        with open(path, 'r') as script_file:
+            nodes = compile_source(script_file.read())
+        _store_cached(path, key, nodes)
+    _compiled[path] = (key, nodes)
+    return nodes
+
+def run_nodes(nodes):
+    """Run compiled nodes in order and return the status of the last one."""
+    return run_body(nodes)
+
+def execute_script(file_path):
+    """Execute commands from a script file and return the last exit status."""
+    try:
+        nodes = compile_script(os.path.expanduser(file_path))
+    except Exception as e:
+        logging.error(f"Error executing script: {e}", exc_info=True)
+        print(f"{RED}Error executing script: {e}{RESET}", file=sys.stderr)
+        return 1
+    return run_nodes(nodes)
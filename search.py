@@ -0,0 +1,614 @@
+# search.py
+
+import os
+import re
+import sys
+import stat
+import time
+import mmap
+import fnmatch
+import logging
+import itertools
+import multiprocessing
+from constants import RED, RESET
+
+# Files at least this big are searched through mmap instead of being read
+MMAP_THRESHOLD = 1024 * 1024
+# Files handed to a grep worker at a time
+BATCH_FILES = 64
+# Files grep searches before starting worker processes; fewer are searched in-process
+PARALLEL_FILES = 2 * BATCH_FILES
+# Subdirectories a find root needs before its subtrees go to worker processes
+PARALLEL_SUBTREES = 2
+# Most worker processes started by default, however many CPUs there are
+MAX_WORKERS = 4
+# Bytes looked at to decide whether a file is binary, like grep
+BINARY_PROBE = 8192
+# Predicates of find that take a value, all the builtin supports
+FIND_PREDICATES = ('-name', '-iname', '-path', '-type', '-size', '-mtime', '-mmin', '-maxdepth', '-mindepth', '-j')
+# Characters that are literal in a basic regular expression but operators in Python's re
+BRE_LITERALS = frozenset('(){}|+?')
+# Backslash escapes that quote the same special character in both
+QUOTED_SPECIALS = frozenset('.*[]^$\\/')
+# Bytes read from a stream at a time by grep
+STREAM_CHUNK = 64 * 1024
+SIZE_UNITS = {'c': 1, 'w': 2, 'b': 512, 'k': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def default_workers():
+    return min(os.cpu_count() or 1, MAX_WORKERS)
+
+def _pool(workers):
+    """Return a process pool, or None when the work is done in this process."""
+    if workers <= 1:
+        return None
+    return multiprocessing.get_context('fork').Pool(workers)
+
+def _scan(path, ordered):
+    """Return the entries of a directory, sorted by name when the order matters."""
+    with os.scandir(path) as scanner:
+        entries = list(scanner)
+    if ordered:
+        entries.sort(key=lambda entry: entry.name)
+    return entries
+
+def _compare(value, op, target):
+    if op == '+':
+        return value > target
+    if op == '-':
+        return value < target
+    return value == target
+
+class FindQuery:
+    """The predicates of one 'find' run; every given predicate must match."""
+
+    def __init__(self):
+        self.names = []
+        self.paths = []
+        self.kind = None
+        self.size = None
+        self.age = None
+        self.maxdepth = None
+        self.mindepth = 0
+        self.ordered = False
+
+    def needs_stat(self):
+        return self.size is not None or self.age is not None
+
+    def matches(self, path, name, entry, depth):
+        if depth < self.mindepth:
+            return False
+        if any(not pattern.match(name) for pattern in self.names):
+            return False
+        if any(not pattern.match(path) for pattern in self.paths):
+            return False
+        if self.kind is not None:
+            if self.kind == 'l':
+                if not entry.is_symlink():
+                    return False
+            elif self.kind == 'd':
+                if entry.is_symlink() or not entry.is_dir():
+                    return False
+            elif entry.is_symlink() or not entry.is_file():
+                return False
+        if self.needs_stat():
+            stats = entry.stat(follow_symlinks=False)
+            if self.size is not None:
+                op, count, unit = self.size
+                if not _compare(-(-stats.st_size // unit), op, count):
+                    return False
+            if self.age is not None:
+                op, count, seconds = self.age
+                if not _compare(int((time.time() - stats.st_mtime) // seconds), op, count):
+                    return False
+        return True
+
+class _RootEntry:
+    """The DirEntry interface for a path given on the command line."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path.rstrip('/')) or path
+        self._stat = os.lstat(path)
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self._stat.st_mode)
+
+    def is_dir(self, follow_symlinks=True):
+        return stat.S_ISDIR(self._stat.st_mode)
+
+    def is_file(self, follow_symlinks=True):
+        return stat.S_ISREG(self._stat.st_mode)
+
+    def stat(self, follow_symlinks=True):
+        return self._stat
+
+def _find_subtree(unit):
+    """Walk one subtree depth first; return (matched paths, error messages)."""
+    path, depth, query, entry = unit
+    found = []
+    errors = []
+    stack = [(path, depth, entry)]
+    while stack:
+        path, depth, entry = stack.pop()
+        try:
+            if query.matches(path, entry.name, entry, depth):
+                found.append(path)
+            descend = entry.is_dir(follow_symlinks=False) and (query.maxdepth is None or depth < query.maxdepth)
+        except OSError as e:
+            errors.append(f"find: '{path}': {e.strerror}")
+            continue
+        if descend:
+            try:
+                children = _scan(path, query.ordered)
+            except OSError as e:
+                errors.append(f"find: '{path}': {e.strerror}")
+                continue
+            stack.extend((os.path.join(path, child.name), depth + 1, child) for child in reversed(children))
+    return found, errors
+
+class _Unit:
+    """A pickleable stand-in for a DirEntry sent to a worker process."""
+
+    def __init__(self, entry):
+        self.name = entry.name
+        self._symlink = entry.is_symlink()
+        self._dir = entry.is_dir(follow_symlinks=False)
+        self._file = entry.is_file(follow_symlinks=False)
+        self._path = entry.path
+
+    def is_symlink(self):
+        return self._symlink
+
+    def is_dir(self, follow_symlinks=True):
+        return self._dir
+
+    def is_file(self, follow_symlinks=True):
+        return self._file
+
+    def stat(self, follow_symlinks=True):
+        return os.stat(self._path, follow_symlinks=follow_symlinks)
+
+def find(roots, query, workers, write):
+    """Print the paths under roots matching query; return the exit status.
+
+    When a root has several subdirectories, each is walked by a worker
+    process; smaller roots are walked in this process. With
+    query.ordered the output is in sorted depth-first order, streamed as the
+    subtrees finish; otherwise it is printed as soon as any subtree is done.
+    """
+    status = 0
+
+    def emit(result):
+        nonlocal status
+        found, errors = result
+        if found:
+            write('\n'.join(found) + '\n')
+        for error in errors:
+            print(f"{RED}{error}{RESET}", file=sys.stderr)
+            status = 1
+
+    # Started for the first root with enough subtrees to share out
+    pool = None
+    try:
+        for root in roots:
+            try:
+                entry = _RootEntry(root)
+            except OSError as e:
+                emit(([], [f"find: '{root}': {e.strerror}"]))
+                continue
+            units = subtrees = []
+            if workers > 1 and entry.is_dir() and query.maxdepth != 0:
+                try:
+                    children = _scan(root, query.ordered)
+                except OSError:
+                    # Reported by the walk below
+                    children = []
+                units = [(os.path.join(root, child.name), 1, query, _Unit(child)) for child in children]
+                # Subtrees go to the pool; single files are cheaper to test here
+                subtrees = [unit for unit in units if unit[3].is_dir()]
+            if len(subtrees) < PARALLEL_SUBTREES:
+                emit(_find_subtree((root, 0, query, entry)))
+                continue
+            if pool is None:
+                pool = _pool(workers)
+            emit(([root] if query.matches(root, entry.name, entry, 0) else [], []))
+            if query.ordered:
+                results = pool.imap(_find_subtree, subtrees)
+                for unit in units:
+                    emit(next(results) if unit[3].is_dir() else _find_subtree(unit))
+            else:
+                results = pool.imap_unordered(_find_subtree, subtrees)
+                for unit in units:
+                    if not unit[3].is_dir():
+                        emit(_find_subtree(unit))
+                for result in results:
+                    emit(result)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return status
+
+class GrepQuery:
+    """The pattern and output options of one 'grep' run."""
+
+    def __init__(self, pattern, ignore_case=False, line_numbers=False, count=False,
+                 files_only=False, show_names=False):
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        self.regex = re.compile(os.fsencode(pattern), flags)
+        self.line_numbers = line_numbers
+        self.count = count
+        self.files_only = files_only
+        self.show_names = show_names
+
+def search_data(data, name, query, first_line=1, binary=None):
+    """Search a bytes-like object line by line; return (output lines, number of matching lines).
+
+    The regex scans the whole buffer (mmap or bytes) and each match is widened
+    to its line, so lines without a match never reach Python code.
+    ``first_line`` is the number of the first line of data, and ``binary``
+    says whether to treat it as binary, found out from the data if None.
+    """
+    # The empty line after a final newline is not a line of the file
+    size = len(data) - 1 if data[-1:] == b'\n' else len(data)
+    if binary is None:
+        binary = b'\0' in data[:BINARY_PROBE]
+    if query.files_only:
+        matched = int(query.regex.search(data, 0, size) is not None)
+        return ([name] if matched else []), matched
+    show_lines = not query.count and not binary
+    prefix = f"{name}:" if query.show_names else ''
+    lines = []
+    matched = 0
+    pos = 0
+    line_number = first_line
+    counted_to = 0
+    while pos <= size:
+        match = query.regex.search(data, pos, size)
+        if match is None:
+            break
+        end = data.find(b'\n', match.start(), size)
+        if end == -1:
+            end = size
+        matched += 1
+        if show_lines:
+            start = data.rfind(b'\n', 0, match.start()) + 1
+            text = data[start:end].decode('utf-8', 'replace')
+            if query.line_numbers:
+                line_number += data[counted_to:start].count(b'\n')
+                counted_to = start
+                lines.append(f"{prefix}{line_number}:{text}")
+            else:
+                lines.append(prefix + text)
+        pos = end + 1
+    if query.count:
+        lines = [f"{name}:{matched}" if query.show_names else str(matched)]
+    elif binary and matched:
+        lines = [f"Binary file {name} matches"]
+    return lines, matched
+
+def _line_chunks(stream):
+    """Yield the data of a binary stream in whole lines, as soon as it arrives."""
+    read = getattr(stream, 'read1', None) or stream.readline
+    rest = b''
+    while True:
+        chunk = read(STREAM_CHUNK)
+        if not chunk:
+            break
+        data = rest + chunk if rest else chunk
+        end = data.rfind(b'\n') + 1
+        if end:
+            yield data[:end]
+        rest = data[end:]
+    if rest:
+        yield rest
+
+def grep_stream(stream, name, query, write, flush):
+    """Search a stream as its lines arrive and write the results; return the number of matching lines.
+
+    Matches are written and flushed chunk by chunk, so 'tail -f log | grep x'
+    shows them as they come, 'yes | grep y' runs in bounded memory and a
+    closed output pipe stops the search with BrokenPipeError.
+    """
+    matched = 0
+    line_number = 1
+    binary = None
+    for data in _line_chunks(stream):
+        if binary is None:
+            binary = b'\0' in data[:BINARY_PROBE]
+        lines, count = search_data(data, name, query, line_number, binary)
+        matched += count
+        if query.files_only and matched:
+            break
+        if query.line_numbers:
+            line_number += data.count(b'\n')
+        if lines and not query.count and not binary:
+            write('\n'.join(lines) + '\n')
+            flush()
+    if query.files_only:
+        lines = [name] if matched else []
+    elif query.count:
+        lines = [f"{name}:{matched}" if query.show_names else str(matched)]
+    else:
+        lines = [f"Binary file {name} matches"] if binary and matched else []
+    if lines:
+        write('\n'.join(lines) + '\n')
+    return matched
+
+def grep_file(path, query):
+    """Search one file; return (output lines, matching lines, error message or None)."""
+    if path == '-':
+        # Standard input among other files: read whole, like a file
+        return (*search_data(sys.stdin.buffer.read(), '(standard input)', query), None)
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size >= MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    lines, matched = search_data(data, path, query)
+            else:
+                lines, matched = search_data(f.read(), path, query)
+        return lines, matched, None
+    except OSError as e:
+        return [], 0, f"grep: {path}: {e.strerror}"
+
+def _grep_batch(batch):
+    paths, query = batch
+    lines = []
+    errors = []
+    matched = 0
+    for path in paths:
+        file_lines, file_matched, error = grep_file(path, query)
+        lines.extend(file_lines)
+        matched += file_matched
+        if error:
+            errors.append(error)
+    return lines, matched, errors
+
+def _files(paths, recursive, ordered, errors):
+    """Yield the files to search, walking directories depth first for -r."""
+    stack = list(reversed(paths))
+    while stack:
+        path = stack.pop()
+        if not os.path.isdir(path):
+            yield path
+            continue
+        if not recursive:
+            errors.append(f"grep: {path}: Is a directory")
+            continue
+        try:
+            children = _scan(path, ordered)
+        except OSError as e:
+            errors.append(f"grep: {path}: {e.strerror}")
+            continue
+        for child in reversed(children):
+            try:
+                if child.is_dir(follow_symlinks=False) or child.is_file(follow_symlinks=False):
+                    stack.append(child.path)
+            except OSError:
+                pass
+
+def _batches(files, query):
+    batch = []
+    for path in files:
+        batch.append(path)
+        if len(batch) >= BATCH_FILES:
+            yield batch, query
+            batch = []
+    if batch:
+        yield batch, query
+
+def grep(paths, query, recursive, ordered, workers, write):
+    """Search files for query; return 0 if a line matched, 1 if none did, 2 on errors."""
+    walk_errors = []
+    matched = 0
+    errors = 0
+
+    def emit(result):
+        nonlocal matched, errors
+        lines, count, messages = result
+        matched += count
+        if lines:
+            write('\n'.join(lines) + '\n')
+        for message in messages:
+            print(f"{RED}{message}{RESET}", file=sys.stderr)
+            errors += 1
+
+    files = _files(paths, recursive, ordered, walk_errors)
+    # A pool only pays for itself on many files, and only this process can read its standard input
+    first = list(itertools.islice(files, PARALLEL_FILES))
+    pool = _pool(workers) if len(first) == PARALLEL_FILES and '-' not in paths else None
+    files = itertools.chain(first, files)
+    try:
+        if pool is None:
+            for path in files:
+                lines, count, error = grep_file(path, query)
+                emit((lines, count, [error] if error else []))
+                if walk_errors:
+                    emit(([], 0, walk_errors[:]))
+                    walk_errors.clear()
+        else:
+            mapper = pool.imap if ordered else pool.imap_unordered
+            for result in mapper(_grep_batch, _batches(files, query)):
+                emit(result)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    emit(([], 0, walk_errors))
+    if errors:
+        return 2
+    return 0 if matched else 1
+
+def _parse_size(text):
+    op = text[0] if text[:1] in '+-' and text else ''
+    text = text[len(op):]
+    unit = SIZE_UNITS['b']
+    if text and text[-1] in SIZE_UNITS:
+        unit = SIZE_UNITS[text[-1]]
+        text = text[:-1]
+    return op, int(text), unit
+
+def _parse_age(text, seconds):
+    op = text[0] if text[:1] in '+-' and text else ''
+    return op, int(text[len(op):]), seconds
+
+class UsageError(Exception):
+    """Raised for arguments of find or grep that the builtins do not support."""
+
+def _find_arguments(args):
+    """Parse the arguments of find into (roots, query, workers)."""
+    query = FindQuery()
+    workers = default_workers()
+    roots = []
+    args = list(args)
+    while args and not args[0].startswith('-'):
+        roots.append(os.path.expanduser(args.pop(0)))
+    arg = value = None
+    try:
+        while args:
+            arg = args.pop(0)
+            if arg == '--ordered':
+                query.ordered = True
+                continue
+            if arg not in FIND_PREDICATES:
+                raise UsageError(f"unknown predicate '{arg}'")
+            value = args.pop(0)
+            if arg == '-name':
+                query.names.append(re.compile(fnmatch.translate(value)))
+            elif arg == '-iname':
+                query.names.append(re.compile(fnmatch.translate(value), re.IGNORECASE))
+            elif arg == '-path':
+                query.paths.append(re.compile(fnmatch.translate(value)))
+            elif arg == '-type':
+                if value not in ('f', 'd', 'l'):
+                    raise UsageError(f"unknown argument to -type: {value}")
+                query.kind = value
+            elif arg == '-size':
+                query.size = _parse_size(value)
+            elif arg == '-mtime':
+                query.age = _parse_age(value, 86400)
+            elif arg == '-mmin':
+                query.age = _parse_age(value, 60)
+            elif arg == '-maxdepth':
+                query.maxdepth = int(value)
+            elif arg == '-mindepth':
+                query.mindepth = int(value)
+            elif arg == '-j':
+                workers = max(1, int(value))
+    except IndexError:
+        raise UsageError(f"missing argument to '{arg}'")
+    except ValueError:
+        raise UsageError(f"invalid argument '{value}' to '{arg}'")
+    return roots or ['.'], query, workers
+
+def find_handles(args):
+    """Tell whether the find builtin supports these arguments; otherwise the system find runs."""
+    try:
+        _find_arguments(args)
+    except UsageError:
+        return False
+    return True
+
+def builtin_find(args):
+    try:
+        roots, query, workers = _find_arguments(args)
+    except UsageError as e:
+        print(f"{RED}find: {e}{RESET}", file=sys.stderr)
+        return 1
+    try:
+        return find(roots, query, workers, sys.stdout.write)
+    except BrokenPipeError:
+        return 1
+
+def _grep_arguments(args):
+    """Parse the arguments of grep into (pattern, paths, options, recursive, ordered, workers)."""
+    options = {'ignore_case': False, 'line_numbers': False, 'count': False, 'files_only': False}
+    recursive = False
+    ordered = False
+    workers = default_workers()
+    operands = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == '--':
+            operands.extend(args)
+            break
+        if arg == '--ordered':
+            ordered = True
+        elif arg == '-j':
+            try:
+                workers = max(1, int(args.pop(0)))
+            except (IndexError, ValueError):
+                raise UsageError('-j needs a number of processes')
+        elif arg.startswith('-') and len(arg) > 1 and not operands:
+            for flag in arg[1:]:
+                if flag in 'rR':
+                    recursive = True
+                elif flag == 'i':
+                    options['ignore_case'] = True
+                elif flag == 'n':
+                    options['line_numbers'] = True
+                elif flag == 'c':
+                    options['count'] = True
+                elif flag == 'l':
+                    options['files_only'] = True
+                else:
+                    raise UsageError(f"invalid option -- '{flag}'")
+        else:
+            operands.append(arg)
+    if not operands:
+        raise UsageError('missing pattern')
+    pattern, *paths = operands
+    return pattern, [os.path.expanduser(path) for path in paths], options, recursive, ordered, workers
+
+def _same_as_bre(pattern):
+    """Tell whether a pattern means the same as a POSIX basic regular expression and as a Python one."""
+    if pattern.startswith('*') or '^*' in pattern or '[:' in pattern or '[=' in pattern or '[.' in pattern:
+        return False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            if pattern[i + 1:i + 2] not in QUOTED_SPECIALS:
+                return False
+            i += 2
+            continue
+        if c in BRE_LITERALS:
+            return False
+        i += 1
+    return True
+
+def grep_handles(args):
+    """Tell whether the grep builtin supports these arguments; otherwise the system grep runs.
+
+    The builtin matches with Python's re, so patterns using syntax that a
+    basic regular expression reads differently, like '\\(' or '{', are left
+    to the system grep too.
+    """
+    try:
+        pattern = _grep_arguments(args)[0]
+    except UsageError:
+        return False
+    return _same_as_bre(pattern)
+
+def builtin_grep(args):
+    try:
+        pattern, paths, options, recursive, ordered, workers = _grep_arguments(args)
+    except UsageError as e:
+        print(f"{RED}grep: {e}{RESET}", file=sys.stderr)
+        return 2
+    try:
+        query = GrepQuery(pattern, show_names=recursive or len(paths) > 1, **options)
+    except re.error as e:
+        print(f"{RED}grep: invalid regular expression: {e}{RESET}", file=sys.stderr)
+        return 2
+    try:
+        if (not paths and not recursive) or paths == ['-']:
+            matched = grep_stream(sys.stdin.buffer, '(standard input)', query, sys.stdout.write, sys.stdout.flush)
+            return 0 if matched else 1
+        return grep(paths or ['.'], query, recursive, ordered, workers, sys.stdout.write)
+    except BrokenPipeError:
+        return 2
+    except Exception as e:
+        logging.error(f"grep: Error: {e}", exc_info=True)
+        print(f"{RED}grep: Error: {e}{RESET}", file=sys.stderr)
+        return 2
@@ -0,0 +1,186 @@
+# server.py
+
+import os
+import sys
+import socket
+import struct
+import signal
+import logging
+import marshal
+from constants import RED, RESET, shell_state
+
+# Longest request accepted, in bytes
+MAX_REQUEST = 16 * 1024 * 1024
+# Connections waiting to be accepted
+BACKLOG = 128
+
+def default_socket_path():
+    """Per-user socket path: $XDG_RUNTIME_DIR/custom_shell.sock, or one in /tmp named by uid."""
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'custom_shell.sock')
+    return f"/tmp/custom_shell-{os.getuid()}.sock"
+
+def warm_up():
+    """Load what every request would otherwise load: builtin modules and the PATH index."""
+    import cmdhash
+    import scripts
+    from registry import BUILTINS
+    for builtin in BUILTINS.values():
+        try:
+            builtin.handler
+        except ImportError as e:
+            logging.error(f"server: cannot load builtin {builtin.name}: {e}")
+    cmdhash.path_index()
+
+def _recv_exact(connection, size):
+    data = b''
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise EOFError('client closed the connection')
+        data += chunk
+    return data
+
+def read_request(connection):
+    """Read one request: its dict and the client's stdin, stdout and stderr descriptors.
+
+    The frame is a 4-byte length and a marshal'ed dict; the descriptors come
+    with the first bytes as SCM_RIGHTS ancillary data.
+    """
+    header, fds, _, _ = socket.recv_fds(connection, 4, 3)
+    if len(fds) != 3 or len(header) < 4:
+        for fd in fds:
+            os.close(fd)
+        raise EOFError('malformed request')
+    size, = struct.unpack('!I', header)
+    if size > MAX_REQUEST:
+        raise EOFError('request too large')
+    return marshal.loads(_recv_exact(connection, size)), fds
+
+def _apply_request(request, fds):
+    """Turn this forked child into the client's command: its descriptors, cwd and environment."""
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.environ.update(request.get('env') or {})
+    if 'PATH' in (request.get('env') or {}):
+        import cmdhash
+        cmdhash.clear()
+    os.chdir(request.get('cwd') or os.getcwd())
+    shell_state['cwd'] = None
+
+def handle(connection):
+    """Run one request in this forked child and send back its pid, then its exit status."""
+    from scripts import compile_source, run_nodes
+    status = 1
+    try:
+        request, fds = read_request(connection)
+        connection.sendall(struct.pack('!i', os.getpid()))
+        _apply_request(request, fds)
+        status = run_nodes(compile_source(request['command']))
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 0
+    except KeyboardInterrupt:
+        status = 128 + signal.SIGINT
+    except (EOFError, OSError, ValueError, KeyError, TypeError) as e:
+        logging.error(f"server: bad request: {e}", exc_info=True)
+        print(f"{RED}server: {e}{RESET}", file=sys.stderr)
+    except Exception as e:
+        logging.error(f"server: error running request: {e}", exc_info=True)
+        print(f"{RED}server: {e}{RESET}", file=sys.stderr)
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+    try:
+        connection.sendall(struct.pack('!i', status))
+    except OSError:
+        pass
+    return status
+
+def _reap_children(signum, frame):
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+def _authorized(connection):
+    """Only the user running the daemon may use it."""
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    _, uid, _ = struct.unpack('3i', credentials)
+    return uid == os.getuid()
+
+def serve(path=None):
+    """Serve command requests on a Unix socket until interrupted.
+
+    The daemon keeps a shell warmed up: rc state, builtin modules and the
+    command hash. Each connection is handled by a fork of it, which takes
+    over the client's stdin, stdout and stderr (passed over the socket), its
+    cwd and its environment overlay, runs the command and reports the exit
+    status. Requests are therefore isolated from each other and from the
+    daemon, run concurrently, and stream output straight to the client's
+    descriptors without passing through the daemon.
+    """
+    path = path or default_socket_path()
+    warm_up()
+    try:
+        owner = os.lstat(path).st_uid
+    except FileNotFoundError:
+        owner = None
+    if owner is not None:
+        # The path in /tmp is predictable: never remove what another user put there
+        if owner != os.getuid():
+            print(f"{RED}server: {path} belongs to another user{RESET}", file=sys.stderr)
+            return 1
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(BACKLOG)
+    signal.signal(signal.SIGCHLD, _reap_children)
+    daemon = os.getpid()
+    print(f"Serving on {path}", file=sys.stderr)
+    try:
+        while True:
+            connection, _ = listener.accept()
+            if not _authorized(connection):
+                connection.close()
+                continue
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                # The child must never get back to the loop or to the cleanup below
+                status = 1
+                try:
+                    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                    signal.signal(signal.SIGINT, signal.default_int_handler)
+                    listener.close()
+                    os.setsid()
+                    status = handle(connection)
+                    from logs import stop_logging
+                    stop_logging()
+                except BaseException as e:
+                    logging.error(f"server: request failed: {e}", exc_info=True)
+                finally:
+                    os._exit(status & 0xff)
+            connection.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        if os.getpid() == daemon:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    return 0
@@ -0,0 +1,169 @@
+# shell.py
+
+import os
+import sys
+import stat
+import time
+from collections import deque
+from constants import RED, RESET, shell_state
+from commands import describe_pipeline, set_environment_variable, run_pipeline
+from logs import command_log
+from parser import Command, CommandList, ParseError, Pipeline, compile_command, is_compound
+from registry import resolve
+from substitution import expand_command, expand_word, last_substitution
+from expansion import ExpansionError
+
+# Records of the commands run in this session, for the 'stats' builtin
+SESSION_RECORDS = 10000
+session_records = deque(maxlen=SESSION_RECORDS)
+
+class _CountingStream:
+    """Stands in for sys.stdout while a builtin runs, counting the bytes it writes."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text.encode('utf-8', 'replace'))
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def process_command(command_input):
+    """Process a single command input and return its exit status."""
+    if not command_input:
+        return 0
+    if is_compound(command_input):
+        # if/for/while/case/functions run in the interpreter
+        from interpreter import run_source
+        return run_source(command_input)
+
+    # Parse the line, or reuse the AST of an identical earlier line
+    start = time.perf_counter()
+    try:
+        pipeline = compile_command(command_input)
+    except ParseError as e:
+        print(f"{RED}{e}{RESET}", file=sys.stderr)
+        return 2
+    return run_parsed(pipeline, command_input, time.perf_counter() - start)
+
+def run_parsed(pipeline, command_input, parse_time=None):
+    """Run an alias-expanded Pipeline or CommandList, log a timing record for it and return its exit status."""
+    record = {'command': command_input, 'path': None, 'status': None, 'output_bytes': None,
+              'parse_s': parse_time}
+    before = os.times()
+    start = time.perf_counter()
+    status = _dispatch(pipeline, command_input, record)
+    record['wall_s'] = time.perf_counter() - start
+    after = os.times()
+    # The shell's own CPU time plus that of the children reaped meanwhile, like bash's 'time'
+    record['user_s'] = after.user - before.user + after.children_user - before.children_user
+    record['sys_s'] = after.system - before.system + after.children_system - before.children_system
+    record['status'] = status
+    session_records.append(record)
+    command_log.info('command', extra={'fields': record})
+    shell_state['last_status'] = status
+    return status
+
+def _stdout_size():
+    """Return the size of the file fd 1 writes to, or None if it is not a regular file."""
+    try:
+        stats = os.fstat(1)
+    except OSError:
+        return None
+    return stats.st_size if stat.S_ISREG(stats.st_mode) else None
+
+def _run_builtin(builtin, args, record):
+    record['path'] = 'builtin'
+    counter = _CountingStream(sys.stdout)
+    sys.stdout = counter
+    try:
+        return builtin.run(args)
+    finally:
+        sys.stdout = counter.stream
+        record['output_bytes'] = counter.bytes
+
+def run_timed(pipeline, command_input):
+    """Run a pipeline prefixed with the 'time' keyword and report its times on stderr."""
+    first = pipeline.commands[0]
+    inner = Pipeline([Command(first.words[1:], first.redirects, first.assignments)] + pipeline.commands[1:],
+                     pipeline.background, pipeline.negated)
+    words = command_input.split(None, 1)
+    status = run_parsed(inner, words[1] if len(words) > 1 else '')
+    record = session_records[-1]
+    for label, key in (('real', 'wall_s'), ('user', 'user_s'), ('sys', 'sys_s')):
+        minutes, seconds = divmod(record[key], 60)
+        sys.stderr.write(f"{label}\t{int(minutes)}m{seconds:.3f}s\n")
+    return status
+
+def run_list(command_list, run):
+    """Run the pipelines of a CommandList in order and return the last status.
+
+    A pipeline after '&&' only runs if the status so far is 0, one after '||'
+    only if it is not; a skipped pipeline leaves the status unchanged.
+    """
+    status = 0
+    for connector, pipeline in command_list.items:
+        if (connector == '&&' and status != 0) or (connector == '||' and status == 0):
+            continue
+        status = run(pipeline)
+        # '$?' in the next pipeline of the list is this one's status
+        shell_state['last_status'] = status
+    return status
+
+def _dispatch(pipeline, command_input, record):
+    if isinstance(pipeline, CommandList):
+        record['path'] = 'list'
+        return run_list(pipeline, lambda item: _dispatch(item, describe_pipeline(item), {}))
+    if pipeline.negated:
+        return 0 if _dispatch_pipeline(pipeline, command_input, record) else 1
+    return _dispatch_pipeline(pipeline, command_input, record)
+
+def _dispatch_pipeline(pipeline, command_input, record):
+    if not pipeline.commands:
+        return 0
+    first = pipeline.commands[0]
+
+    # Handle variable assignment
+    if not first.words:
+        record['path'] = 'assignment'
+        # Like other shells, 'x=$(false)' has the status of its last substitution
+        last_substitution['status'] = 0
+        try:
+            for name, value in first.assignments:
+                set_environment_variable(name, expand_word(value))
+        except ExpansionError as e:
+            print(f"{RED}{e}{RESET}", file=sys.stderr)
+            return 1
+        return last_substitution['status']
+
+    # 'time' is a keyword: it times the whole pipeline after it
+    if first.words[0] == 'time':
+        record['path'] = 'time'
+        return run_timed(pipeline, command_input)
+
+    try:
+        tokens = expand_command(first)
+    except ExpansionError as e:
+        print(f"{RED}{e}{RESET}", file=sys.stderr)
+        return 1
+    if not tokens:
+        return 0
+
+    # Handle built-in commands with a single table lookup
+    builtin = resolve(tokens)
+    if builtin is not None and len(pipeline.commands) == 1 and not first.redirects and not pipeline.background:
+        return _run_builtin(builtin, tokens[1:], record)
+
+    # Pipelines, redirections and external commands; builtin stages run in threads
+    if len(pipeline.commands) > 1:
+        record['path'] = 'pipeline'
+    else:
+        record['path'] = 'builtin' if builtin is not None and not pipeline.background else 'external'
+    size = _stdout_size()
+    status = run_pipeline(pipeline, command_text=command_input, first_argv=tokens)
+    if size is not None:
+        record['output_bytes'] = max(0, (_stdout_size() or 0) - size)
+    return status
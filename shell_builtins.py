@@ -0,0 +1,305 @@
+# shell_builtins.py
+
+import os
+import re
+import sys
+import signal
+import shlex
+from constants import RED, GREEN, YELLOW, CYAN, RESET, aliases, shell_state
+from registry import BUILTINS
+from commands import (
+    change_directory,
+    make_directory,
+    print_working_directory,
+    set_alias,
+    remove_alias,
+    set_environment_variable,
+)
+from jobs import (
+    bring_job_to_foreground,
+    find_job,
+    list_jobs,
+    resume_job_in_background,
+    wait_for_jobs,
+)
+
+def builtin_exit(args):
+    try:
+        status = int(args[0]) if args else 0
+    except ValueError:
+        print(f"{RED}exit: numeric argument required{RESET}", file=sys.stderr)
+        status = 2
+    if shell_state['interactive']:
+        print(f"{GREEN}Exiting Custom Shell. Goodbye!{RESET}")
+    sys.exit(status)
+
+def builtin_cd(args):
+    path = args[0] if args else os.path.expanduser('~')
+    return change_directory(path)
+
+def builtin_mkdir(args):
+    if not args:
+        print(f"{RED}mkdir: missing operand{RESET}", file=sys.stderr)
+        return 1
+    status = 0
+    for directory_name in args:
+        status = make_directory(directory_name) or status
+    return status
+
+def builtin_pwd(args):
+    print_working_directory()
+
+def builtin_alias(args):
+    if args:
+        for arg in args:
+            if '=' in arg:
+                name, cmd = arg.split('=', 1)
+                set_alias(name, cmd)
+            else:
+                print(f"{YELLOW}{arg}='{aliases.get(arg, '')}'{RESET}")
+    else:
+        for name, cmd in aliases.items():
+            print(f"{YELLOW}{name}='{cmd}'{RESET}")
+
+def builtin_unalias(args):
+    remove_alias(args[0])
+
+def builtin_export(args):
+    if args and '=' in args[0]:
+        name, value = args[0].split('=', 1)
+        set_environment_variable(name, value)
+    else:
+        print(f"{RED}export: invalid format. Use 'export NAME=value'{RESET}", file=sys.stderr)
+        return 1
+
+def builtin_echo(args):
+    print(' '.join(args))
+
+def builtin_jobs(args):
+    list_jobs(detailed='-l' in args)
+
+def builtin_fg(args):
+    return bring_job_to_foreground(args[0] if args else None)
+
+def builtin_bg(args):
+    return resume_job_in_background(args[0] if args else None)
+
+def builtin_wait(args):
+    return wait_for_jobs(args)
+
+def builtin_kill(args):
+    if args and args[0] == '-l':
+        print(' '.join(sig.name[3:] for sig in signal.Signals))
+        return
+    sig = signal.SIGTERM
+    if args and args[0].startswith('-'):
+        name = args.pop(0)[1:]
+        if name == 's' and args:
+            name = args.pop(0)
+        try:
+            sig = int(name) if name.isdigit() else signal.Signals['SIG' + name.upper().removeprefix('SIG')]
+        except KeyError:
+            print(f"{RED}kill: invalid signal: {name}{RESET}", file=sys.stderr)
+            return 1
+    if not args:
+        print(f"{RED}kill: usage: kill [-SIGNAL] %job|pid ...{RESET}", file=sys.stderr)
+        return 1
+    status = 0
+    for target in args:
+        try:
+            if target.startswith('%'):
+                job = find_job(target)
+                if job is None or job.pgid is None:
+                    print(f"{RED}kill: {target}: no such job{RESET}", file=sys.stderr)
+                    status = 1
+                    continue
+                os.killpg(job.pgid, sig)
+            else:
+                os.kill(int(target), sig)
+        except ValueError:
+            print(f"{RED}kill: {target}: arguments must be process or job IDs{RESET}", file=sys.stderr)
+            status = 1
+        except ProcessLookupError:
+            print(f"{RED}kill: {target}: no such process{RESET}", file=sys.stderr)
+            status = 1
+    return status
+
+def builtin_hash(args):
+    import cmdhash
+    names = [arg for arg in args if not arg.startswith('-')]
+    if '-r' in args:
+        cmdhash.clear()
+    if '-s' in args:
+        print(f"hits: {cmdhash.counters['hits']}, misses: {cmdhash.counters['misses']}")
+    status = 0
+    for name in names:
+        if cmdhash.resolve(name) is None:
+            print(f"{RED}hash: {name}: not found{RESET}", file=sys.stderr)
+            status = 1
+    if not args:
+        entries = cmdhash.entries()
+        if not entries:
+            print("hash: hash table empty")
+            return
+        print("hits\tcommand")
+        for hits, name, path in entries:
+            print(f"{hits:>4}\t{path}")
+    return status
+
+def _read_line():
+    """Read one line of input without reading past it, so the rest stays for the next reader."""
+    from streams import stage_stdin
+    stdin = stage_stdin()
+    if stdin is not None:
+        return stdin.readline() or None
+    try:
+        os.lseek(0, 0, os.SEEK_CUR)
+        size = 4096
+    except OSError:
+        # Pipes and terminals cannot seek back, so they are read a byte at a time
+        size = 1
+    data = b''
+    while True:
+        chunk = os.read(0, size)
+        if not chunk:
+            return data.decode(errors='surrogateescape') if data else None
+        newline = chunk.find(b'\n')
+        if newline != -1:
+            if newline + 1 < len(chunk):
+                os.lseek(0, newline + 1 - len(chunk), os.SEEK_CUR)
+            return (data + chunk[:newline + 1]).decode(errors='surrogateescape')
+        data += chunk
+
+def builtin_read(args):
+    raw = False
+    args = list(args)
+    while args and args[0].startswith('-'):
+        arg = args.pop(0)
+        if arg == '-r':
+            raw = True
+        elif arg == '-p' and args:
+            sys.stderr.write(args.pop(0))
+            sys.stderr.flush()
+        else:
+            print(f"{RED}read: usage: read [-r] [-p prompt] [NAME ...]{RESET}", file=sys.stderr)
+            return 2
+    names = args or ['REPLY']
+    line = _read_line()
+    if line is None:
+        for name in names:
+            set_environment_variable(name, '')
+        return 1
+    line = line.rstrip('\n')
+    if not raw:
+        line = re.sub(r'\\(.)', r'\1', line)
+    if names == ['REPLY']:
+        set_environment_variable('REPLY', line)
+        return 0
+    fields = line.split(None, len(names) - 1)
+    for index, name in enumerate(names):
+        set_environment_variable(name, fields[index] if index < len(fields) else '')
+    return 0
+
+def builtin_source(args):
+    from scripts import execute_script
+    return execute_script(args[0])
+
+def builtin_prompt(args):
+    import prompt
+    if not args:
+        for segment in prompt.segments.values():
+            print(f"{segment.name} (timeout {segment.timeout}s)")
+        return
+    action = args[0]
+    if action == 'remove' and len(args) > 1:
+        if not prompt.remove_segment(args[1]):
+            print(f"{RED}prompt: no such segment: {args[1]}{RESET}", file=sys.stderr)
+            return 1
+        return
+    if action != 'add' or len(args) < 2:
+        print(f"{RED}prompt: usage: prompt [add NAME [-t SECONDS] [COMMAND...] | remove NAME]{RESET}", file=sys.stderr)
+        return 1
+    name = args[1]
+    rest = args[2:]
+    timeout = prompt.DEFAULT_TIMEOUT
+    if len(rest) >= 2 and rest[0] == '-t':
+        try:
+            timeout = float(rest[1])
+        except ValueError:
+            print(f"{RED}prompt: invalid timeout: {rest[1]}{RESET}", file=sys.stderr)
+            return 1
+        rest = rest[2:]
+    if rest:
+        prompt.add_segment(name, prompt.command_output(shlex.join(rest)), timeout)
+    elif name in prompt.BUILTIN_SEGMENTS:
+        compute, color = prompt.BUILTIN_SEGMENTS[name]
+        prompt.add_segment(name, compute, timeout, color)
+    else:
+        print(f"{RED}prompt: unknown segment '{name}'; give a command to run{RESET}", file=sys.stderr)
+        return 1
+
+def display_help():
+    """Display help information."""
+    lines = [f"\n{GREEN}Available commands:{RESET}"]
+    for builtin in BUILTINS.values():
+        if len(builtin.usage) < 17:
+            lines.append(f"  {CYAN}{builtin.usage:<17}{RESET}{builtin.summary}")
+        else:
+            lines.append(f"  {CYAN}{builtin.usage}{RESET}")
+            lines.append(f"                   {builtin.summary}")
+        if builtin.options:
+            lines.append("                   Options:")
+            for flag, description in builtin.options:
+                lines.append(f"                     {flag:<6}{description}")
+    lines.append("\nYou can also execute system commands and use pipelines and redirection.\n")
+    print('\n'.join(lines))
+
+def display_command_help(command_name):
+    """Display help for a specific command."""
+    builtin = BUILTINS.get(command_name)
+    if builtin is None:
+        print(f"No help available for '{command_name}'.")
+        return
+    lines = [f"Usage: {builtin.usage}", builtin.summary]
+    if builtin.options:
+        lines.append("Options:")
+        for flag, description in builtin.options:
+            lines.append(f"  {flag:<4}{description}")
+    print('\n'.join(lines))
+
+def builtin_time(args):
+    # Only reached for a quoted 'time'; the keyword itself is handled by the dispatcher
+    from shell import run_timed
+    from parser import compile_command
+    command_input = shlex.join(['time'] + list(args))
+    return run_timed(compile_command(command_input), command_input)
+
+def builtin_stats(args):
+    from shell import session_records
+    try:
+        count = int(args[args.index('-n') + 1]) if '-n' in args else 10
+    except (IndexError, ValueError):
+        print(f"{RED}stats: -n needs a number{RESET}", file=sys.stderr)
+        return 1
+    records = [record for record in session_records if record['path'] != 'time']
+    if not records:
+        print("No commands run yet.")
+        return 0
+    total = sum(record['wall_s'] for record in records)
+    paths = {}
+    for record in records:
+        paths[record['path']] = paths.get(record['path'], 0) + 1
+    by_path = ', '.join(f"{count} {path}" for path, count in sorted(paths.items(), key=lambda item: -item[1]))
+    print(f"{len(records)} commands ({by_path}), {total:.3f}s in total")
+    print(f"{CYAN}{'wall ms':>10} {'cpu ms':>10} {'status':>6}  {'path':<10} command{RESET}")
+    for record in sorted(records, key=lambda record: record['wall_s'], reverse=True)[:count]:
+        cpu = record['user_s'] + record['sys_s']
+        print(f"{record['wall_s'] * 1000:>10.1f} {cpu * 1000:>10.1f} {record['status']:>6}  "
+              f"{record['path'] or '-':<10} {record['command']}")
+    return 0
+
+def builtin_help(args):
+    if args:
+        display_command_help(args[0])
+    else:
+        display_help()
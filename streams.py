@@ -0,0 +1,316 @@
+# streams.py
+
+import io
+import os
+import sys
+import signal
+import logging
+import threading
+from collections import deque
+from constants import RED, RESET
+
+# Text a builtin writes is handed to the next stage in chunks of about this many characters
+CHUNK_SIZE = 64 * 1024
+# Chunks an in-process pipe holds before the writing stage waits for the reader
+PIPE_CHUNKS = 16
+
+class Pipe:
+    """An in-process pipe between two builtin stages.
+
+    The writer's text goes into a bounded queue of chunks that the reader
+    drains as a generator, so neither side forks and a fast writer waits for
+    a slow reader instead of filling memory. Closing the reading end makes
+    further writes raise BrokenPipeError, like a real pipe.
+    """
+
+    def __init__(self, capacity=PIPE_CHUNKS):
+        self.capacity = capacity
+        self._chunks = deque()
+        self._cond = threading.Condition()
+        self._writing = True
+        self._reading = True
+        self.reader = PipeReader(self)
+        self.writer = PipeWriter(self)
+
+    def put(self, text):
+        with self._cond:
+            while len(self._chunks) >= self.capacity and self._reading:
+                self._cond.wait()
+            if not self._reading:
+                raise BrokenPipeError(32, 'Broken pipe')
+            self._chunks.append(text)
+            self._cond.notify_all()
+
+    def chunks(self):
+        """Yield the written chunks in order until the writing end is closed."""
+        while True:
+            with self._cond:
+                while not self._chunks and self._writing:
+                    self._cond.wait()
+                if not self._chunks:
+                    return
+                chunk = self._chunks.popleft()
+                self._cond.notify_all()
+            yield chunk
+
+    def close_writer(self):
+        with self._cond:
+            self._writing = False
+            self._cond.notify_all()
+
+    def close_reader(self):
+        with self._cond:
+            self._reading = False
+            self._chunks.clear()
+            self._cond.notify_all()
+
+class PipeWriter(io.TextIOBase):
+    """The writing end of a Pipe, used as a builtin's sys.stdout."""
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+        self._pending = []
+        self._size = 0
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._pending.append(text)
+        self._size += len(text)
+        if self._size >= CHUNK_SIZE:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._pending:
+            text = ''.join(self._pending)
+            self._pending = []
+            self._size = 0
+            self._pipe.put(text)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.flush()
+            finally:
+                self._pipe.close_writer()
+                super().close()
+
+class PipeReader(io.TextIOBase):
+    """The reading end of a Pipe, used as a builtin's sys.stdin.
+
+    ``buffer`` gives the same data as bytes, for builtins that read binary input.
+    """
+
+    def __init__(self, pipe):
+        self._pipe = pipe
+        self._chunks = pipe.chunks()
+        self._rest = ''
+        self.buffer = _EncodedReader(self)
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def readable(self):
+        return True
+
+    def _fill(self):
+        """Append the next chunk to the unread text; return False at end of input."""
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        self._rest += chunk
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while self._fill():
+                pass
+            text, self._rest = self._rest, ''
+            return text
+        while len(self._rest) < size and self._fill():
+            pass
+        text, self._rest = self._rest[:size], self._rest[size:]
+        return text
+
+    def readline(self, size=-1):
+        while '\n' not in self._rest and self._fill():
+            pass
+        end = self._rest.find('\n') + 1 or len(self._rest)
+        if size is not None and 0 <= size < end:
+            end = size
+        line, self._rest = self._rest[:end], self._rest[end:]
+        return line
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def close(self):
+        if not self.closed:
+            self._pipe.close_reader()
+            super().close()
+
+class _EncodedReader:
+    """The bytes view of a PipeReader."""
+
+    def __init__(self, reader):
+        self._reader = reader
+
+    def read(self, size=-1):
+        return self._reader.read(size).encode('utf-8', 'surrogateescape')
+
+    def readline(self, size=-1):
+        return self._reader.readline(size).encode('utf-8', 'surrogateescape')
+
+# The stdin, stdout and stderr of the builtin stage running in each thread
+_local = threading.local()
+_routing = {'users': 0, 'saved': None}
+_routing_lock = threading.Lock()
+
+class _Routed:
+    """Stands in for sys.stdin, sys.stdout or sys.stderr while builtin stages run.
+
+    Each thread running a stage sees its own stream; every other thread,
+    including the REPL, keeps the original one.
+    """
+
+    def __init__(self, index, default):
+        self._index = index
+        self._default = default
+
+    def _target(self):
+        streams = getattr(_local, 'streams', None)
+        return self._default if streams is None else streams[self._index]
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def __iter__(self):
+        return iter(self._target())
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+def _start_routing():
+    with _routing_lock:
+        if _routing['users'] == 0:
+            _routing['saved'] = (sys.stdin, sys.stdout, sys.stderr)
+            sys.stdin, sys.stdout, sys.stderr = (_Routed(index, stream)
+                                                 for index, stream in enumerate(_routing['saved']))
+        _routing['users'] += 1
+
+def _stop_routing():
+    with _routing_lock:
+        _routing['users'] -= 1
+        if _routing['users'] == 0:
+            sys.stdin, sys.stdout, sys.stderr = _routing['saved']
+            _routing['saved'] = None
+
+def stage_stdin():
+    """The stdin of the builtin stage running in the calling thread, or None if it is the shell's own."""
+    streams = getattr(_local, 'streams', None)
+    if streams is None or streams[0] is _routing['saved'][0]:
+        return None
+    return streams[0]
+
+def _own_streams():
+    """The streams of the calling thread: its stage's, or the shell's own."""
+    streams = getattr(_local, 'streams', None)
+    if streams is not None:
+        return streams
+    return _routing['saved'] or (sys.stdin, sys.stdout, sys.stderr)
+
+def stage_streams(fds):
+    """Turn the fd map of a builtin stage into its (stdin, stdout, stderr) and the files it owns.
+
+    The caller's own 0, 1 and 2 are used as they are, and so are Pipe ends.
+    Other descriptors are duplicated into new files, so the caller can close
+    its copies as it does for external stages; a descriptor closed with '>&-'
+    reads and writes nothing.
+    """
+    own = _own_streams()
+    files = {}
+    streams = []
+    owned = []
+    for target in (0, 1, 2):
+        value = fds[target]
+        if isinstance(value, (PipeReader, PipeWriter)):
+            streams.append(value)
+            owned.append(value)
+        elif value in (0, 1, 2):
+            streams.append(own[value])
+        else:
+            if value not in files:
+                mode = 'r' if target == 0 else 'w'
+                if value is None:
+                    files[value] = open(os.devnull, mode, encoding='utf-8')
+                else:
+                    files[value] = open(os.dup(value), mode, encoding='utf-8', errors='surrogateescape')
+                owned.append(files[value])
+            streams.append(files[value])
+    return streams, owned
+
+class BuiltinStage:
+    """A builtin running as one stage of a pipeline, in a thread of its own."""
+
+    def __init__(self, builtin, args, streams, owned):
+        self.builtin = builtin
+        self.args = args
+        self.streams = streams
+        self.owned = owned
+        self.status = None
+        self._thread = None
+
+    def start(self):
+        _start_routing()
+        self._thread = threading.Thread(target=self._run, name=f"builtin-{self.builtin.name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        _local.streams = self.streams
+        try:
+            self.status = self.builtin.run(self.args)
+        except BrokenPipeError:
+            self.status = 128 + signal.SIGPIPE
+        except SystemExit as e:
+            # 'exit' in a pipeline ends its stage, not the shell
+            self.status = e.code if isinstance(e.code, int) else 0
+        except Exception as e:
+            logging.error(f"{self.builtin.name}: Error: {e}", exc_info=True)
+            print(f"{RED}{self.builtin.name}: Error: {e}{RESET}", file=sys.stderr)
+            self.status = 1
+        finally:
+            self.close()
+            _local.streams = None
+            _stop_routing()
+
+    def close(self):
+        """Close the stage's ends, so the next stage sees EOF and the previous one EPIPE."""
+        for stream in self.streams[1:]:
+            if stream not in self.owned:
+                # Output shared with other stages must be out before theirs
+                try:
+                    stream.flush()
+                except (OSError, ValueError):
+                    pass
+        for stream in self.owned:
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    def wait(self):
+        self._thread.join()
+        return self.status
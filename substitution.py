@@ -0,0 +1,222 @@
+# substitution.py
+
+import os
+import sys
+import logging
+import shlex
+from collections import deque
+from constants import RED, RESET
+from parser import CommandList, ParseError, parse_list, skip_backticks, skip_substitution, tokenize, WORD
+import expansion
+
+# Size of the reads from a substitution's output pipe
+CHUNK_SIZE = 64 * 1024
+# Subshells of one line's substitutions running at once; the others start as these finish
+MAX_SUBSHELLS = 8
+
+def _echo(args):
+    return ' '.join(args)
+
+def _pwd(args):
+    return os.getcwd()
+
+# Exit status of the last substitution, which is also that of a command made only of assignments
+last_substitution = {'status': 0}
+
+# Builtins cheap and side-effect free enough to answer without forking
+INPROCESS_BUILTINS = {
+    'echo': _echo,
+    'pwd': _pwd,
+}
+
+def find_substitutions(line):
+    """Scan a line once and return (start, end, command, quoted) for each top-level substitution.
+
+    Nested substitutions stay inside ``command`` and are expanded when that
+    command runs. Text in single quotes and arithmetic '$((...))' is skipped.
+    """
+    found = []
+    n = len(line)
+    i = 0
+    in_double = False
+    while i < n:
+        c = line[i]
+        if c == '\\':
+            i += 2
+        elif c == "'" and not in_double:
+            end = line.find("'", i + 1)
+            if end == -1:
+                raise ParseError("unterminated single quote")
+            i = end + 1
+        elif c == '"':
+            in_double = not in_double
+            i += 1
+        elif c == '$' and line.startswith('$(', i):
+            end = skip_substitution(line, i)
+            if not line.startswith('$((', i):
+                found.append((i, end, line[i + 2:end - 1], in_double))
+            i = end
+        elif c == '`':
+            end = skip_backticks(line, i)
+            command = line[i + 1:end - 1].replace('\\`', '`').replace('\\$', '$').replace('\\\\', '\\')
+            found.append((i, end, command, in_double))
+            i = end
+        else:
+            i += 1
+    return found
+
+def _inprocess(command):
+    """Return the output of a lone echo or pwd without forking, or None for any other command."""
+    words = command.split(None, 1)
+    if not words or words[0] not in INPROCESS_BUILTINS:
+        return None
+    try:
+        pipeline = parse_list(command)
+    except ParseError:
+        return None
+    if isinstance(pipeline, CommandList) or len(pipeline.commands) != 1:
+        return None
+    first = pipeline.commands[0]
+    if first.redirects or first.assignments or pipeline.background or pipeline.negated:
+        return None
+    argv = expand_command(first)
+    builtin = INPROCESS_BUILTINS.get(argv[0]) if argv else None
+    return None if builtin is None else builtin(argv[1:])
+
+def _subshell(command):
+    # Runs in the forked child
+    from interpreter import run_source
+    try:
+        return run_source(command)
+    except ParseError as e:
+        print(f"{RED}Error in command substitution: {e}{RESET}", file=sys.stderr)
+        return 2
+
+def start_substitution(command):
+    """Start a command in a subshell with its stdout on a pipe; return (job, read end of the pipe)."""
+    # commands imports this module for word expansion
+    from commands import fork_shell
+    from jobs import Job, add_process
+    read_fd, write_fd = os.pipe()
+    try:
+        pid = fork_shell(lambda: _subshell(command), {0: 0, 1: write_fd, 2: 2})
+    except OSError:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    job = Job(command)
+    add_process(job, pid)
+    return job, read_fd
+
+def finish_substitution(job, read_fd):
+    """Read a started substitution's output to EOF and wait for it; return (output, exit status)."""
+    from jobs import wait_for
+    chunks = []
+    try:
+        while True:
+            chunk = os.read(read_fd, CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        os.close(read_fd)
+    status = wait_for(job)
+    return b''.join(chunks).decode(errors='replace').rstrip('\n'), status
+
+def run_substitution(command):
+    """Run one substituted command and return its output without trailing newlines.
+
+    The command runs in a subshell, a forked copy of the shell, so that
+    'cd', assignments and other changes it makes do not reach the shell.
+    """
+    output = _inprocess(command)
+    if output is not None:
+        return output.rstrip('\n')
+    return finish_substitution(*start_substitution(command))[0]
+
+def _collect(running, outputs, statuses):
+    """Finish a started substitution, storing its output and status at its index."""
+    index, started = running
+    try:
+        outputs[index], statuses[index] = finish_substitution(*started)
+    except Exception as e:
+        _report(e)
+
+def _quote_output(output, quoted):
+    """Make substituted text safe to splice back into the command line."""
+    if quoted:
+        for char in '\\"$`':
+            output = output.replace(char, '\\' + char)
+        return output
+    # Unquoted output is split into words, which must not be re-read as syntax
+    return ' '.join(shlex.quote(field) for field in output.split())
+
+def _report(e):
+    logging.error(f"Error in command substitution: {e}", exc_info=True)
+    print(f"{RED}Error in command substitution: {e}{RESET}", file=sys.stderr)
+
+def substitute_commands(command_input):
+    """Substitute commands enclosed in backticks or $().
+
+    The line is scanned once. Each substitution runs in its own subshell.
+    Up to MAX_SUBSHELLS of them run at once, and the next starts as soon as
+    the oldest is read, so a line with several slow substitutions costs
+    about the slowest one, not their sum.
+    """
+    if '$(' not in command_input and '`' not in command_input:
+        return command_input
+    try:
+        found = find_substitutions(command_input)
+    except ParseError as e:
+        print(f"{RED}Error in command substitution: {e}{RESET}", file=sys.stderr)
+        return command_input
+    if not found:
+        return command_input
+    outputs = [''] * len(found)
+    statuses = [1] * len(found)
+    running = deque()
+    for index, (_, _, command, _) in enumerate(found):
+        try:
+            output = _inprocess(command)
+            if output is not None:
+                outputs[index], statuses[index] = output.rstrip('\n'), 0
+                continue
+            if len(running) >= MAX_SUBSHELLS:
+                _collect(running.popleft(), outputs, statuses)
+            running.append((index, start_substitution(command)))
+        except Exception as e:
+            _report(e)
+    while running:
+        _collect(running.popleft(), outputs, statuses)
+    last_substitution['status'] = statuses[-1]
+    pieces = []
+    position = 0
+    for (start, end, _, quoted), output in zip(found, outputs):
+        pieces.append(command_input[position:start])
+        pieces.append(_quote_output(output, quoted))
+        position = end
+    pieces.append(command_input[position:])
+    return ''.join(pieces)
+
+def expand_words(words):
+    """Expand raw words into the final argument list.
+
+    All command substitutions of the command are resolved in a single pass;
+    the words that result then go through brace, tilde, parameter,
+    arithmetic and pathname expansion, and quote removal.
+    """
+    line = ' '.join(words)
+    if '$(' in line or '`' in line:
+        words = [value for kind, value in tokenize(substitute_commands(line)) if kind == WORD]
+    return expansion.expand_words(words)
+
+def expand_word(word):
+    """Expand a raw word that must stay a single string, such as an assignment value."""
+    return expansion.expand_string(substitute_commands(word))
+
+def expand_command(command):
+    """Return the argument list of a parsed Command, expanding it only when needed."""
+    if command.argv is not None:
+        return command.argv
+    return expand_words(command.words)
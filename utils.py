@@ -1,36 +1,44 @@
 # utils.py
 
 import os
-import getpass
-import socket
-import readline
-import shlex
-import glob
-from constants import GREEN, BLUE, RESET, YELLOW, command_options
+from constants import RESET, YELLOW
 
 def confirm(prompt):
     """Prompt the user for confirmation."""
     answer = input(f"{YELLOW}{prompt} [y/N]: {RESET}")
     return answer.lower() == 'y'
 
-def get_prompt():
-    """Generate the command prompt."""
-    username = getpass.getuser()
-    hostname = socket.gethostname()
-    current_dir = os.getcwd()
-    return f"{GREEN}{username}@{hostname}{RESET}:{BLUE}{current_dir}{RESET}$ "
+def write_atomically(path, write):
+    """Write a file by calling write() on a temporary one, then renaming it over path.
+
+    Concurrent shells never read a half-written file. The directory is
+    created if needed; OSError is left to the caller.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
 def setup_autocomplete(autocomplete_function):
     """Set up autocompletion using the readline module."""
+    import readline
     readline.parse_and_bind("tab: complete")
+    # Complete whole words such as 'src/main.py' or '-l', not the pieces between '/' and '-'
+    readline.set_completer_delims(' \t\n;|&<>')
     readline.set_completer(autocomplete_function)
 
-def load_configuration(process_command):
-    """Load shell configuration from ~/.custom_shellrc."""
-    config_file = os.path.expanduser('~/.custom_shellrc')
-    if os.path.isfile(config_file):
-        with open(config_file, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    process_command(line)
+def load_configuration():
+    """Load shell configuration from ~/.custom_shellrc, from its cached snapshot when unchanged.
+
+    Returns 'snapshot', 'executed' or None when there is no rc file.
+    """
+    from rcfile import load_rc
+    return load_rc()
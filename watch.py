@@ -0,0 +1,406 @@
+# watch.py
+
+import os
+import sys
+import time
+import errno
+import select
+import shlex
+import struct
+import logging
+from constants import RED, GREEN, CYAN, RESET
+
+# Seconds between runs in periodic mode
+DEFAULT_INTERVAL = 2.0
+# Quiet time, in seconds, that ends a burst of file events
+DEFAULT_DEBOUNCE = 0.1
+# Longest a burst of events may hold back a run, in seconds
+MAX_SETTLE = 2.0
+# Seconds between scans when inotify is not available
+POLL_INTERVAL = 0.5
+
+# inotify(7) flags
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT_HEADER = struct.Struct('iIII')
+# Room for a few hundred events per read
+READ_SIZE = 64 * 1024
+
+class WatchError(Exception):
+    """Raised when the paths of 'watch -e' cannot be watched."""
+
+def _excluded(name, excludes):
+    from expansion import match_pattern
+    return any(match_pattern(pattern, name) for pattern in excludes)
+
+def _directories(root, excludes):
+    """Yield root and every directory below it, skipping hidden and excluded ones like '**'."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        yield directory
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if (not entry.name.startswith('.') and not _excluded(entry.name, excludes)
+                            and entry.is_dir(follow_symlinks=False)):
+                        stack.append(entry.path)
+        except OSError:
+            continue
+
+def _targets(paths):
+    """Split the watched paths into directories (watched recursively) and files by parent."""
+    directories = []
+    files = {}
+    for path in paths:
+        if os.path.isdir(path):
+            directories.append(path)
+        elif os.path.exists(path):
+            parent, name = os.path.split(os.path.abspath(path))
+            files.setdefault(parent, set()).add(name)
+        else:
+            raise WatchError(f"{path}: No such file or directory")
+    return directories, files
+
+class InotifyWatcher:
+    """Wait for changes under a set of paths with Linux inotify, called through ctypes.
+
+    Directories are watched recursively: one watch per directory, added as
+    new directories appear; hidden entries are ignored, as by '**'. A file
+    is watched through its parent directory, so editors that save by
+    renaming a new file over it are still seen.
+    """
+
+    def __init__(self, paths, excludes=()):
+        import ctypes
+        self.excludes = excludes
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        # Watch descriptor -> (directory, names of the files wanted in it, or None for all)
+        self.watches = {}
+        try:
+            directories, files = _targets(paths)
+            for root in directories:
+                for directory in _directories(root, excludes):
+                    self._add(directory, None)
+            for parent, names in files.items():
+                self._add(parent, names)
+        except BaseException:
+            self.close()
+            raise
+
+    def _add(self, directory, names):
+        import ctypes
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise OSError(error, f"{directory}: {os.strerror(error)}")
+        previous = self.watches.get(wd)
+        if previous is not None and (previous[1] is None or names is None):
+            names = None
+        elif previous is not None:
+            names = previous[1] | names
+        self.watches[wd] = (directory, names)
+
+    def _read(self):
+        """Read the pending events and return the changed paths."""
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, size = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + size].rstrip(b'\0'))
+                offset += size
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost: something changed, but not known what
+                    changed.add('')
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                watch = self.watches.get(wd)
+                if watch is None:
+                    continue
+                directory, names = watch
+                if names is not None and name not in names:
+                    continue
+                if name and names is None and (name.startswith('.') or _excluded(name, self.excludes)):
+                    continue
+                path = os.path.join(directory, name) if name else directory
+                if names is None and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    for new in _directories(path, self.excludes):
+                        self._add(new, None)
+                changed.add(path)
+
+    def wait(self, timeout=None):
+        """Block until something changes, or the timeout (seconds) passes; return the changed paths."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        return self._read() if readable else set()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class PollingWatcher:
+    """Wait for changes by comparing scans of the paths, where inotify is not available."""
+
+    def __init__(self, paths, excludes=(), interval=POLL_INTERVAL):
+        self.excludes = excludes
+        self.interval = interval
+        self.directories, self.files = _targets(paths)
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for root in self.directories:
+            for directory in _directories(root, self.excludes):
+                try:
+                    with os.scandir(directory) as entries:
+                        for entry in entries:
+                            if entry.name.startswith('.') or _excluded(entry.name, self.excludes):
+                                continue
+                            try:
+                                info = entry.stat(follow_symlinks=False)
+                            except OSError:
+                                continue
+                            snapshot[entry.path] = (info.st_mtime_ns, info.st_size, info.st_ino)
+                except OSError:
+                    continue
+        for parent, names in self.files.items():
+            for name in names:
+                path = os.path.join(parent, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (info.st_mtime_ns, info.st_size, info.st_ino)
+        return snapshot
+
+    def wait(self, timeout=None):
+        """Scan every interval until something changes or the timeout passes; return the changed paths."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, deadline - time.monotonic())
+            if delay > 0:
+                time.sleep(delay)
+            snapshot = self._scan()
+            changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def close(self):
+        pass
+
+def open_watcher(paths, excludes=(), polling=False):
+    """Return an inotify watcher for the paths, or a polling one if inotify cannot be used."""
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths, excludes)
+        except (OSError, AttributeError) as e:
+            # Out of watches (ENOSPC), no inotify in this libc, ...: scanning still works
+            logging.error(f"watch: inotify unavailable, polling instead: {e}")
+    return PollingWatcher(paths, excludes)
+
+def wait_for_changes(watcher, debounce):
+    """Block until a burst of changes is over and return the changed paths.
+
+    The burst ends after ``debounce`` seconds without events, or MAX_SETTLE
+    seconds after it began, so a file written continuously still triggers runs.
+    """
+    changed = watcher.wait()
+    while not changed:
+        changed = watcher.wait()
+    settle = time.monotonic() + MAX_SETTLE
+    while True:
+        remaining = settle - time.monotonic()
+        if remaining <= 0:
+            return changed
+        more = watcher.wait(min(debounce, remaining))
+        if not more:
+            return changed
+        changed |= more
+
+def run_command(command):
+    """Run a command line with the interpreter and return its exit status."""
+    from interpreter import run_source
+    from parser import ParseError
+    try:
+        return run_source(command)
+    except ParseError as e:
+        print(f"{RED}watch: {e}{RESET}", file=sys.stderr)
+        return 2
+
+def run_captured(command):
+    """Run a command line in a subshell with its stdout on a pipe; return the output bytes and exit status.
+
+    Only the subshell's descriptors change, so this works wherever watch
+    itself writes, including a pipe to a later stage.
+    """
+    from commands import fork_shell
+    from jobs import Job, add_process, wait_for
+    read_fd, write_fd = os.pipe()
+    try:
+        pid = fork_shell(lambda: run_command(command), {0: 0, 1: write_fd, 2: 2})
+    except OSError:
+        os.close(read_fd)
+        raise
+    finally:
+        os.close(write_fd)
+    job = Job(command)
+    add_process(job, pid)
+    with open(read_fd, 'rb') as output:
+        data = output.read()
+    return data, wait_for(job)
+
+def _changes(previous, current):
+    """Return the lines of a line diff between two outputs, colored, without context."""
+    import difflib
+    lines = []
+    for line in difflib.unified_diff(previous.splitlines(), current.splitlines(), n=0, lineterm=''):
+        if line.startswith(('---', '+++', '@@')):
+            continue
+        color = GREEN if line.startswith('+') else RED
+        lines.append(f"{color}{line}{RESET}")
+    return lines
+
+def watch_periodic(command, interval, count=None):
+    """Run the command every interval seconds and print its output, then only the lines that changed."""
+    previous = None
+    previous_status = None
+    runs = 0
+    next_run = time.monotonic()
+    while True:
+        output, status = run_captured(command)
+        output = output.decode(errors='replace')
+        stamp = time.strftime('%H:%M:%S')
+        if previous is None:
+            print(f"{CYAN}Every {interval:g}s: {command}  {stamp}{RESET}")
+            sys.stdout.write(output)
+        elif output != previous or status != previous_status:
+            note = f"  (exit {status})" if status != previous_status else ''
+            print(f"{CYAN}{stamp}{note}{RESET}")
+            for line in _changes(previous, output):
+                print(line)
+        sys.stdout.flush()
+        previous, previous_status = output, status
+        runs += 1
+        if count is not None and runs >= count:
+            return status
+        # Runs keep to a fixed rate; one that overran its slot is followed at once
+        next_run = max(next_run + interval, time.monotonic())
+        time.sleep(next_run - time.monotonic())
+
+def watch_events(command, paths, excludes=(), debounce=DEFAULT_DEBOUNCE, count=None, polling=False):
+    """Run the command once, then again each time files under the paths change.
+
+    Changes made while the command runs are not lost and do not pile up:
+    they are read once it finishes and trigger a single rerun.
+    """
+    watcher = open_watcher(paths, excludes, polling)
+    try:
+        status = run_command(command)
+        runs = 1
+        while count is None or runs < count:
+            changed = wait_for_changes(watcher, debounce)
+            shown = sorted(path for path in changed if path)
+            more = f" (+{len(shown) - 1} more)" if len(shown) > 1 else ''
+            print(f"{CYAN}watch: {shown[0] if shown else 'changes'}{more} changed, running {command}{RESET}",
+                  file=sys.stderr)
+            status = run_command(command)
+            runs += 1
+        return status
+    finally:
+        watcher.close()
+
+def _number(option, value, convert=float):
+    try:
+        number = convert(value)
+    except (TypeError, ValueError):
+        raise WatchError(f"{option} needs a number, not '{value}'")
+    if number < 0 or (convert is int and number == 0):
+        raise WatchError(f"{option} needs a positive number, not '{value}'")
+    return number
+
+def _parse_args(args):
+    options = {'interval': DEFAULT_INTERVAL, 'debounce': DEFAULT_DEBOUNCE, 'count': None,
+               'paths': [], 'excludes': [], 'polling': False}
+    separated = '--' in args
+    args = list(args)
+    while args and args[0].startswith('-'):
+        arg = args.pop(0)
+        if arg == '--':
+            break
+        value = args[0] if args else None
+        if arg in ('-n', '--interval'):
+            options['interval'] = max(_number(arg, value), 0.1)
+            args.pop(0)
+        elif arg in ('-c', '--count'):
+            options['count'] = _number(arg, value, int)
+            args.pop(0)
+        elif arg == '--debounce':
+            options['debounce'] = _number(arg, value)
+            args.pop(0)
+        elif arg in ('-x', '--exclude') and value is not None:
+            options['excludes'].append(args.pop(0))
+        elif arg == '--poll':
+            options['polling'] = True
+        elif arg in ('-e', '--events'):
+            # Paths up to the next option or '--'
+            while args and not args[0].startswith('-'):
+                options['paths'].append(args.pop(0))
+            if not options['paths']:
+                raise WatchError('-e needs at least one path')
+        else:
+            raise WatchError(f"unknown option '{arg}'")
+    if not args and len(options['paths']) > 1 and not separated:
+        # 'watch -e PATH... command' with a one-word command and no '--'
+        args = [options['paths'].pop()]
+    if not args:
+        raise WatchError('missing command')
+    # One argument is a command line, as in 'watch "ls | wc -l"'; several are
+    # words already expanded by the shell, quoted so they are not expanded again
+    options['command'] = args[0] if len(args) == 1 else shlex.join(args)
+    return options
+
+def builtin_watch(args):
+    try:
+        options = _parse_args(args)
+        if options['paths']:
+            return watch_events(options['command'], options['paths'], options['excludes'],
+                                options['debounce'], options['count'], options['polling'])
+        return watch_periodic(options['command'], options['interval'], options['count'])
+    except WatchError as e:
+        print(f"{RED}watch: {e}{RESET}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        logging.error(f"watch: {e}", exc_info=True)
+        print(f"{RED}watch: {e}{RESET}", file=sys.stderr)
+        return 1